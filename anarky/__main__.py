@@ -0,0 +1,15 @@
+# -*- coding: utf8 -*-
+
+"""
+Runs the 'anarky' program with 'python -m anarky'.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+import sys
+
+from anarky.scripts.main import run
+
+if __name__ == '__main__':
+    sys.exit(run())
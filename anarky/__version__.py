@@ -22,4 +22,4 @@ __description__ = 'Encodes and decodes between several types of audio files.'
 __license__ = 'MIT'
 __title__ = 'anarky'
 __url__ = 'https://github.com/MulberryBeacon/anarky'
-__version__ = '0.0.4'
+__version__ = '0.0.5'
@@ -6,3 +6,342 @@ API to run encoding and decoding operations.
 Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
+
+from concurrent.futures import Future
+from os.path import isdir
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, NamedTuple, Optional, \
+    Sequence, Tuple
+
+from anarky.audio.decode import decode_flac_wav, decode_flac_wav_async, \
+    FLAC_ARGUMENTS as DECODE_ARGUMENTS
+from anarky.audio.encode import encode_flac_mp3, encode_flac_mp3_async, encode_wav_flac, \
+    encode_wav_flac_async, encode_wav_mp3, encode_wav_mp3_async
+from anarky.audio.fanout import fan_out, get_targets_programs, Target
+from anarky.enum.audio_file import AudioFile
+from anarky.enum.program import Program
+from anarky.enum.script import Script
+from anarky.manifest import Manifest
+from anarky.metadata import get_cover_cache
+from anarky.planner import plan_jobs
+from anarky.profile import DEFAULT_PROFILE, get_profile, Profile, ProfileSelector
+from anarky.process import iter_blocking, run_bounded
+from anarky.programs import ERROR_PROGRAMS, get_missing_programs
+from anarky.scheduler import Result, Scheduler
+from anarky.scratch import Scratch
+from anarky.utils import ERROR_UNAVAILABLE, walk_files
+
+ERROR_CONVERSION = "Conversion '{}' is not available (expected one of: {})!"
+
+
+class ConversionError(Exception):
+    """
+    Error raised when a conversion can't be set up.
+    """
+
+
+class Conversion(NamedTuple):
+    """
+    Conversion between two types of audio files.
+
+    The arguments are the encoder settings of a given profile, which are recorded in the manifest.
+    Conversions that don't encode (e.g. decoding into WAV) ignore the profiles. The coroutine
+    function is the asynchronous version of the conversion function (used by 'Engine').
+    """
+    function: Callable
+    programs: Tuple[Program, ...]
+    arguments: Callable[[Profile], List[str]]
+    extension: str
+    profiled: bool = True
+    coroutine: Optional[Callable] = None
+
+    def job(self, selector: ProfileSelector, asynchronous: bool = False) -> Callable:
+        """
+        Binds the conversion function to the profile selected for each file.
+
+        :param selector:
+            The selector of the profile of each file
+        :param asynchronous:
+            Flag that indicates if the coroutine function is bound instead
+        :return:
+            The conversion function (or coroutine function), which takes the input file name and
+            the destination
+        """
+        function = self.coroutine if asynchronous else self.function
+        if not self.profiled:
+            return function
+
+        def convert(filename: str, destination: str):
+            return function(filename, destination, profile=selector.select(filename))
+
+        return convert
+
+    def settings(self, selector: ProfileSelector) -> Callable[[str], str]:
+        """
+        Binds the encoder settings to the profile selected for each file.
+
+        :param selector:
+            The selector of the profile of each file
+        :return:
+            The function that retrieves the encoder settings of an input file
+        """
+        return lambda filename: ' '.join(self.arguments(selector.select(filename)))
+
+
+CONVERSIONS = {
+    Script.FLAC2MP3.value: Conversion(encode_flac_mp3, (Program.FLAC, Program.LAME),
+                                      Profile.lame_arguments, AudioFile.FLAC.value,
+                                      coroutine=encode_flac_mp3_async),
+    Script.FLAC2WAV.value: Conversion(decode_flac_wav, (Program.FLAC,),
+                                      lambda profile: DECODE_ARGUMENTS, AudioFile.FLAC.value,
+                                      profiled=False, coroutine=decode_flac_wav_async),
+    Script.WAV2FLAC.value: Conversion(encode_wav_flac, (Program.FLAC,), Profile.flac_arguments,
+                                      AudioFile.WAV.value, coroutine=encode_wav_flac_async),
+    Script.WAV2MP3.value: Conversion(encode_wav_mp3, (Program.LAME,), Profile.lame_arguments,
+                                     AudioFile.WAV.value, coroutine=encode_wav_mp3_async)
+}
+
+
+def fan_out_conversion(targets: Sequence[Target]) -> Conversion:
+    """
+    Builds the conversion that decodes each FLAC audio file once and encodes it into several
+    targets at the same time (see 'fan_out').
+
+    The output of the first target is the one reported in the results; the outputs of every
+    target are recorded in the manifest and the journal, so a file is only skipped while all of
+    them are still there. The outputs of the other targets are stored next to the first one, in
+    their own subdirectories of the destination.
+
+    :param targets:
+        The targets
+    :return:
+        The conversion
+    """
+    def convert(filename: str, destination: str,
+                profile: Profile = DEFAULT_PROFILE) -> List[str]:
+        return [str(output) for output in fan_out(filename, destination, targets, profile)]
+
+    return Conversion(convert, tuple(get_targets_programs(targets)),
+                      lambda profile: [argument for target in targets
+                                       for argument in target.arguments(profile)],
+                      AudioFile.FLAC.value)
+
+
+class Converter:
+    """
+    Converts batches of audio files in the current process.
+
+    The pool of workers is kept alive between batches, so a long running service can keep a
+    single converter for as many batches as it needs. Errors are raised as exceptions when the
+    converter is created and reported in the results of each file afterwards; the process is never
+    terminated.
+
+    Example::
+
+        with Converter('flac2mp3', '/srv/mp3', jobs=8) as converter:
+            for result in converter.convert(['/srv/flac/album', '/srv/flac/song.flac']):
+                print(result.filename, result.output, result.error)
+    """
+
+    def __init__(self, conversion: str, destination: str, jobs: int = None,
+                 incremental: bool = False, profile: str = None, scratch: str = None,
+                 scratch_budget: int = None):
+        """
+        :param conversion:
+            The name of the conversion (e.g. 'flac2mp3')
+        :param destination:
+            The destination where the output files will be stored
+        :param jobs:
+            The maximum number of files converted at the same time (defaults to the processor
+            count)
+        :param incremental:
+            Flag that indicates if the files whose output is up to date are skipped
+        :param profile:
+            The name of the encoder profile used for every file (by default, the profile is
+            selected by the '.anarky-profile' files of the input directories)
+        :param scratch:
+            The directory (on a fast local file system, e.g. '/dev/shm') where the intermediate
+            and output files are written before the outputs are moved to the destination (by
+            default, they're written straight into the destination)
+        :param scratch_budget:
+            The maximum number of bytes of scratch space used at the same time (see 'Scratch')
+        :raise ConversionError:
+            If the conversion, the profile, the destination or the required external programs
+            aren't available
+        """
+        if conversion not in CONVERSIONS:
+            raise ConversionError(ERROR_CONVERSION.format(conversion, ', '.join(CONVERSIONS)))
+        for directory in (destination, scratch):
+            if directory is not None and not isdir(directory):
+                raise ConversionError(ERROR_UNAVAILABLE.format('Directory', directory))
+
+        self.conversion = CONVERSIONS[conversion]
+        try:
+            self.selector = ProfileSelector(get_profile(profile) if profile else None)
+        except ValueError as e:
+            raise ConversionError(str(e))
+        self.function = self.conversion.job(self.selector)
+        missing = get_missing_programs(self.conversion.programs)
+        if missing:
+            raise ConversionError(ERROR_PROGRAMS.format(', '.join(missing)))
+
+        self.scratch = None
+        if scratch is not None:
+            self.scratch = Scratch(scratch, scratch_budget)
+            self.function = self.scratch.track(self.function)
+
+        self.destination = str(destination)
+        self.plan = None
+        self.manifest = None
+        if incremental:
+            self.manifest = Manifest(self.destination, conversion,
+                                     self.conversion.settings(self.selector))
+        self._scheduler = Scheduler(jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        from asyncio import get_event_loop
+
+        await get_event_loop().run_in_executor(None, self.close)
+
+    @property
+    def jobs(self) -> int:
+        """
+        Retrieves the maximum number of files converted at the same time.
+
+        :return:
+            The number of workers
+        """
+        return self._scheduler.jobs
+
+    def close(self):
+        """
+        Waits for the running conversions, saves the manifest and releases the workers.
+        """
+        self._scheduler.close()
+        self.save()
+        if self.scratch is not None:
+            self.scratch.close()
+
+    def save(self):
+        """
+        Saves the manifest of conversions (in incremental mode).
+        """
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def files(self, paths: Iterable[str]) -> Iterator[str]:
+        """
+        Lazily expands the given paths into the input audio files.
+
+        :param paths:
+            The input audio file names and directories (where the files with the input extension
+            of the conversion are looked up)
+        :return:
+            The input audio file names
+        """
+        for path in paths:
+            if isdir(path):
+                yield from walk_files(str(path), [self.conversion.extension])
+            else:
+                yield str(path)
+
+    def convert(self, paths: Iterable[str], plan: bool = False) -> Iterator[Result]:
+        """
+        Converts a batch of audio files.
+
+        :param paths:
+            The input audio file names and directories
+        :param plan:
+            Flag that indicates if the longest files are converted first (every file is listed
+            before the first one is converted; see 'plan_jobs'). The plan is kept in the 'plan'
+            attribute, whose 'report' compares the predicted and actual time of the batch
+        :return:
+            The outcome of each conversion, as soon as it finishes
+        """
+        files = self.files(paths)
+        function = self.function
+        if plan:
+            self.plan = plan_jobs(files, self.jobs)
+            files = self.plan
+            function = self.plan.track(function)
+        try:
+            with get_cover_cache():
+                yield from self._scheduler.run(function, files, self.destination,
+                                               self.manifest)
+        finally:
+            self.save()
+
+    def convert_all(self, paths: Iterable[str], plan: bool = False) -> List[Result]:
+        """
+        Converts a batch of audio files and waits for all of them.
+
+        :param paths:
+            The input audio file names and directories
+        :param plan:
+            Flag that indicates if the longest files are converted first
+        :return:
+            The outcome of each conversion, in order of completion
+        """
+        return list(self.convert(paths, plan))
+
+    def start(self, path: str) -> Future:
+        """
+        Starts the conversion of a single audio file on the pool of workers.
+
+        :param path:
+            The input audio file name
+        :return:
+            The future outcome of the conversion
+        """
+        # The cover art pictures of the job are kept until it finishes (see 'CoverCache')
+        covers = get_cover_cache()
+        covers.acquire()
+        try:
+            future = self._scheduler.submit(self.function, str(path), self.destination,
+                                            self.manifest)
+        except BaseException:
+            covers.release()
+            raise
+        future.add_done_callback(lambda future: covers.release())
+        return future
+
+    async def submit(self, path: str) -> Result:
+        """
+        Converts a single audio file without blocking the event loop.
+
+        :param path:
+            The input audio file name
+        :return:
+            The outcome of the conversion
+        """
+        from asyncio import wrap_future
+
+        return await wrap_future(self.start(path))
+
+    async def convert_async(self, paths: Iterable[str]) -> AsyncIterator[Result]:
+        """
+        Converts a batch of audio files without blocking the event loop.
+
+        The input files are listed lazily (off the event loop) and only a couple of conversions per
+        worker are submitted ahead of the running ones (see 'run_bounded').
+
+        :param paths:
+            The input audio file names and directories
+        :return:
+            The outcome of each conversion, as soon as it finishes
+        """
+        try:
+            with get_cover_cache():
+                jobs = (self.submit(path) async for path in iter_blocking(self.files(paths)))
+                async for result in run_bounded(jobs, self.jobs * 2):
+                    yield result
+        finally:
+            self.save()
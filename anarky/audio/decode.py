@@ -7,22 +7,62 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
-from subprocess import call
+from typing import List
 
 from anarky.enum.program import Program
 from anarky.enum.audio_file import AudioFile
-from anarky.utils import update_path
+from anarky.process import run_process, run_process_async
+from anarky.programs import get_program
+from anarky.stats import stage
+from anarky.utils import atomic_output, update_path
 
+# Arguments of the 'flac' program used in the FLAC decoding operation
+FLAC_ARGUMENTS = ['-df']
 
-def decode_flac_wav(filename: str, destination: str) -> str:
+
+def flac_wav_command(filename: str, output_filename: str) -> List[str]:
     """
-    Decodes a FLAC audio file, generating the corresponding WAV audio file.
+    Builds the command that decodes a FLAC audio file into a WAV audio file.
 
     The 'flac' program is executed with the following arguments:
       * -d => Decode (the default behavior is to encode)
       * -f => Force overwriting of output files
       * -o => Force the output file name
 
+    :param filename:
+        The input audio file name
+    :param output_filename:
+        The output audio file name
+    :return:
+        The program and its arguments
+    """
+    return [get_program(Program.FLAC)] + FLAC_ARGUMENTS + [filename, '-o', output_filename]
+
+
+def decode_flac_wav(filename: str, destination: str) -> str:
+    """
+    Decodes a FLAC audio file, generating the corresponding WAV audio file.
+
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :return:
+        The output audio file name
+    """
+    output_filename = update_path(filename, destination, AudioFile.WAV.value)
+    with stage('decode', filename) as current, atomic_output(output_filename) as partial:
+        run_process(flac_wav_command(filename, partial))
+        current.output = output_filename
+
+    return output_filename
+
+
+async def decode_flac_wav_async(filename: str, destination: str) -> str:
+    """
+    Decodes a FLAC audio file, generating the corresponding WAV audio file, without blocking the
+    event loop.
+
     :param filename:
         The input audio file name
     :param destination:
@@ -31,6 +71,9 @@ def decode_flac_wav(filename: str, destination: str) -> str:
         The output audio file name
     """
     output_filename = update_path(filename, destination, AudioFile.WAV.value)
-    call([Program.FLAC.value, '-df', filename, '-o', output_filename])
+    with stage('decode', filename, cpu=False) as current, \
+            atomic_output(output_filename) as partial:
+        await run_process_async(flac_wav_command(filename, partial))
+        current.output = output_filename
 
     return output_filename
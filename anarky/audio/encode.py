@@ -7,76 +7,356 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
-from subprocess import call
+from subprocess import CalledProcessError
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
 
-from anarky.audio.decode import decode_flac_wav
+from anarky.audio.decode import decode_flac_wav, decode_flac_wav_async
 from anarky.enum.program import Program
 from anarky.enum.audio_file import AudioFile
-from anarky.utils import update_path
+from anarky.metadata import EXTENSIONS, get_cover_cache, get_front_cover, get_lame_arguments, \
+    read_flac_metadata
+from anarky.process import run_blocking, run_pipeline, run_pipeline_async, run_process, \
+    run_process_async
+from anarky.profile import DEFAULT_PROFILE, Profile
+from anarky.programs import get_program
+from anarky.scheduler import describe_job
+from anarky.stats import stage
+from anarky.utils import atomic_output, get_workspace, update_path
 
+_logger = logging.getLogger(__name__)
 
-def encode_wav_flac(filename: str, destination: str) -> str:
+# Arguments of the 'flac' program used to decode into stdout
+STREAM_ARGUMENTS = ['-dcs']
+
+WARNING_STREAM = "Streaming '%s' failed (%s), falling back to an intermediate WAV file"
+WARNING_TAGS = "Reading the tags of '%s' failed (%s), the output files won't be tagged"
+
+
+def wav_flac_command(filename: str, output_filename: str,
+                     profile: Profile = DEFAULT_PROFILE) -> List[str]:
     """
-    Encodes a WAV audio file, generating the corresponding FLAC audio file.
+    Builds the command that encodes a WAV audio file into a FLAC audio file.
 
-    The 'flac' program is executed with the following arguments:
-      * -f => Force overwriting of output files
-      * -8 => Synonymous with -l 12 -b 4096 -m -e -r 6
-      * -V => Verify a correct encoding
+    The 'flac' program is executed with the arguments of the profile (see
+    'Profile.flac_arguments') and the following arguments:
       * -o => Force the output file name
 
+    :param filename:
+        The input audio file name
+    :param output_filename:
+        The output audio file name
+    :param profile:
+        The encoder profile (archival by default)
+    :return:
+        The program and its arguments
+    """
+    arguments = profile.flac_arguments() + ['-o', output_filename, filename]
+    return [get_program(Program.FLAC)] + arguments
+
+
+def wav_mp3_command(filename: str, output_filename: str, profile: Profile = DEFAULT_PROFILE,
+                    tags: Sequence[str] = ()) -> List[str]:
+    """
+    Builds the command that encodes a WAV audio file into a MP3 audio file.
+
+    The 'lame' program is executed with the arguments of the profile (see
+    'Profile.lame_arguments') and the tag arguments (see 'flac_tags').
+
+    :param filename:
+        The input audio file name ('-' to read from stdin)
+    :param output_filename:
+        The output audio file name
+    :param profile:
+        The encoder profile (archival by default)
+    :param tags:
+        The arguments that write the ID3 tags
+    :return:
+        The program and its arguments
+    """
+    arguments = profile.lame_arguments() + list(tags) + [filename, output_filename]
+    return [get_program(Program.LAME)] + arguments
+
+
+def flac_stream_command(filename: str) -> List[str]:
+    """
+    Builds the command that decodes a FLAC audio file into stdout.
+
+    The 'flac' program is executed with the following arguments:
+      * -d => Decode (the default behavior is to encode)
+      * -c => Write the output to stdout
+      * -s => Silent mode (the progress report would be mixed with the output)
+
+    :param filename:
+        The input audio file name
+    :return:
+        The program and its arguments
+    """
+    return [get_program(Program.FLAC)] + STREAM_ARGUMENTS + [filename]
+
+
+def read_source_tags(filename: str) -> Tuple[Dict[str, List[str]], Optional[str]]:
+    """
+    Reads the tags and the front cover of a FLAC audio file, in a single pass over its metadata
+    blocks.
+
+    The front cover is stored in the cover cache, so the tracks of an album that embed the same
+    picture share a single temporary file. If the metadata can't be read, there are no tags. The
+    duration and tags are also recorded on the running job (see 'describe_job').
+
+    :param filename:
+        The input audio file name
+    :return:
+        The tags and the name of the front cover file (None if there's no cover)
+    """
+    try:
+        with stage('metadata', filename, audio=False):
+            metadata = read_flac_metadata(filename)
+    except (OSError, ValueError) as e:
+        _logger.warning(WARNING_TAGS, filename, e)
+        return {}, None
+
+    describe_job(metadata.stream_info.duration, metadata.tags)
+    picture = get_front_cover(metadata)
+    if picture is None or picture.mime not in EXTENSIONS:
+        return metadata.tags, None
+
+    return metadata.tags, get_cover_cache().store(picture)
+
+
+def flac_tags(filename: str) -> List[str]:
+    """
+    Reads the tags and the front cover of a FLAC audio file and builds the arguments that make the
+    'lame' program write them into the ID3 tag of the MP3 audio file, so the MP3 audio file is
+    tagged as it's encoded (see 'read_source_tags').
+
+    :param filename:
+        The input audio file name
+    :return:
+        The arguments that write the ID3 tags
+    """
+    tags, cover = read_source_tags(filename)
+    return get_lame_arguments(tags, cover)
+
+
+def encode_wav_flac(filename: str, destination: str,
+                    profile: Profile = DEFAULT_PROFILE) -> str:
+    """
+    Encodes a WAV audio file, generating the corresponding FLAC audio file.
+
     :param filename:
         The input audio file name
     :param destination:
         The destination where the output file will be stored
+    :param profile:
+        The encoder profile (archival by default)
     :return:
         The name of the output audio file
     """
     output_filename = update_path(filename, destination, AudioFile.FLAC.value)
-    call([Program.FLAC.value, '-f8V', '-o', output_filename, filename])
+    with stage('encode', filename) as current, atomic_output(output_filename) as partial:
+        run_process(wav_flac_command(filename, partial, profile))
+        current.output = output_filename
 
     return output_filename
 
 
-def encode_wav_mp3(filename: str, destination: str) -> str:
+def encode_wav_mp3(filename: str, destination: str,
+                   profile: Profile = DEFAULT_PROFILE,
+                   tags: Sequence[str] = ()) -> str:
     """
     Encodes a WAV audio file, generating the corresponding MP3 audio file.
 
-    The 'lame' program is executed with the following arguments:
-      * -b 320          => Set the bitrate to 320 kbps
-      * -q 0            => Highest quality, very slow
-      * --preset insane => Type of the quality settings
-      * --id3v2-only    => Add only a version 2 tag
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :param profile:
+        The encoder profile (archival by default)
+    :param tags:
+        The arguments that write the ID3 tags (see 'flac_tags')
+    :return:
+        The name of the output audio file
+    """
+    output_filename = update_path(filename, destination, AudioFile.MP3.value)
+    with stage('encode', filename) as current, atomic_output(output_filename) as partial:
+        run_process(wav_mp3_command(filename, partial, profile, tags))
+        current.output = output_filename
+
+    return output_filename
+
+
+def stream_flac_mp3(filename: str, destination: str,
+                    profile: Profile = DEFAULT_PROFILE,
+                    tags: Sequence[str] = ()) -> str:
+    """
+    Decodes a FLAC audio file and pipes the decoded audio straight into the MP3 encoder, without
+    writing an intermediate WAV audio file.
+
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :param profile:
+        The encoder profile (archival by default)
+    :param tags:
+        The arguments that write the ID3 tags (see 'flac_tags')
+    :return:
+        The name of the output audio file
+    """
+    output_filename = update_path(filename, destination, AudioFile.MP3.value)
+    with stage('transcode', filename) as current, atomic_output(output_filename) as partial:
+        run_pipeline(flac_stream_command(filename), wav_mp3_command('-', partial, profile, tags))
+        current.output = output_filename
+
+    return output_filename
+
+
+def encode_flac_mp3(filename: str, destination: str, stream: bool = True,
+                    profile: Profile = DEFAULT_PROFILE) -> str:
+    """
+    Encodes a FLAC audio file, generating the corresponding MP3 audio file.
+
+    By default, the decoded audio is piped from the FLAC decoder into the MP3 encoder. If the
+    pipeline fails (or streaming is disabled), the FLAC audio file is decoded into an intermediate
+    WAV audio file (in the scratch directory, if there's one), which is then encoded and removed.
+    Either way, the tags and front cover of the FLAC audio file are written by the MP3 encoder
+    (see 'flac_tags').
+
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :param stream:
+        Flag that indicates if the decoded audio is piped into the MP3 encoder
+    :param profile:
+        The encoder profile (archival by default)
+    :return:
+        The name of the output audio file
+    """
+    tags = flac_tags(filename)
+    if stream:
+        try:
+            return stream_flac_mp3(filename, destination, profile, tags)
+        except (CalledProcessError, OSError) as e:
+            _logger.warning(WARNING_STREAM, filename, e)
+
+    wav_file = decode_flac_wav(filename, get_workspace() or destination)
+    try:
+        return encode_wav_mp3(str(wav_file), destination, profile, tags)
+    finally:
+        if wav_file.is_file():
+            wav_file.unlink()
+
+
+async def encode_wav_flac_async(filename: str, destination: str,
+                                profile: Profile = DEFAULT_PROFILE) -> str:
+    """
+    Encodes a WAV audio file, generating the corresponding FLAC audio file, without blocking the
+    event loop.
+
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :param profile:
+        The encoder profile (archival by default)
+    :return:
+        The name of the output audio file
+    """
+    output_filename = update_path(filename, destination, AudioFile.FLAC.value)
+    with stage('encode', filename, cpu=False) as current, \
+            atomic_output(output_filename) as partial:
+        await run_process_async(wav_flac_command(filename, partial, profile))
+        current.output = output_filename
+
+    return output_filename
+
+
+async def encode_wav_mp3_async(filename: str, destination: str,
+                               profile: Profile = DEFAULT_PROFILE,
+                               tags: Sequence[str] = ()) -> str:
+    """
+    Encodes a WAV audio file, generating the corresponding MP3 audio file, without blocking the
+    event loop.
+
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :param profile:
+        The encoder profile (archival by default)
+    :param tags:
+        The arguments that write the ID3 tags (see 'flac_tags')
+    :return:
+        The name of the output audio file
+    """
+    output_filename = update_path(filename, destination, AudioFile.MP3.value)
+    with stage('encode', filename, cpu=False) as current, \
+            atomic_output(output_filename) as partial:
+        await run_process_async(wav_mp3_command(filename, partial, profile, tags))
+        current.output = output_filename
+
+    return output_filename
+
+
+async def stream_flac_mp3_async(filename: str, destination: str,
+                                profile: Profile = DEFAULT_PROFILE,
+                                tags: Sequence[str] = ()) -> str:
+    """
+    Decodes a FLAC audio file and pipes the decoded audio straight into the MP3 encoder, without
+    blocking the event loop.
 
     :param filename:
         The input audio file name
     :param destination:
         The destination where the output file will be stored
+    :param profile:
+        The encoder profile (archival by default)
+    :param tags:
+        The arguments that write the ID3 tags (see 'flac_tags')
     :return:
         The name of the output audio file
     """
     output_filename = update_path(filename, destination, AudioFile.MP3.value)
-    call([Program.LAME.value, '-b', '320', '-q', '0', '--preset', 'insane', '--id3v2-only',
-          filename,
-          output_filename])
+    # A timeout or cancellation also removes the truncated partial file
+    with stage('transcode', filename, cpu=False) as current, \
+            atomic_output(output_filename) as partial:
+        await run_pipeline_async(flac_stream_command(filename),
+                                 wav_mp3_command('-', partial, profile, tags))
+        current.output = output_filename
 
     return output_filename
 
 
-def encode_flac_mp3(filename: str, destination: str) -> str:
+async def encode_flac_mp3_async(filename: str, destination: str, stream: bool = True,
+                                profile: Profile = DEFAULT_PROFILE) -> str:
     """
-    Decodes a FLAC audio file, generating the corresponding WAV audio file.
-    The WAV audio file is then encoded, generating the corresponding MP3 audio file.
+    Encodes a FLAC audio file, generating the corresponding MP3 audio file, without blocking the
+    event loop (see 'encode_flac_mp3').
 
     :param filename:
         The input audio file name
     :param destination:
         The destination where the output file will be stored
+    :param stream:
+        Flag that indicates if the decoded audio is piped into the MP3 encoder
+    :param profile:
+        The encoder profile (archival by default)
     :return:
         The name of the output audio file
     """
-    wav_file = decode_flac_wav(filename, destination)
-    if wav_file.is_file():
-        return encode_wav_mp3(str(wav_file), destination)
+    # Reading the metadata (and writing the cover) blocks, so it's done off the event loop
+    tags = await run_blocking(flac_tags, filename)
+    if stream:
+        try:
+            return await stream_flac_mp3_async(filename, destination, profile, tags)
+        except (CalledProcessError, OSError) as e:
+            _logger.warning(WARNING_STREAM, filename, e)
 
-    return None
+    wav_file = await decode_flac_wav_async(filename, get_workspace() or destination)
+    try:
+        return await encode_wav_mp3_async(str(wav_file), destination, profile, tags)
+    finally:
+        if wav_file.is_file():
+            wav_file.unlink()
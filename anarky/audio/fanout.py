@@ -0,0 +1,245 @@
+# -*- coding: utf8 -*-
+
+"""
+Audio fan-out operations, which decode a FLAC audio file once and encode it into several targets.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import logging
+
+from anarky.audio.encode import flac_stream_command, read_source_tags, wav_mp3_command
+from anarky.audio.wav import repair_header
+from anarky.enum.audio_file import AudioFile
+from anarky.enum.program import Program
+from anarky.metadata import get_flac_arguments, get_lame_arguments
+from anarky.process import run_tee
+from anarky.profile import DEFAULT_PROFILE, get_profile, Profile
+from anarky.programs import get_program
+from anarky.stats import stage
+from anarky.utils import commit_output, discard_output, stage_output, update_path
+
+_logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'flac': AudioFile.FLAC,
+    'mp3': AudioFile.MP3,
+    'wav': AudioFile.WAV
+}
+
+ERROR_TARGET = "Target '{}' is invalid (expected FORMAT or FORMAT:PROFILE, with one of the " \
+               "formats: {})!"
+ERROR_DUPLICATE = "Target '{}' is given more than once!"
+WARNING_TARGET = "Target '%s' of '%s' failed (%s)"
+
+
+class Target(NamedTuple):
+    """
+    Output format (and encoder profile) of a fan-out.
+
+    The output files of each target are stored in their own subdirectory of the destination, named
+    after the target (e.g. 'mp3-standard'). A target without a profile uses the profile selected
+    for each file.
+    """
+    audio_file: AudioFile
+    profile: Optional[Profile] = None
+
+    @property
+    def name(self) -> str:
+        """
+        Retrieves the name of the target.
+
+        :return:
+            The format, followed by the profile if there's one (e.g. 'mp3' or 'mp3-standard')
+        """
+        name = self.audio_file.value.lstrip('.')
+        return name if self.profile is None else '{}-{}'.format(name, self.profile.name)
+
+    @property
+    def programs(self) -> Tuple[Program, ...]:
+        """
+        Retrieves the external programs required by the target (besides the decoder).
+
+        :return:
+            The external programs
+        """
+        return (Program.LAME,) if self.audio_file == AudioFile.MP3 else ()
+
+    def arguments(self, profile: Profile = DEFAULT_PROFILE) -> List[str]:
+        """
+        Builds the encoder settings of the target, which are recorded in the manifest.
+
+        :param profile:
+            The profile selected for the file (unless the target has its own)
+        :return:
+            The name of the target and the arguments of its encoder
+        """
+        profile = self.profile or profile
+        if self.audio_file == AudioFile.FLAC:
+            return [self.name] + profile.flac_arguments()
+        if self.audio_file == AudioFile.MP3:
+            return [self.name] + profile.lame_arguments()
+        return [self.name]
+
+    def output(self, filename: str, destination: str) -> Path:
+        """
+        Builds the name of the output file of the target.
+
+        :param filename:
+            The input audio file name
+        :param destination:
+            The destination where the subdirectories of the targets are stored
+        :return:
+            The name of the output audio file
+        """
+        return update_path(filename, str(Path(destination, self.name)), self.audio_file.value)
+
+    def command(self, output_filename: str, profile: Profile = DEFAULT_PROFILE,
+                tags: dict = None, cover: str = None) -> Optional[List[str]]:
+        """
+        Builds the command that encodes the decoded audio (read from stdin) into the target.
+
+        :param output_filename:
+            The output audio file name
+        :param profile:
+            The profile selected for the file (unless the target has its own)
+        :param tags:
+            The tags of the input audio file
+        :param cover:
+            The name of the front cover file
+        :return:
+            The program and its arguments (None for WAV targets, which are written directly)
+        """
+        profile = self.profile or profile
+        tags = tags or {}
+        if self.audio_file == AudioFile.FLAC:
+            return [get_program(Program.FLAC)] + profile.flac_arguments() + \
+                get_flac_arguments(tags, cover) + ['-o', output_filename, '-']
+        if self.audio_file == AudioFile.MP3:
+            return wav_mp3_command('-', output_filename, profile, get_lame_arguments(tags, cover))
+        return None
+
+
+def parse_target(specification: str) -> Target:
+    """
+    Parses a target in the 'FORMAT' or 'FORMAT:PROFILE' form (e.g. 'mp3:standard').
+
+    :param specification:
+        The specification of the target
+    :return:
+        The target
+    :raise ValueError:
+        If the format or the profile don't exist
+    """
+    name, _, profile = specification.strip().lower().partition(':')
+    if name not in FORMATS:
+        raise ValueError(ERROR_TARGET.format(specification, ', '.join(FORMATS)))
+
+    return Target(FORMATS[name], get_profile(profile) if profile else None)
+
+
+def parse_targets(specifications: Iterable[str]) -> List[Target]:
+    """
+    Parses the targets of a fan-out (see 'parse_target').
+
+    :param specifications:
+        The specifications of the targets
+    :return:
+        The targets
+    :raise ValueError:
+        If a target is invalid or given more than once (its output files would be overwritten)
+    """
+    targets = []
+    for specification in specifications:
+        target = parse_target(specification)
+        if target in targets:
+            raise ValueError(ERROR_DUPLICATE.format(specification))
+        targets.append(target)
+
+    return targets
+
+
+def get_targets_programs(targets: Iterable[Target]) -> List[Program]:
+    """
+    Retrieves the external programs required by a fan-out.
+
+    :param targets:
+        The targets of the fan-out
+    :return:
+        The external programs, starting with the decoder
+    """
+    programs = [Program.FLAC]
+    for target in targets:
+        programs += [program for program in target.programs if program not in programs]
+
+    return programs
+
+
+def fan_out(filename: str, destination: str, targets: Sequence[Target],
+            profile: Profile = DEFAULT_PROFILE) -> List[Path]:
+    """
+    Decodes a FLAC audio file once and copies the decoded audio into the encoder of every target
+    at the same time, so the input file is read and decoded only once however many targets there
+    are.
+
+    The tags and front cover of the FLAC audio file are written into the MP3 and FLAC targets. A
+    target that fails doesn't stop the others: the outputs of the targets that succeeded are kept
+    and the error of the first target that failed is raised afterwards.
+
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the subdirectories of the targets are stored
+    :param targets:
+        The targets
+    :param profile:
+        The profile selected for the file (used by the targets without a profile)
+    :return:
+        The names of the output audio files, in the order of the targets
+    """
+    tags, cover = read_source_tags(filename)
+    outputs = [target.output(filename, destination) for target in targets]
+    partials = [stage_output(str(output)) for output in outputs]
+    for output in outputs:
+        output.parent.mkdir(parents=True, exist_ok=True)
+
+    commands = [target.command(str(partial), profile, tags, cover)
+                for target, partial in zip(targets, partials)]
+    encoders = [index for index, command in enumerate(commands) if command is not None]
+    writers = [index for index, command in enumerate(commands) if command is None]
+
+    with stage('transcode', filename) as current:
+        try:
+            errors = run_tee(flac_stream_command(filename),
+                             [commands[index] for index in encoders],
+                             [partials[index] for index in writers])
+        except BaseException:
+            for partial in partials:
+                discard_output(partial)
+            raise
+        current.output = outputs[0]
+
+    # The errors come back in the order of the consumers (encoders first, then WAV files)
+    failed = None
+    for index, error in zip(encoders + writers, errors):
+        if error is None and targets[index].audio_file == AudioFile.WAV:
+            # Written to a pipe, the WAV header may lack the sizes of the audio data
+            try:
+                repair_header(str(partials[index]))
+            except (OSError, ValueError) as e:
+                error = e
+        if error is None:
+            commit_output(partials[index], str(outputs[index]))
+            continue
+
+        _logger.warning(WARNING_TARGET, targets[index].name, filename, error)
+        discard_output(partials[index])
+        failed = failed or error
+
+    if failed is not None:
+        raise failed
+
+    return outputs
@@ -0,0 +1,357 @@
+# -*- coding: utf8 -*-
+
+"""
+Native reading and writing of WAV audio files.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from mmap import ACCESS_READ, mmap
+from struct import error as StructError, pack, unpack_from
+from typing import BinaryIO, Iterator, NamedTuple, Tuple
+
+# RIFF chunk identifiers
+RIFF = b'RIFF'
+WAVE = b'WAVE'
+FMT = b'fmt '
+DATA = b'data'
+
+# Sample formats (the extensible format stores the actual one in its sub-format)
+PCM = 0x0001
+IEEE_FLOAT = 0x0003
+EXTENSIBLE = 0xFFFE
+
+# Size of the buffers in which the audio frames are streamed
+BUFFER_SIZE = 1 << 16
+
+# Size of the canonical header (RIFF, 16 byte 'fmt ' and 'data' chunk headers)
+HEADER_SIZE = 44
+
+
+class WavFormat(NamedTuple):
+    """
+    Sample format of a WAV audio file, stored in the 'fmt ' chunk.
+    """
+    format_tag: int
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+
+    @property
+    def block_align(self) -> int:
+        """
+        Calculates the size of an audio frame (one sample per channel).
+
+        :return:
+            The size of an audio frame in bytes
+        """
+        return self.channels * ((self.bits_per_sample + 7) // 8)
+
+    @property
+    def byte_rate(self) -> int:
+        """
+        Calculates the number of bytes of audio per second.
+
+        :return:
+            The number of bytes per second
+        """
+        return self.sample_rate * self.block_align
+
+
+class WavInfo(NamedTuple):
+    """
+    Layout of a WAV audio file: its sample format and where its audio frames are.
+    """
+    format: WavFormat
+    data_offset: int
+    data_size: int
+    declared_size: int
+    riff_size: int
+    file_size: int
+
+    @property
+    def frames(self) -> int:
+        """
+        Calculates the number of audio frames.
+
+        :return:
+            The number of audio frames
+        """
+        return self.data_size // self.format.block_align
+
+    @property
+    def duration(self) -> float:
+        """
+        Calculates the duration of the audio.
+
+        :return:
+            The duration in seconds
+        """
+        return self.frames / self.format.sample_rate
+
+    @property
+    def damaged(self) -> bool:
+        """
+        Checks if the sizes in the header don't match the file (e.g. the file is truncated or was
+        written to a pipe, where the sizes aren't known in advance).
+
+        :return:
+            True if the header needs to be repaired; False otherwise
+        """
+        return self.declared_size != self.data_size or self.riff_size != self.file_size - 8
+
+
+def _parse_format(buffer, offset: int, size: int) -> WavFormat:
+    if size < 16:
+        raise ValueError("The 'fmt ' chunk is too short ({} bytes)".format(size))
+
+    format_tag, channels, sample_rate, _, _, bits_per_sample = unpack_from('<HHIIHH', buffer,
+                                                                            offset)
+    if format_tag == EXTENSIBLE and size >= 40:
+        # The sub-format GUID starts with the actual format tag
+        (format_tag,) = unpack_from('<H', buffer, offset + 24)
+    if not channels or not sample_rate or not bits_per_sample:
+        raise ValueError('Invalid sample format ({} channels, {} Hz, {} bits)'.format(
+            channels, sample_rate, bits_per_sample))
+
+    return WavFormat(format_tag, channels, sample_rate, bits_per_sample)
+
+
+def _parse_chunks(buffer) -> WavInfo:
+    length = len(buffer)
+    if length < 12 or buffer[0:4] != RIFF or buffer[8:12] != WAVE:
+        raise ValueError('Not a WAV audio file')
+
+    (riff_size,) = unpack_from('<I', buffer, 4)
+    wav_format = None
+    offset = 12
+    while offset + 8 <= length:
+        chunk_id = bytes(buffer[offset:offset + 4])
+        (size,) = unpack_from('<I', buffer, offset + 4)
+        body = offset + 8
+        if chunk_id == FMT:
+            wav_format = _parse_format(buffer, body, size)
+        elif chunk_id == DATA:
+            if wav_format is None:
+                raise ValueError("The 'data' chunk comes before the 'fmt ' chunk")
+            available = length - body
+            data_size = size if 0 < size <= available else available
+            data_size -= data_size % wav_format.block_align
+            return WavInfo(wav_format, body, data_size, size, riff_size, length)
+
+        # Chunks are word aligned
+        offset = body + size + (size & 1)
+
+    raise ValueError("The 'data' chunk is missing")
+
+
+def parse_wav(buffer) -> WavInfo:
+    """
+    Parses the RIFF chunks of a WAV audio file, up to the 'data' chunk.
+
+    The audio frames are never copied, so the buffer can be a memory map of a large file. A
+    'data' chunk whose size is unknown (zero) or larger than the file is assumed to run until the
+    end of the file, rounded down to a whole number of audio frames.
+
+    :param buffer:
+        The contents of the WAV audio file
+    :return:
+        The layout of the WAV audio file
+    :raise ValueError:
+        If the contents aren't a valid WAV audio file
+    """
+    try:
+        return _parse_chunks(buffer)
+    except StructError:
+        raise ValueError('The WAV header is truncated')
+
+
+def read_wav_info(filename: str) -> WavInfo:
+    """
+    Reads the layout of a WAV audio file, without reading its audio frames.
+
+    :param filename:
+        The input audio file name
+    :return:
+        The layout of the WAV audio file
+    :raise ValueError:
+        If the file isn't a valid WAV audio file
+    """
+    with WavReader(filename) as reader:
+        return reader.info
+
+
+class WavReader:
+    """
+    Reader of WAV audio files, backed by a memory map.
+
+    The operating system pages the audio frames in as they are used, so even a large file is never
+    read into memory as a whole.
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename:
+            The input audio file name
+        :raise ValueError:
+            If the file isn't a valid WAV audio file
+        """
+        self.filename = str(filename)
+        self._file = open(self.filename, 'rb')
+        try:
+            self._map = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            self._file.close()
+            raise ValueError('Not a WAV audio file')
+        except BaseException:
+            self._file.close()
+            raise
+        try:
+            self.info = parse_wav(self._map)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Releases the memory map and the file.
+        """
+        self._map.close()
+        self._file.close()
+
+    def _range(self, buffer_size: int) -> Iterator[Tuple[int, int]]:
+        # Buffers hold whole audio frames, so no frame is ever split between two buffers
+        block_align = self.info.format.block_align
+        size = max(block_align, buffer_size - buffer_size % block_align)
+        start = self.info.data_offset
+        end = start + self.info.data_size
+        for offset in range(start, end, size):
+            yield offset, min(offset + size, end)
+
+    def iter_buffers(self, buffer_size: int = BUFFER_SIZE) -> Iterator[bytes]:
+        """
+        Reads the audio frames in fixed-size buffers.
+
+        :param buffer_size:
+            The maximum size of each buffer (rounded down to a whole number of audio frames)
+        :return:
+            The buffers of audio frames
+        """
+        for start, end in self._range(buffer_size):
+            yield self._map[start:end]
+
+    def write_to(self, output: BinaryIO, buffer_size: int = BUFFER_SIZE) -> int:
+        """
+        Writes the audio frames into a file or pipe (e.g. the input of an encoder), straight from
+        the memory map.
+
+        :param output:
+            The binary file or pipe
+        :param buffer_size:
+            The maximum size of each write
+        :return:
+            The number of bytes written
+        """
+        written = 0
+        with memoryview(self._map) as view:
+            for start, end in self._range(buffer_size):
+                with view[start:end] as chunk:
+                    output.write(chunk)
+                written += end - start
+
+        return written
+
+
+class WavWriter:
+    """
+    Writer of WAV audio files with a canonical header.
+
+    The audio frames are written as they come and the sizes in the header are filled in when the
+    writer is closed, so the total size doesn't need to be known in advance.
+    """
+
+    def __init__(self, filename: str, wav_format: WavFormat):
+        """
+        :param filename:
+            The output audio file name
+        :param wav_format:
+            The sample format of the audio frames
+        """
+        self.filename = str(filename)
+        self.format = wav_format
+        self.data_size = 0
+        self._file = open(self.filename, 'wb')
+        self._file.write(self._header())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _header(self) -> bytes:
+        wav_format = self.format
+        padding = self.data_size & 1
+        return RIFF + pack('<I', HEADER_SIZE - 8 + self.data_size + padding) + WAVE + \
+            FMT + pack('<IHHIIHH', 16, wav_format.format_tag, wav_format.channels,
+                       wav_format.sample_rate, wav_format.byte_rate, wav_format.block_align,
+                       wav_format.bits_per_sample) + \
+            DATA + pack('<I', self.data_size)
+
+    def write(self, frames: bytes):
+        """
+        Writes audio frames.
+
+        :param frames:
+            The audio frames (interleaved samples, in the sample format of the writer)
+        """
+        self._file.write(frames)
+        self.data_size += len(frames)
+
+    def close(self):
+        """
+        Fills in the sizes in the header and closes the file.
+        """
+        if self._file.closed:
+            return
+
+        if self.data_size & 1:
+            self._file.write(b'\x00')
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+
+
+def repair_header(filename: str) -> bool:
+    """
+    Repairs the sizes in the header of a WAV audio file, if they don't match the file (e.g. after
+    the file was truncated or written by a program that couldn't seek back to fill them in).
+
+    Only the RIFF and 'data' chunk sizes are rewritten; the audio frames are left untouched.
+
+    :param filename:
+        The WAV audio file name
+    :return:
+        True if the header was repaired; False if it was already valid
+    :raise ValueError:
+        If the file isn't a valid WAV audio file
+    """
+    info = read_wav_info(filename)
+    if not info.damaged:
+        return False
+
+    with open(str(filename), 'r+b') as wav_file:
+        wav_file.seek(4)
+        wav_file.write(pack('<I', info.file_size - 8))
+        wav_file.seek(info.data_offset - 4)
+        wav_file.write(pack('<I', info.data_size))
+
+    return True
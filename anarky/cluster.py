@@ -0,0 +1,438 @@
+# -*- coding: utf8 -*-
+
+"""
+Distributed conversion of batches across several hosts, through a job queue on shared storage.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+from os import getpid
+from pathlib import Path
+from socket import gethostname
+from threading import Event, Thread
+from time import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+import sqlite3
+
+from anarky.api import Converter
+from anarky.scheduler import Result
+
+VERSION = 1
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (QUEUED, RUNNING, DONE, FAILED)
+
+# Time (in seconds) a worker holds a job without renewing its lease
+LEASE = 60.0
+
+# Number of times a job is claimed before it's failed (e.g. because it keeps crashing its workers)
+ATTEMPTS = 3
+
+# Time (in seconds) between the checks of a worker that's waiting for new jobs
+POLL = 5.0
+
+# Time (in seconds) the writers wait for each other before giving up
+LOCK_TIMEOUT = 60.0
+
+ERROR_QUEUE = "Queue '{}' was created by another version of Anarky or isn't a queue!"
+ERROR_LEASE = 'The lease expired too many times (the workers crashed or were killed)'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS jobs (
+    file TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    worker TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    output TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, expires);
+'''
+
+
+def default_worker_name() -> str:
+    """
+    Builds the name of the worker run by the current process.
+
+    :return:
+        The host name and process identifier
+    """
+    return '{}:{}'.format(gethostname(), getpid())
+
+
+class JobQueue:
+    """
+    Queue of conversion jobs stored in a SQLite database, which every host opens on shared storage.
+
+    The coordinator adds the input files to the queue, along with the settings of the conversion.
+    Each worker claims a job at a time, holding a lease that it renews while the job runs. When a
+    worker crashes, its leases expire and the jobs are claimed again by the other workers; a job
+    whose lease expires too many times is failed. Adding the same files again only adds the new
+    ones, so the coordinator can be run periodically over the same directories.
+
+    The database is also a local stand-in for a message broker: on a single host (or in the tests)
+    it's simply a file in a local directory. On shared storage, the file system must support
+    POSIX locks (e.g. NFSv4 or SMB with locking enabled).
+    """
+
+    def __init__(self, path: str, lease: float = LEASE, attempts: int = ATTEMPTS,
+                 clock: Callable[[], float] = time):
+        """
+        :param path:
+            The database file of the queue (created if it doesn't exist)
+        :param lease:
+            The time (in seconds) a worker holds a job without renewing its lease
+        :param attempts:
+            The number of times a job is claimed before it's failed
+        :param clock:
+            The clock of the leases (the hosts must have their clocks synchronized)
+        :raise ValueError:
+            If the file isn't a queue (or was created by another version)
+        """
+        self.path = Path(path)
+        self.lease = lease
+        self.attempts = attempts
+        self.clock = clock
+        self.requeued = 0
+
+        # Transactions are explicit, so the claims hold the write lock from the start
+        self._connection = sqlite3.connect(str(self.path), timeout=LOCK_TIMEOUT,
+                                           isolation_level=None)
+        try:
+            self._connection.executescript(SCHEMA)
+            with self._transaction():
+                version = self._connection.execute(
+                    "SELECT value FROM settings WHERE name = 'version'").fetchone()
+                if version is None:
+                    self._connection.execute("INSERT INTO settings VALUES ('version', ?)",
+                                             (str(VERSION),))
+                elif version[0] != str(VERSION):
+                    raise ValueError(ERROR_QUEUE.format(path))
+        except sqlite3.DatabaseError:
+            self._connection.close()
+            raise ValueError(ERROR_QUEUE.format(path))
+        except ValueError:
+            self._connection.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _transaction(self):
+        return _Transaction(self._connection)
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return str(Path(filename).resolve())
+
+    @property
+    def settings(self) -> Dict[str, str]:
+        """
+        Retrieves the settings of the conversion, as set by the coordinator.
+
+        :return:
+            The settings (e.g. 'conversion', 'destination' and 'profile')
+        """
+        rows = self._connection.execute(
+            "SELECT name, value FROM settings WHERE name != 'version'").fetchall()
+        return dict(rows)
+
+    def configure(self, **settings: Optional[str]):
+        """
+        Stores the settings of the conversion (the settings set to None are removed).
+
+        :param settings:
+            The settings (e.g. 'conversion', 'destination' and 'profile')
+        """
+        with self._transaction():
+            for name, value in settings.items():
+                if value is None:
+                    self._connection.execute('DELETE FROM settings WHERE name = ?', (name,))
+                else:
+                    self._connection.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                                             (name, str(value)))
+
+    def add(self, files: Iterable[str], batch: int = 500) -> int:
+        """
+        Adds jobs to the queue, ignoring the files that were already added.
+
+        :param files:
+            The input audio file names (on the shared storage, under the same path on every host)
+        :param batch:
+            The number of files added in each transaction
+        :return:
+            The number of jobs added
+        """
+        added = 0
+        files = iter(files)
+        while True:
+            keys = [self._key(filename) for filename in islice(files, batch)]
+            if not keys:
+                return added
+            with self._transaction():
+                before = self._connection.total_changes
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO jobs (file, state) VALUES (?, ?)',
+                    [(key, QUEUED) for key in keys])
+                added += self._connection.total_changes - before
+
+    def _expire(self, now: float):
+        # The expired jobs are failed if they used up their attempts and queued again otherwise
+        self._connection.execute(
+            'UPDATE jobs SET state = ?, worker = NULL, error = ? '
+            'WHERE state = ? AND expires < ? AND attempts >= ?',
+            (FAILED, ERROR_LEASE, RUNNING, now, self.attempts))
+        cursor = self._connection.execute(
+            'UPDATE jobs SET state = ?, worker = NULL WHERE state = ? AND expires < ?',
+            (QUEUED, RUNNING, now))
+        self.requeued += cursor.rowcount
+
+    def claim(self, worker: str) -> Optional[str]:
+        """
+        Claims the next queued job, re-queuing the jobs of the workers whose leases expired.
+
+        :param worker:
+            The name of the worker
+        :return:
+            The input audio file name, or None if there are no queued jobs
+        """
+        with self._transaction():
+            now = self.clock()
+            self._expire(now)
+            row = self._connection.execute(
+                'SELECT file FROM jobs WHERE state = ? ORDER BY rowid LIMIT 1',
+                (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                'UPDATE jobs SET state = ?, worker = ?, expires = ?, attempts = attempts + 1 '
+                'WHERE file = ?', (RUNNING, worker, now + self.lease, row[0]))
+
+        return row[0]
+
+    def renew(self, worker: str) -> int:
+        """
+        Renews the leases of the jobs held by a worker.
+
+        :param worker:
+            The name of the worker
+        :return:
+            The number of jobs still held by the worker (the jobs whose leases already expired
+            may have been claimed by other workers)
+        """
+        with self._transaction():
+            cursor = self._connection.execute(
+                'UPDATE jobs SET expires = ? WHERE state = ? AND worker = ?',
+                (self.clock() + self.lease, RUNNING, worker))
+            return cursor.rowcount
+
+    def release(self, filename: str, worker: str):
+        """
+        Puts a job that was claimed but not started back into the queue.
+
+        :param filename:
+            The input audio file name
+        :param worker:
+            The name of the worker
+        """
+        with self._transaction():
+            self._connection.execute(
+                'UPDATE jobs SET state = ?, worker = NULL, attempts = attempts - 1 '
+                'WHERE file = ? AND state = ? AND worker = ?', (QUEUED, filename, RUNNING, worker))
+
+    def complete(self, filename: str, worker: str, output: str = None, error: str = None) -> bool:
+        """
+        Records the outcome of a job.
+
+        :param filename:
+            The input audio file name
+        :param worker:
+            The name of the worker
+        :param output:
+            The output audio file name
+        :param error:
+            The error raised by the conversion (None if it succeeded)
+        :return:
+            True if the outcome was recorded; False if the job is no longer held by the worker
+        """
+        with self._transaction():
+            cursor = self._connection.execute(
+                'UPDATE jobs SET state = ?, worker = NULL, expires = NULL, output = ?, error = ? '
+                'WHERE file = ? AND state = ? AND worker = ?',
+                (FAILED if error is not None else DONE, output, error, filename, RUNNING, worker))
+            return cursor.rowcount > 0
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Counts the jobs in each state.
+
+        :return:
+            The number of jobs in each state
+        """
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._connection.execute(
+            'SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        return counts
+
+    def failures(self) -> Iterator[Result]:
+        """
+        Retrieves the jobs that failed.
+
+        :return:
+            The outcome of each failed job
+        """
+        rows = self._connection.execute(
+            'SELECT file, error FROM jobs WHERE state = ? ORDER BY rowid', (FAILED,)).fetchall()
+        for filename, error in rows:
+            yield Result(filename, None, error)
+
+    def pending(self) -> int:
+        """
+        Counts the jobs that aren't finished.
+
+        :return:
+            The number of queued and running jobs
+        """
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)', (QUEUED, RUNNING)).fetchone()[0]
+
+    def close(self):
+        """
+        Closes the queue.
+        """
+        self._connection.close()
+
+
+class _Transaction:
+    # Write transaction that takes the database lock as it begins (so two workers never claim the
+    # same job) and is rolled back if anything fails
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def __enter__(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, *exc_info):
+        self._connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+class QueueWorker:
+    """
+    Converts the jobs claimed from a shared queue, until the queue is drained or the worker is
+    stopped.
+
+    The worker claims one job per free worker of the converter, so the jobs are spread across
+    every host that runs a worker. The leases of the running jobs are renewed a few times per
+    lease period from a thread of its own, so neither a slow consumer of the results nor the
+    conversions that finish after the worker is stopped let them expire.
+
+    Example::
+
+        with JobQueue('/mnt/shared/queue.db') as queue, \\
+                Converter('flac2mp3', '/mnt/shared/mp3', jobs=8) as converter:
+            for result in QueueWorker(converter, queue).run():
+                print(result.filename, result.output, result.error)
+    """
+
+    def __init__(self, converter: Converter, queue: JobQueue, name: str = None,
+                 poll: float = POLL):
+        """
+        :param converter:
+            The converter that runs the conversions
+        :param queue:
+            The shared queue of jobs
+        :param name:
+            The name of the worker (defaults to the host name and process identifier)
+        :param poll:
+            The time (in seconds) between the checks for new jobs while the other workers hold
+            the remaining ones
+        """
+        self.converter = converter
+        self.queue = queue
+        self.name = name or default_worker_name()
+        self.poll = poll
+
+    def run(self, stop: Event = None) -> Iterator[Result]:
+        """
+        Converts jobs until there are no queued or running jobs left (or the worker is stopped).
+
+        :param stop:
+            The event that stops the worker (after the running conversions finish)
+        :return:
+            The outcome of each conversion, as soon as it finishes
+        """
+        stop = stop or Event()
+        running = {}
+        renewal = _LeaseRenewal(self.queue, self.name)
+        try:
+            while True:
+                while not stop.is_set() and len(running) < self.converter.jobs:
+                    filename = self.queue.claim(self.name)
+                    if filename is None:
+                        break
+                    running[self.converter.start(filename)] = filename
+
+                if not running:
+                    # The jobs held by other workers are claimed again if their leases expire
+                    if stop.is_set() or not self.queue.pending():
+                        return
+                    stop.wait(self.poll)
+                    continue
+
+                done, _ = wait(running, timeout=self.poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    self.queue.complete(running.pop(future), self.name, result.output,
+                                        result.error)
+                    yield result
+        finally:
+            # If the worker is interrupted, the jobs that haven't started go back to the queue
+            try:
+                for future, filename in list(running.items()):
+                    if future.cancel():
+                        self.queue.release(filename, self.name)
+                        del running[future]
+                for future in running:
+                    result = future.result()
+                    self.queue.complete(running[future], self.name, result.output, result.error)
+            finally:
+                renewal.stop()
+
+
+class _LeaseRenewal:
+    # Renews the leases of the jobs held by a worker a few times per lease period, from its own
+    # thread and connection to the queue (SQLite connections can't be shared between threads),
+    # until it's stopped. A renewal that fails (e.g. the database stays locked) is retried on the
+    # next one
+
+    def __init__(self, queue: JobQueue, worker: str):
+        self.queue = queue
+        self.worker = worker
+        self.stopped = Event()
+        self.thread = Thread(target=self._renew, daemon=True)
+        self.thread.start()
+
+    def _renew(self):
+        with JobQueue(str(self.queue.path), self.queue.lease, self.queue.attempts,
+                      self.queue.clock) as queue:
+            while not self.stopped.wait(self.queue.lease / 3):
+                try:
+                    queue.renew(self.worker)
+                except sqlite3.Error:
+                    pass
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
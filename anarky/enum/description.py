@@ -15,5 +15,11 @@ class Description(Enum):
     """
     FLAC2WAV = 'Decodes FLAC files into the WAV format'
     FLAC2MP3 = 'Encodes FLAC files into the MP3 format with the maximum compression level'
+    FLAC2MANY = 'Decodes FLAC files once and encodes them into several formats at the same time'
     WAV2FLAC = 'Encodes WAV files into the FLAC format with the maximum compression level'
     WAV2MP3 = 'Encodes WAV files into the MP3 format with the maximum compression level'
+    WATCH = 'Converts the audio files dropped into a set of directories when they are written'
+    VERIFY = 'Verifies the integrity of FLAC files that changed since their last verification'
+    QUEUE = 'Spreads the conversion of a batch across several hosts through a shared job queue'
+    LIBRARY = 'Indexes the tags and properties of an audio library and lists the files that match'
+    ANARKY = 'Runs any of the Anarky programs as a command'
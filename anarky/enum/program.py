@@ -16,7 +16,3 @@ class Program(Enum):
     FLAC = 'flac'
     METAFLAC = 'metaflac'
     LAME = 'lame'
-    GREP = 'grep'
-    SED = 'sed'
-    FILE = 'file'
-    WHEREIS = 'whereis'
@@ -15,5 +15,11 @@ class Script(Enum):
     """
     FLAC2WAV = 'flac2wav'
     FLAC2MP3 = 'flac2mp3'
+    FLAC2MANY = 'flac2many'
     WAV2FLAC = 'wav2flac'
     WAV2MP3 = 'wav2mp3'
+    WATCH = 'anarky-watch'
+    VERIFY = 'anarky-verify'
+    QUEUE = 'anarky-queue'
+    LIBRARY = 'anarky-library'
+    ANARKY = 'anarky'
@@ -9,40 +9,68 @@ License: MIT (see LICENSE for details)
 
 # Module import
 # --------------------------------------------------------------------------------------------------
-from os import walk
-from os.path import isdir, isfile, join
+from itertools import chain
+from os.path import isdir, isfile
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator, TYPE_CHECKING
 import argparse
 import logging
 import sys
 
 from .__version__ import __version__
+from .enum.program import Program
+from .programs import ERROR_PROGRAMS, get_missing_programs
+from .scheduler import default_jobs, Result, Scheduler
+from .utils import ERROR_UNAVAILABLE, prefetch, walk_files
+
+# The modules of the conversions are only imported by the programs that run them
+if TYPE_CHECKING:
+    from .api import Conversion
+    from .manifest import Manifest
 
 
 # Constants
 # --------------------------------------------------------------------------------------------------
-ERROR = "{} '{}' is not available (doesn't exist or no privileges to access it)!"
 ERROR_INVALID = "{} '{}' is invalid!"
 ERROR_INVALID_LIST = 'The list of input files is invalid!'
 ERROR_EMPTY_LIST = 'The list of input files is empty!'
+ERROR_JOB = "Conversion of '{}' failed: {}"
+ERROR_JOBS = "The number of jobs must be a positive integer, not '{}'!"
+ERROR_SECONDS = "The number of seconds must be a positive number, not '{}'!"
+ERROR_TIMEOUT = 'The time limit can\'t be combined with {}!'
+SUMMARY = '{} file(s) converted, {} up to date, {} failed'
+RESUMED = '{} file(s) already converted by the interrupted batch'
+CONVERTED = "Converted '{}' into '{}'"
+PLAYLIST = '{} file(s) written to the playlist {}'
 
 
 # Logger
 # --------------------------------------------------------------------------------------------------
-logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger(__name__)
 
+
+def configure_logging():
+    """
+    Sends the log messages of the programs to stderr (it's up to the applications that use Anarky
+    as a library to configure their own logging).
+    """
+    logging.basicConfig(level=logging.INFO)
+
+
 def keyboard_interrupt():
-    _logger.warn('\nThe program execution was interrupted!\n')
+    _logger.warning('\nThe program execution was interrupted! Run it again with --resume to '
+                    'convert the remaining files.\n')
 
 
 # Methods :: Command line options and instructions
 # --------------------------------------------------------------------------------------------------
-def parse_options(program, description, decode=False):
+def parse_options(program, description, decode=False, fanout=False):
     """
     Parses and retrieves the values for the full set of command line arguments.
     :param program: The name of the program
     :param description: The description of the program
     :param decode: Flag the indicates if it's an encoding or decoding operation
+    :param fanout: Flag that indicates if each file is converted into several targets
     :return: The list of command line arguments
     """
     # Defines the parent parser
@@ -54,25 +82,160 @@ def parse_options(program, description, decode=False):
     # TODO: the destination probably shouldn't be a required parameter. And the name could be
     # changed to "output"...
     group.add_argument('-o', '--output', metavar='OUTPUT', dest='output_dir', help='output directory')
+    group.add_argument('-j', '--jobs', metavar='JOBS', dest='jobs', type=positive_integer,
+        default=default_jobs(), help='number of files converted in parallel (default: %(default)s)')
+    group.add_argument('-i', '--incremental', action='store_true', dest='incremental',
+        help='skip the files whose output is up to date')
+    group.add_argument('--include', metavar='GLOB', dest='include', action='append', default=[],
+        help='only convert the files (inside directories) that match the pattern')
+    group.add_argument('--exclude', metavar='GLOB', dest='exclude', action='append', default=[],
+        help='skip the files and directories that match the pattern')
+    add_profile_option(group)
+    group.add_argument('--resume', action='store_true', dest='resume',
+        help='continue an interrupted batch, skipping the files it already converted')
+    group.add_argument('--plan', action='store_true', dest='plan',
+        help='convert the longest files first (all input files are listed before starting) and '
+        'report the predicted and actual time')
+    group.add_argument('--stats-json', metavar='FILE', dest='stats_json',
+        help='write the timing and throughput statistics of each stage to a JSON file')
+    add_scratch_options(group)
+    group.add_argument('-p', '--playlist', metavar='FILE', dest='playlist',
+        help='write an extended M3U playlist of the output files as they are converted (UTF-8 if '
+        'the extension is .m3u8)')
+    if fanout:
+        group.add_argument('--targets', nargs='+', metavar='TARGET', dest='targets',
+            required=True, help='formats (and profiles) each file is converted into, e.g. '
+            'mp3:archival mp3:standard flac wav')
+    else:
+        group.add_argument('--timeout', metavar='SECONDS', dest='timeout', type=positive_number,
+            help='stop the conversion of a file (killing its programs) after a number of seconds')
+    parser.set_defaults(timeout=None)
+
+    args = parser.parse_args()
+    if fanout:
+        from .audio.fanout import parse_targets
+
+        try:
+            args.targets = parse_targets(args.targets)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.timeout is not None:
+        combined = [option for option, value in (('--resume', args.resume), ('--plan', args.plan),
+                                                 ('--scratch', args.scratch),
+                                                 ('--playlist', args.playlist)) if value]
+        if combined:
+            parser.error(ERROR_TIMEOUT.format(', '.join(combined)))
+
+    return args
+
+
+def positive_integer(value: str) -> int:
+    """
+    Converts a command line argument into a positive integer.
+    :param value: The value of the command line argument
+    :return: The converted value
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number < 1:
+        raise argparse.ArgumentTypeError(ERROR_JOBS.format(value))
+
+    return number
+
+
+def positive_number(value: str) -> float:
+    """
+    Converts a command line argument into a positive number of seconds.
+    :param value: The value of the command line argument
+    :return: The converted value
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0.0
+
+    if not number > 0:
+        raise argparse.ArgumentTypeError(ERROR_SECONDS.format(value))
+
+    return number
+
 
-    return parser.parse_args()
+def byte_size(value: str) -> int:
+    """
+    Converts a command line argument into a number of bytes.
+    :param value: The value of the command line argument (e.g. '512M' or '2G')
+    :return: The converted value
+    """
+    from .scratch import parse_size
+
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def add_profile_option(parser):
+    """
+    Adds the option that selects the encoder profile of every file.
+    :param parser: The parser (or group of arguments) where the option is added
+    """
+    from .profile import PROFILES
+
+    parser.add_argument('--profile', metavar='PROFILE', dest='profile', choices=sorted(PROFILES),
+        help='encoder profile of every file ({}); overrides the .anarky-profile files of the input '
+        'directories (default: archival)'.format(', '.join(PROFILES)))
+
+
+def add_scratch_options(parser):
+    """
+    Adds the options of the scratch space where the conversions write their files.
+    :param parser: The parser (or group of arguments) where the options are added
+    """
+    parser.add_argument('--scratch', metavar='DIR', dest='scratch',
+        help='write the intermediate and output files into a directory on a fast local file '
+        'system (e.g. /dev/shm), moving each output to the output directory once complete')
+    parser.add_argument('--scratch-budget', metavar='SIZE', dest='scratch_budget', type=byte_size,
+        help='maximum scratch space used at the same time, e.g. 2G (default: half of the free '
+        'space)')
 
 
-def get_options(program, description, decode=False):
+def get_options(program, description, decode=False, programs: Iterable[Program] = (),
+                extensions: Iterable[str] = (), fanout=False):
     """
     Parses, retrieves and validates the values for the full set of command line arguments.
     :param program: The name of the program
     :param description: The description of the program
     :param decode: Flag the indicates if it's an encoding or decoding operation
-    :return: The fully parsed and validated list of command line arguments
+    :param programs: The external programs required by the operation
+    :param extensions: The extensions of the input files looked up inside directories
+    :param fanout: Flag that indicates if each file is converted into several targets (whose
+        programs are also required)
+    :return: The input files (found lazily) and the remaining command line arguments
     """
-    args = parse_options(program, description, decode)
+    args = parse_options(program, description, decode, fanout)
+    if fanout:
+        from .audio.fanout import get_targets_programs
+
+        programs = list(programs) + [program for program in get_targets_programs(args.targets)
+                                     if program not in programs]
+
+    # Checks the external programs before doing anything else
+    missing = get_missing_programs(programs)
+    if missing:
+        _logger.error(ERROR_PROGRAMS.format(', '.join(missing)))
+        sys.exit(1)
 
-    # Checks the input files
-    files = get_input_files(args.input_files)
-    if len(files) == 0:
+    # Checks the input files (only the first one is looked up; the rest are found while the first
+    # ones are converted)
+    files = iter_input_files(args.input_files, extensions, args.include, args.exclude)
+    first = next(files, None)
+    if first is None:
         _logger.error(ERROR_EMPTY_LIST)
         sys.exit(1)
+    files = chain([first], files)
 
     # TODO: this bit needs to be completely reviewed!
     # Checks the output directory, cover and tag parameters 
@@ -82,14 +245,211 @@ def get_options(program, description, decode=False):
         sys.exit(1)
     """
     if not directory_exists(args.output_dir):
-        _logger.error(ERROR.format('Directory', args.output_dir))
+        _logger.error(ERROR_UNAVAILABLE.format('Directory', args.output_dir))
+        sys.exit(1)
+    if args.scratch and not directory_exists(args.scratch):
+        sys.exit(1)
+    if args.playlist and not directory_exists(str(Path(args.playlist).resolve().parent)):
         sys.exit(1)
 
     #return files, args.output_dir, args.cover, args.tags, args.playlist
-    return files, args.output_dir
+    return files, args
 
 
+def report_results(results: Iterable[Result]) -> int:
+    """
+    Logs the outcome of a batch of conversion jobs.
+    :param results: The outcome of each conversion job
+    :return: The exit status of the program (0 if every job succeeded; 1 otherwise)
+    """
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    for result in results:
+        count_result(result, counts)
+    return report_counts(counts)
+
 
+async def report_results_async(results: AsyncIterator[Result]) -> int:
+    """
+    Logs the outcome of a batch of conversion jobs run on an event loop (see 'report_results').
+    :param results: The outcome of each conversion job
+    :return: The exit status of the program (0 if every job succeeded; 1 otherwise)
+    """
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    async for result in results:
+        count_result(result, counts)
+    return report_counts(counts)
+
+
+def count_result(result: Result, counts: dict):
+    """
+    Counts the outcome of a conversion job, logging it if it failed.
+    :param result: The outcome of the conversion job
+    :param counts: The number of converted, skipped and failed jobs
+    """
+    if result.failed:
+        _logger.error(ERROR_JOB.format(result.filename, result.error))
+        counts['failed'] += 1
+    elif result.skipped:
+        counts['skipped'] += 1
+    else:
+        counts['converted'] += 1
+
+
+def report_counts(counts: dict) -> int:
+    """
+    Logs the summary of a batch of conversion jobs.
+    :param counts: The number of converted, skipped and failed jobs
+    :return: The exit status of the program (0 if every job succeeded; 1 otherwise)
+    """
+    _logger.info(SUMMARY.format(counts['converted'], counts['skipped'], counts['failed']))
+    return 1 if counts['failed'] else 0
+
+
+def convert(program: str, files: Iterable[str], options: argparse.Namespace,
+            conversion: 'Conversion' = None) -> int:
+    """
+    Runs a conversion over the input files and reports the outcome.
+    :param program: The name of the program (which is also the name of the conversion)
+    :param files: The input files
+    :param options: The command line arguments
+    :param conversion: The conversion (defaults to the one named after the program)
+    :return: The exit status of the program (0 if every file was converted; 1 if any failed; 130
+        if the program was interrupted)
+    """
+    from .api import CONVERSIONS
+    from .journal import Journal
+    from .manifest import Manifest
+    from .metadata import get_cover_cache, get_duration
+    from .profile import get_profile, ProfileSelector
+    from .stats import Recorder, set_recorder
+
+    conversion = conversion or CONVERSIONS[program]
+    selector = ProfileSelector(get_profile(options.profile) if options.profile else None)
+    function = conversion.job(selector)
+
+    manifest = None
+    if options.incremental:
+        manifest = Manifest(options.output_dir, program, conversion.settings(selector))
+
+    # The jobs with a time limit run on an event loop, which kills their programs on time
+    if options.timeout is not None:
+        return run_engine(conversion.job(selector, asynchronous=True), files, options, manifest)
+
+    # The playlist follows the order in which the files are listed, before they are planned
+    playlist = None
+    if options.playlist:
+        from .playlist import Playlist
+
+        playlist = Playlist(options.playlist)
+        files = playlist.queue(files)
+        function = playlist.track(function)
+
+    def add_resumed(filename: str, output: str):
+        playlist.add(Result(filename, output, skipped=True))
+
+    on_resumed = add_resumed if playlist is not None else None
+
+    plan = None
+    if options.plan:
+        from .planner import plan_jobs
+
+        plan = plan_jobs(files, options.jobs)
+        files = plan
+        function = plan.track(function)
+
+    journal = Journal(options.output_dir, program, options.resume)
+    files = journal.queue(files, on_resumed)
+    function = journal.track(function)
+
+    scratch = None
+    if options.scratch:
+        from .scratch import Scratch
+
+        scratch = Scratch(options.scratch, options.scratch_budget)
+        function = scratch.track(function)
+
+    recorder = None
+    if options.stats_json:
+        recorder = Recorder(get_duration)
+        set_recorder(recorder)
+
+    # The journal is only kept if the batch is interrupted or fails, so it can be resumed
+    status = 130
+    try:
+        with get_cover_cache(), Scheduler(options.jobs) as scheduler:
+            results = scheduler.run(function, files, options.output_dir, manifest)
+            if playlist is not None:
+                results = playlist.record(results)
+            status = report_results(results)
+            return status
+    except KeyboardInterrupt:
+        keyboard_interrupt()
+        return 130
+    finally:
+        journal.close(remove=status == 0)
+        if journal.resumed:
+            _logger.info(RESUMED.format(journal.resumed))
+        if plan is not None:
+            _logger.info(plan.summary())
+        if manifest is not None:
+            manifest.save()
+        if recorder is not None:
+            set_recorder(None)
+            recorder.save(options.stats_json, options.jobs)
+        if scratch is not None:
+            scratch.close()
+        if playlist is not None:
+            playlist.close()
+            _logger.info(PLAYLIST.format(playlist.count, playlist.path))
+
+
+def run_engine(function, files: Iterable[str], options: argparse.Namespace,
+               manifest: 'Manifest' = None) -> int:
+    """
+    Runs a conversion over the input files on an event loop, where each job is cancelled (and its
+    programs killed) once it runs for longer than the time limit.
+    :param function: The conversion coroutine function
+    :param files: The input files
+    :param options: The command line arguments
+    :param manifest: The manifest of previous conversions (in incremental mode)
+    :return: The exit status of the program (0 if every file was converted; 1 if any failed or ran
+        out of time; 130 if the program was interrupted)
+    """
+    from asyncio import run
+    from .metadata import get_cover_cache, get_duration
+    from .process import Engine
+    from .stats import Recorder, set_recorder
+
+    recorder = None
+    if options.stats_json:
+        recorder = Recorder(get_duration)
+        set_recorder(recorder)
+
+    engine = Engine(options.jobs, options.timeout)
+    try:
+        with get_cover_cache():
+            return run(report_results_async(engine.run(function, files, options.output_dir,
+                                                       manifest)))
+    except KeyboardInterrupt:
+        keyboard_interrupt()
+        return 130
+    finally:
+        if manifest is not None:
+            manifest.save()
+        if recorder is not None:
+            set_recorder(None)
+            recorder.save(options.stats_json, options.jobs)
+
+
+def report_result(result: Result):
+    """
+    Logs the outcome of a single conversion job.
+    :param result: The outcome of the conversion job
+    """
+    if result.failed:
+        _logger.error(ERROR_JOB.format(result.filename, result.error))
+    elif not result.skipped:
+        _logger.info(CONVERTED.format(result.filename, result.output))
 
 
 # Methods :: File system library
@@ -102,7 +462,7 @@ def file_exists(filename):
     """
     try:
         if not isfile(filename):
-            _logger.error(ERROR.format('File', filename))
+            _logger.error(ERROR_UNAVAILABLE.format('File', filename))
             return False
     except TypeError:
         _logger.error(ERROR_INVALID.format('File', filename))
@@ -119,7 +479,7 @@ def directory_exists(directory):
     """
     try:
         if not isdir(directory):
-            _logger.error(ERROR.format('Directory', directory))
+            _logger.error(ERROR_UNAVAILABLE.format('Directory', directory))
             return False
     except TypeError:
         _logger.error(ERROR_INVALID.format('Directory', directory))
@@ -128,25 +488,36 @@ def directory_exists(directory):
     return True
 
 
-def get_input_files(entries):
+def iter_input_files(entries, extensions: Iterable[str] = (), include: Iterable[str] = (),
+                     exclude: Iterable[str] = ()) -> Iterator[str]:
     """
-    Checks and stores the input files provided in the command line interface.
+    Lazily checks and yields the input files provided in the command line interface.
+    The directories are walked by a background thread, a bounded number of files ahead of the ones
+    consumed, so the first files are available right away and the rest are found while the first
+    ones are converted. The filters only apply to the files found inside directories; the files
+    given explicitly are always accepted.
     :param entries: The set of input entries (can be either files or directories)
-    :return: A complete list of the input files
+    :param extensions: The accepted file extensions (all files are accepted if empty)
+    :param include: The glob patterns that files must match (all files are accepted if empty)
+    :param exclude: The glob patterns of the files and directories that are skipped
+    :return: The input files
     """
-    result = []
     try:
         for entry in entries:
             if isfile(entry):
-                result.append(entry)
+                yield entry
             elif isdir(entry):
-                for root, directories, files in walk(entry):
-                    for filename in files:
-                        file_path = join(root, filename)
-                        result.append(file_path)
+                yield from prefetch(walk_files(entry, extensions, include, exclude))
             else:
-                _logger.error(ERROR.format('File system entry', entry))
+                _logger.error(ERROR_UNAVAILABLE.format('File system entry', entry))
     except TypeError:
         _logger.error(ERROR_INVALID_LIST)
 
-    return result
\ No newline at end of file
+
+def get_input_files(entries):
+    """
+    Checks and stores the input files provided in the command line interface.
+    :param entries: The set of input entries (can be either files or directories)
+    :return: A complete list of the input files
+    """
+    return list(iter_input_files(entries))
@@ -0,0 +1,199 @@
+# -*- coding: utf8 -*-
+
+"""
+Write-ahead journal of a batch of conversions, which allows an interrupted batch to be resumed.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from json import dumps, loads
+from os import fsync, stat
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Iterable, Iterator, Optional
+
+from anarky.utils import get_outputs
+
+JOURNAL = '.anarky-journal.jsonl'
+VERSION = 2
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Journal:
+    """
+    Journal of the conversions of a batch, stored in the output directory.
+
+    Every change of state of a file (queued, running, done or failed) is appended to the journal
+    before the change happens, so the journal survives a killed process; the final state of each
+    file is also synced to disk, so it survives a crash of the system. When a batch is resumed,
+    the files that were done (whose input didn't change and whose outputs are still there) are
+    skipped; the others are converted again.
+
+    The journal holds one JSON record per line. The first record identifies the conversion; a
+    record cut short by a crash is removed when the journal is resumed. A batch that finishes
+    cleanly removes its journal as it's closed.
+    """
+
+    def __init__(self, directory: str, conversion: str, resume: bool = False):
+        """
+        :param directory:
+            The output directory where the journal is stored
+        :param conversion:
+            The name of the conversion (e.g. 'flac2mp3')
+        :param resume:
+            Flag that indicates if the previous journal is resumed (otherwise, it's discarded)
+        """
+        self.path = Path(directory, JOURNAL)
+        self.conversion = conversion
+        self.entries = {}
+        self.resumed = 0
+        self._lock = Lock()
+
+        loaded = resume and self._load()
+        self._file = open(self.path, 'a' if loaded else 'w')
+        if not loaded:
+            self._write({'version': VERSION, 'conversion': conversion})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return str(Path(filename).resolve())
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, 'rb') as journal_file:
+                content = journal_file.read()
+        except FileNotFoundError:
+            return False
+
+        # A record cut short by a crash has no line break, and the next record would be appended to
+        # it, so it's removed
+        complete = content.rfind(b'\n') + 1
+        if complete < len(content):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(complete)
+
+        records = []
+        for line in content[:complete].decode(errors='replace').splitlines():
+            try:
+                records.append(loads(line))
+            except ValueError:
+                continue
+        if not records or records[0] != {'version': VERSION, 'conversion': self.conversion}:
+            return False
+
+        for record in records[1:]:
+            self.entries[record['file']] = record
+
+        return True
+
+    def _write(self, record: dict, sync: bool = False):
+        with self._lock:
+            self._file.write(dumps(record) + '\n')
+            self._file.flush()
+            descriptor = self._file.fileno()
+
+        # The workers don't wait for each other while the journal is synced
+        if sync:
+            fsync(descriptor)
+
+    def _record(self, filename: str, state: str, **values):
+        record = dict(file=self._key(filename), state=state, **values)
+        self._write(record, sync=state in (DONE, FAILED))
+        with self._lock:
+            self.entries[record['file']] = record
+
+    def is_done(self, filename: str) -> bool:
+        """
+        Checks if a file was converted by the batch.
+
+        :param filename:
+            The input audio file name
+        :return:
+            True if the file was converted, it didn't change since then and its outputs still
+            exist; False otherwise
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(filename))
+        if entry is None or entry['state'] != DONE or entry.get('output') is None:
+            return False
+
+        try:
+            source = stat(filename)
+        except OSError:
+            return False
+        return (source.st_size, source.st_mtime_ns) == (entry.get('size'), entry.get('mtime')) \
+            and all(Path(output).is_file() for output in entry.get('outputs', [entry['output']]))
+
+    def queue(self, files: Iterable[str],
+              resumed: Optional[Callable[[str, str], None]] = None) -> Iterator[str]:
+        """
+        Records the files as they are queued, skipping those that are already done.
+
+        :param files:
+            The input audio file names
+        :param resumed:
+            The function called with the name and output file of each file that is skipped
+        :return:
+            The input audio file names that still need to be converted
+        """
+        for filename in files:
+            if self.is_done(filename):
+                self.resumed += 1
+                if resumed is not None:
+                    resumed(filename, self.entries[self._key(filename)]['output'])
+                continue
+            self._record(filename, QUEUED)
+            yield filename
+
+    def track(self, function: Callable[[str, str], str]) -> Callable[[str, str], str]:
+        """
+        Wraps a conversion function, so the start and outcome of each conversion are recorded.
+
+        :param function:
+            The conversion function (e.g. 'encode_wav_flac')
+        :return:
+            The wrapped conversion function
+        """
+        def convert(filename: str, destination: str) -> str:
+            self._record(filename, RUNNING)
+            try:
+                # The input is checked before the conversion, so a change made while it runs is
+                # picked up by the next batch
+                source = stat(filename)
+                output = function(filename, destination)
+            except BaseException as e:
+                self._record(filename, FAILED, error='{}: {}'.format(type(e).__name__, e))
+                raise
+            outputs = get_outputs(output)
+            self._record(filename, DONE, output=outputs[0] if outputs else None, outputs=outputs,
+                         size=source.st_size, mtime=source.st_mtime_ns)
+            return output
+
+        return convert
+
+    def close(self, remove: bool = False):
+        """
+        Closes the journal.
+
+        :param remove:
+            Flag that indicates if the journal is removed (once the batch finished cleanly, so
+            there's nothing left to resume)
+        """
+        with self._lock:
+            self._file.close()
+        if remove:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,353 @@
+# -*- coding: utf8 -*-
+
+"""
+Persistent index of an audio library, which answers queries on the tags and stream properties of
+the audio files without reading them.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from hashlib import sha256
+from os import sep, stat
+from os.path import isdir, isfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import sqlite3
+
+from anarky.audio.wav import read_wav_info
+from anarky.enum.audio_file import AudioFile
+from anarky.metadata import read_flac_metadata, TAGS
+from anarky.programs import get_cache_directory
+from anarky.utils import update_path, walk_files
+
+INDEX_FILE = 'library.db'
+VERSION = 2
+
+# Number of files written to the index in each transaction
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE files (
+    path TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    bits_per_sample INTEGER,
+    error TEXT
+);
+CREATE TABLE tags (
+    path TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    folded TEXT NOT NULL
+);
+CREATE INDEX tags_value ON tags (name, folded);
+CREATE INDEX tags_path ON tags (path);
+CREATE TABLE covers (
+    path TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    type INTEGER NOT NULL,
+    mime TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX covers_path ON covers (path);
+CREATE INDEX covers_digest ON covers (digest);
+'''
+
+# Fields of LibraryEntry stored in the 'files' table (besides the file name, stored as 'path')
+FILE_FIELDS = ('format', 'size', 'mtime', 'duration', 'sample_rate', 'channels', 'bits_per_sample',
+               'error')
+
+
+class Cover(NamedTuple):
+    """
+    Picture embedded in an audio file, identified by the SHA-256 digest of its contents.
+    """
+    type: int
+    mime: str
+    width: int
+    height: int
+    digest: str
+
+
+class LibraryEntry(NamedTuple):
+    """
+    Indexed properties of an audio file.
+    """
+    filename: str
+    format: str
+    size: int
+    mtime: int
+    duration: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    bits_per_sample: Optional[int] = None
+    error: Optional[str] = None
+    tags: Dict[str, List[str]] = {}
+    covers: Tuple[Cover, ...] = ()
+
+
+class UpdateSummary(NamedTuple):
+    """
+    Outcome of an update of the library index.
+    """
+    added: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: int = 0
+
+
+def read_entry(filename: str, size: int, mtime: int) -> LibraryEntry:
+    """
+    Reads the properties of an audio file from its header (and, for FLAC audio files, its tags and
+    pictures).
+
+    Only the tags in TAGS (the ones that are written into the converted files) are kept.
+
+    :param filename:
+        The input audio file name
+    :param size:
+        The size of the file
+    :param mtime:
+        The modification time of the file (in nanoseconds)
+    :return:
+        The properties of the audio file (with the 'error' found, if the header can't be read)
+    """
+    extension = Path(filename).suffix.lower()
+    entry = LibraryEntry(filename, extension.lstrip('.'), size, mtime)
+    try:
+        if extension == AudioFile.FLAC.value:
+            metadata = read_flac_metadata(filename)
+            info = metadata.stream_info
+            covers = tuple(Cover(picture.type, picture.mime, picture.width, picture.height,
+                                 sha256(picture.data).hexdigest())
+                           for picture in metadata.pictures)
+            return entry._replace(duration=info.duration, sample_rate=info.sample_rate,
+                                  channels=info.channels, bits_per_sample=info.bits_per_sample,
+                                  tags={tag: values for tag, values in metadata.tags.items()
+                                        if tag in TAGS},
+                                  covers=covers)
+        if extension == AudioFile.WAV.value:
+            info = read_wav_info(filename)
+            return entry._replace(duration=info.duration, sample_rate=info.format.sample_rate,
+                                  channels=info.format.channels,
+                                  bits_per_sample=info.format.bits_per_sample)
+    except (OSError, ValueError) as e:
+        return entry._replace(error='{}: {}'.format(type(e).__name__, e))
+
+    return entry
+
+
+def without_output(files: Iterable[str], destination: str, extension: str) -> Iterator[str]:
+    """
+    Filters out the files that were already converted into a destination.
+
+    :param files:
+        The input audio file names
+    :param destination:
+        The destination where the output files are stored
+    :param extension:
+        The extension of the output files (e.g. '.mp3')
+    :return:
+        The input audio file names whose output file doesn't exist
+    """
+    for filename in files:
+        if not update_path(filename, destination, extension).is_file():
+            yield filename
+
+
+class LibraryIndex:
+    """
+    Index of the FLAC and WAV audio files of a library, stored in a SQLite database in the Anarky
+    cache directory.
+
+    Each file is recorded with its format, size, modification time, stream properties, tags and
+    cover digests. An update only reads the files whose size or modification time changed (and
+    forgets the ones that were removed), so keeping a large library indexed costs little more
+    than listing it. Queries are answered from the index alone.
+
+    Example::
+
+        with LibraryIndex() as index:
+            index.update(['/srv/flac'])
+            files = index.select(AudioFile.FLAC.value, {'ARTIST': 'Nina Simone'})
+            with Converter('flac2mp3', '/srv/mp3') as converter:
+                converter.convert_all(without_output(files, '/srv/mp3', AudioFile.MP3.value))
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path:
+            The database file of the index (defaults to the Anarky cache directory)
+        """
+        self.path = Path(path) if path else get_cache_directory() / INDEX_FILE
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path))
+        self._connection.execute('PRAGMA foreign_keys = ON')
+
+        # The index is a cache: one written by another version is rebuilt from scratch
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != VERSION:
+            self._connection.executescript(
+                'DROP TABLE IF EXISTS covers; DROP TABLE IF EXISTS tags; DROP TABLE IF EXISTS '
+                'files;' + SCHEMA + 'PRAGMA user_version = {};'.format(VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return str(Path(filename).resolve())
+
+    def _write(self, entries: List[LibraryEntry]):
+        with self._connection:
+            self._connection.executemany('DELETE FROM files WHERE path = ?',
+                                         [(entry.filename,) for entry in entries])
+            self._connection.executemany(
+                'INSERT INTO files (path, {}) VALUES (:filename, {})'.format(
+                    ', '.join(FILE_FIELDS), ', '.join(':' + field for field in FILE_FIELDS)),
+                [entry._asdict() for entry in entries])
+            self._connection.executemany(
+                'INSERT INTO tags (path, name, value, folded) VALUES (?, ?, ?, ?)',
+                [(entry.filename, tag, value, value.casefold()) for entry in entries
+                 for tag, values in entry.tags.items() for value in values])
+            self._connection.executemany(
+                'INSERT INTO covers VALUES (?, ?, ?, ?, ?, ?)',
+                [(entry.filename,) + cover for entry in entries for cover in entry.covers])
+
+    def _remove(self, filenames: List[str]):
+        with self._connection:
+            self._connection.executemany('DELETE FROM files WHERE path = ?',
+                                         [(filename,) for filename in filenames])
+
+    def update(self, paths: Iterable[str], include: Iterable[str] = (),
+               exclude: Iterable[str] = ()) -> UpdateSummary:
+        """
+        Brings the index up to date with the given files and directories.
+
+        The files inside the directories that are no longer there are removed from the index.
+
+        :param paths:
+            The audio file names and directories (where the FLAC and WAV audio files are looked up)
+        :param include:
+            The glob patterns that the files inside directories must match
+        :param exclude:
+            The glob patterns of the files and directories that are skipped
+        :return:
+            The number of files added, updated, unchanged, removed and that couldn't be read
+        """
+        known = {path: (size, mtime) for path, size, mtime in
+                 self._connection.execute('SELECT path, size, mtime FROM files')}
+        extensions = [AudioFile.FLAC.value, AudioFile.WAV.value]
+        counts = dict.fromkeys(UpdateSummary._fields, 0)
+        seen = set()
+        roots = []
+        explicit = set()
+        pending = []
+        for path in paths:
+            if isdir(path):
+                roots.append(self._key(path))
+                files = walk_files(str(path), extensions, include, exclude)
+            else:
+                explicit.add(self._key(path))
+                files = [path]
+
+            for filename in files:
+                key = self._key(filename)
+                if key in seen:
+                    continue
+                seen.add(key)
+                try:
+                    status = stat(key)
+                except OSError:
+                    continue
+                if known.get(key) == (status.st_size, status.st_mtime_ns):
+                    counts['unchanged'] += 1
+                    continue
+
+                entry = read_entry(key, status.st_size, status.st_mtime_ns)
+                counts['added' if key not in known else 'updated'] += 1
+                counts['failed'] += entry.error is not None
+                pending.append(entry)
+                if len(pending) >= BATCH_SIZE:
+                    self._write(pending)
+                    pending = []
+        self._write(pending)
+
+        # A file that wasn't seen is only forgotten if it's gone (and not just filtered out)
+        removed = [key for key in known if key not in seen and not isfile(key) and (
+            key in explicit or any(key.startswith(root + sep) for root in roots))]
+        self._remove(removed)
+        counts['removed'] = len(removed)
+
+        return UpdateSummary(**counts)
+
+    def get(self, filename: str) -> Optional[LibraryEntry]:
+        """
+        Retrieves the indexed properties of an audio file.
+
+        :param filename:
+            The audio file name
+        :return:
+            The properties of the audio file (None if it isn't indexed)
+        """
+        key = self._key(filename)
+        row = self._connection.execute('SELECT {} FROM files WHERE path = ?'.format(
+            ', '.join(FILE_FIELDS)), (key,)).fetchone()
+        if row is None:
+            return None
+
+        tags = {}
+        for tag, value in self._connection.execute(
+                'SELECT name, value FROM tags WHERE path = ? ORDER BY rowid', (key,)):
+            tags.setdefault(tag, []).append(value)
+        covers = tuple(Cover(*cover) for cover in self._connection.execute(
+            'SELECT type, mime, width, height, digest FROM covers WHERE path = ? ORDER BY rowid',
+            (key,)))
+
+        return LibraryEntry(key, tags=tags, covers=covers, **dict(zip(FILE_FIELDS, row)))
+
+    def select(self, extension: str = None, tags: Dict[str, str] = None,
+               cover: bool = None) -> List[str]:
+        """
+        Selects the indexed audio files that match every given criteria.
+
+        :param extension:
+            The extension of the audio files (e.g. '.flac'; any if None)
+        :param tags:
+            The values of the tags the audio files must have (case insensitive in any script,
+            e.g. {'ARTIST': 'Nina Simone'}); a tag with several values matches any of them
+        :param cover:
+            Flag that indicates if the audio files must have (True) or lack (False) pictures
+        :return:
+            The audio file names, sorted
+        """
+        conditions = ['error IS NULL']
+        parameters = []
+        if extension is not None:
+            conditions.append('format = ?')
+            parameters.append(extension.lower().lstrip('.'))
+        for tag, value in (tags or {}).items():
+            conditions.append('path IN (SELECT path FROM tags WHERE name = ? AND folded = ?)')
+            parameters += [tag.upper(), value.casefold()]
+        if cover is not None:
+            conditions.append('{} EXISTS (SELECT 1 FROM covers WHERE covers.path = files.path)'
+                              .format('' if cover else 'NOT'))
+
+        query = 'SELECT path FROM files WHERE {} ORDER BY path'.format(' AND '.join(conditions))
+        return [row[0] for row in self._connection.execute(query, parameters)]
+
+    def close(self):
+        """
+        Closes the index.
+        """
+        self._connection.close()
@@ -0,0 +1,209 @@
+# -*- coding: utf8 -*-
+
+"""
+Persistent record of the conversions carried out in an output directory.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from hashlib import sha256
+from json import dump, load
+from os import replace
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Callable, Sequence, Union
+
+from anarky.utils import get_outputs
+
+MANIFEST = '.anarky-manifest.json'
+VERSION = 1
+CHUNK_SIZE = 1 << 20
+
+# Number of conversions, or seconds, after which the manifest is written during a batch
+CHECKPOINT_FILES = 100
+CHECKPOINT_SECONDS = 30.0
+
+
+def hash_file(filename: str) -> str:
+    """
+    Calculates the SHA-256 digest of the contents of a file.
+
+    :param filename:
+        The name of the file
+    :return:
+        The hexadecimal digest of the file contents
+    """
+    digest = sha256()
+    with open(filename, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Manifest of the files converted into an output directory.
+
+    Each input file is recorded, per conversion, with its size, modification time and content
+    hash, along with the encoder settings and the output files it produced (the first one, plus
+    any 'extra_outputs' of a fan-out conversion). A conversion is up to date while the input file,
+    the settings and every output file are all unchanged. The content hash
+    is only computed when the size and modification time of the input file aren't enough to decide.
+
+    The manifest is written periodically while a batch runs (see 'checkpoint'), so an interrupted
+    or crashed batch keeps most of its records.
+    """
+
+    def __init__(self, directory: str, conversion: str, settings: Union[str, Callable[[str], str]]):
+        """
+        :param directory:
+            The output directory where the manifest is stored
+        :param conversion:
+            The name of the conversion (e.g. 'wav2flac')
+        :param settings:
+            The encoder settings used in the conversions (or a function that retrieves the
+            settings used for each input file)
+        """
+        self.path = Path(directory, MANIFEST)
+        self.conversion = conversion
+        self.settings = settings
+        self.content = {}
+        self._lock = Lock()
+        self._changed = False
+        self._updates = 0
+        self._saved = monotonic()
+
+        try:
+            with open(self.path, 'r') as manifest_file:
+                content = load(manifest_file)
+            if content.get('version') == VERSION:
+                self.content = content.get('conversions', {})
+        except (FileNotFoundError, ValueError):
+            pass
+        self.entries = self.content.setdefault(conversion, {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return str(Path(filename).resolve())
+
+    def _settings(self, filename: str) -> str:
+        return self.settings(filename) if callable(self.settings) else self.settings
+
+    def is_up_to_date(self, filename: str) -> bool:
+        """
+        Checks if the output of a previous conversion of the given file is still valid.
+
+        :param filename:
+            The input audio file name
+        :return:
+            True if the file doesn't need to be converted again; False otherwise
+        """
+        key = self._key(filename)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is None or entry['settings'] != self._settings(filename):
+            return False
+
+        try:
+            source = Path(filename).stat()
+            for output in [entry] + entry.get('extra_outputs', []):
+                target = Path(output['output']).stat()
+                if (target.st_size, target.st_mtime_ns) != \
+                        (output['output_size'], output['output_mtime']):
+                    return False
+        except OSError:
+            return False
+
+        if source.st_size != entry['size']:
+            return False
+        if source.st_mtime_ns == entry['mtime']:
+            return True
+
+        # The file was touched, but its contents may be the same
+        if hash_file(filename) != entry['hash']:
+            return False
+
+        with self._lock:
+            entry['mtime'] = source.st_mtime_ns
+            self._changed = True
+        return True
+
+    def get_output(self, filename: str) -> str:
+        """
+        Retrieves the output file recorded for the given file.
+
+        :param filename:
+            The input audio file name
+        :return:
+            The name of the output file (None if the file isn't in the manifest)
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(filename))
+        return None if entry is None else entry['output']
+
+    def update(self, filename: str, output: Union[str, Sequence[str]]):
+        """
+        Records a successful conversion.
+
+        :param filename:
+            The input audio file name
+        :param output:
+            The name of the output file (or the names of every output file, the first one being
+            the one reported)
+        """
+        source = Path(filename).stat()
+        outputs = []
+        for name in get_outputs(output):
+            target = Path(name).stat()
+            outputs.append({
+                'output': str(Path(name).resolve()),
+                'output_size': target.st_size,
+                'output_mtime': target.st_mtime_ns
+            })
+        entry = dict({
+            'size': source.st_size,
+            'mtime': source.st_mtime_ns,
+            'hash': hash_file(filename),
+            'settings': self._settings(filename)
+        }, **outputs[0])
+        if len(outputs) > 1:
+            entry['extra_outputs'] = outputs[1:]
+        with self._lock:
+            self.entries[self._key(filename)] = entry
+            self._changed = True
+            self._updates += 1
+
+    def checkpoint(self):
+        """
+        Writes the manifest if enough conversions were recorded, or enough time passed, since it
+        was last written (see CHECKPOINT_FILES and CHECKPOINT_SECONDS).
+        """
+        with self._lock:
+            due = self._updates >= CHECKPOINT_FILES or \
+                monotonic() - self._saved >= CHECKPOINT_SECONDS
+        if due:
+            self.save()
+
+    def save(self):
+        """
+        Writes the manifest to the output directory, if anything changed.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            temporary = self.path.with_name(self.path.name + '.tmp')
+            with open(temporary, 'w') as manifest_file:
+                dump({'version': VERSION, 'conversions': self.content}, manifest_file, indent=4)
+            replace(str(temporary), str(self.path))
+            self._changed = False
+            self._updates = 0
+            self._saved = monotonic()
@@ -7,13 +7,21 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
+from functools import lru_cache
+from hashlib import sha256
 from json import dump, load
+from os import replace, stat
 from os.path import join
-from subprocess import call, CalledProcessError, check_output, PIPE, Popen
-import sys
+from struct import error as StructError, unpack
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional
 
-from anarky.enum.program import Program
-from anarky.utils import ENCODING, is_string_empty, update_extension, update_path
+from anarky.audio.wav import read_wav_info
+from anarky.enum.audio_file import AudioFile
+from anarky.stats import stage
+from anarky.utils import ENCODING, is_string_empty, update_extension
 
 
 """
@@ -44,47 +52,397 @@ TAGS = {
 }
 
 
-def get_cover(filename: str, destination: str) -> str:
+# FLAC metadata block types (see https://xiph.org/flac/format.html#metadata_block)
+STREAMINFO = 0
+VORBIS_COMMENT = 4
+PICTURE = 6
+
+# Picture type of the front cover in a PICTURE block
+FRONT_COVER = 3
+
+FLAC_SIGNATURE = b'fLaC'
+ID3_SIGNATURE = b'ID3'
+
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif'
+}
+
+# Number of audio headers whose properties are kept (see 'read_audio_header')
+HEADER_CACHE_SIZE = 4096
+
+
+class StreamInfo(NamedTuple):
+    """
+    Properties of the audio stream, stored in the STREAMINFO block.
+    """
+    sample_rate: int
+    channels: int
+    bits_per_sample: int
+    total_samples: int
+    md5: str
+
+    @property
+    def duration(self) -> float:
+        """
+        Calculates the duration of the audio stream.
+
+        :return:
+            The duration in seconds (0 if the number of samples is unknown)
+        """
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+
+class Picture(NamedTuple):
+    """
+    Picture stored in a PICTURE block.
+    """
+    type: int
+    mime: str
+    description: str
+    width: int
+    height: int
+    data: bytes
+
+
+class FlacMetadata(NamedTuple):
+    """
+    Metadata of a FLAC audio file.
+    """
+    stream_info: StreamInfo
+    tags: Dict[str, List[str]]
+    pictures: List[Picture]
+
+
+def _parse_stream_info(block: bytes) -> StreamInfo:
+    # Bytes 10 to 17 hold the sample rate (20 bits), the number of channels minus one (3 bits),
+    # the bits per sample minus one (5 bits) and the total number of samples (36 bits)
+    (packed,) = unpack('>Q', block[10:18])
+    return StreamInfo(sample_rate=packed >> 44,
+                      channels=((packed >> 41) & 0x07) + 1,
+                      bits_per_sample=((packed >> 36) & 0x1F) + 1,
+                      total_samples=packed & 0xFFFFFFFFF,
+                      md5=block[18:34].hex())
+
+
+def _parse_vorbis_comment(block: bytes) -> Dict[str, List[str]]:
+    # Unlike the rest of the FLAC metadata, the Vorbis comment lengths are little-endian
+    (vendor_length,) = unpack('<I', block[0:4])
+    offset = 4 + vendor_length
+    (count,) = unpack('<I', block[offset:offset + 4])
+    offset += 4
+
+    tags = {}
+    for _ in range(count):
+        (length,) = unpack('<I', block[offset:offset + 4])
+        comment = block[offset + 4:offset + 4 + length].decode(ENCODING, errors='replace')
+        offset += 4 + length
+        name, separator, value = comment.partition('=')
+        if separator:
+            tags.setdefault(name.upper(), []).append(value)
+
+    return tags
+
+
+def _parse_picture(block: bytes) -> Picture:
+    (picture_type, mime_length) = unpack('>II', block[0:8])
+    offset = 8 + mime_length
+    mime = block[8:offset].decode('ascii', errors='replace')
+    (description_length,) = unpack('>I', block[offset:offset + 4])
+    offset += 4
+    description = block[offset:offset + description_length].decode(ENCODING, errors='replace')
+    offset += description_length
+    (width, height, _, _, data_length) = unpack('>IIIII', block[offset:offset + 20])
+    offset += 20
+    return Picture(picture_type, mime, description, width, height,
+                   block[offset:offset + data_length])
+
+
+def get_id3_size(header: bytes) -> int:
+    """
+    Retrieves the total size of an ID3v2 tag from its 10 byte header.
+
+    The size in the header is a 28-bit "synchsafe" integer (7 bits per byte), which doesn't include
+    the header itself nor the optional 10 byte footer (flag 0x10).
+
+    :param header:
+        The header of the ID3v2 tag
+    :return:
+        The number of bytes from the beginning of the tag to the data that follows it
+    """
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+
+    return size + (20 if header[5] & 0x10 else 10)
+
+
+def _skip_id3(handle) -> bytes:
+    # Some taggers prepend an ID3v2 tag to FLAC files, which the decoders are expected to skip
+    signature = handle.read(4)
+    if signature[:3] == ID3_SIGNATURE:
+        header = signature + handle.read(6)
+        if len(header) < 10:
+            return b''
+        handle.seek(get_id3_size(header) - len(header), 1)
+        signature = handle.read(4)
+
+    return signature
+
+
+def read_flac_metadata(filename: str, pictures: bool = True) -> FlacMetadata:
+    """
+    Reads the metadata blocks of a FLAC audio file in a single pass.
+
+    Only the metadata blocks at the beginning of the file are read; the audio frames are never
+    touched.
+
+    :param filename:
+        The input audio file name
+    :param pictures:
+        Flag that indicates if the PICTURE blocks are read (otherwise they are skipped)
+    :return:
+        The stream properties, Vorbis comments and pictures of the audio file
+    :raise ValueError:
+        If the file isn't a FLAC audio file
+    """
+    stream_info = None
+    tags = {}
+    images = []
+    with open(filename, 'rb') as handle:
+        if _skip_id3(handle) != FLAC_SIGNATURE:
+            raise ValueError("'{}' is not a FLAC audio file".format(filename))
+
+        last = False
+        while not last:
+            header = handle.read(4)
+            if len(header) < 4:
+                raise ValueError("'{}' has truncated metadata".format(filename))
+
+            last = bool(header[0] & 0x80)
+            block_type = header[0] & 0x7F
+            (length,) = unpack('>I', b'\x00' + header[1:4])
+            try:
+                if block_type == STREAMINFO:
+                    stream_info = _parse_stream_info(handle.read(length))
+                elif block_type == VORBIS_COMMENT:
+                    tags.update(_parse_vorbis_comment(handle.read(length)))
+                elif block_type == PICTURE and pictures:
+                    images.append(_parse_picture(handle.read(length)))
+                else:
+                    handle.seek(length, 1)
+            except StructError:
+                raise ValueError("'{}' has a corrupted metadata block".format(filename))
+
+    if stream_info is None:
+        raise ValueError("'{}' has no STREAMINFO block".format(filename))
+
+    return FlacMetadata(stream_info, tags, images)
+
+
+def get_front_cover(metadata: FlacMetadata) -> Picture:
+    """
+    Retrieves the front cover from the pictures of a FLAC audio file.
+
+    :param metadata:
+        The metadata of the audio file
+    :return:
+        The front cover (or the first picture, if none is marked as such; None if there are none)
+    """
+    for picture in metadata.pictures:
+        if picture.type == FRONT_COVER:
+            return picture
+
+    return metadata.pictures[0] if metadata.pictures else None
+
+
+class CoverCache:
+    """
+    Cache of cover art pictures, keyed by the hash of their contents.
+
+    The tracks of an album usually embed the same picture, which is only written once per
+    directory: the following tracks get the name of the file written for the first one. A file
+    left by a previous run is reused if its contents match. Pictures stored without a destination
+    go to a private temporary directory, which is removed along with the cache.
+
+    The cache is scoped to the batches (or jobs) that use it at the same time: each one enters it as
+    a context manager, and once the last one leaves, the pictures are forgotten and the temporary
+    directory is removed. So a long-running process (e.g. the watch daemon) only keeps the
+    pictures of the conversions in progress.
+
+    Example::
+
+        with get_cover_cache():
+            for result in scheduler.run(encode_flac_mp3, files, destination):
+                ...
+    """
+
+    def __init__(self):
+        self._covers = {}
+        self._locks = {}
+        self._lock = Lock()
+        self._scratch = None
+        self._users = 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _directory(self, destination: str) -> str:
+        if destination is not None:
+            return str(Path(destination).resolve())
+
+        with self._lock:
+            if self._scratch is None:
+                self._scratch = TemporaryDirectory(prefix='anarky-covers-')
+            return self._scratch.name
+
+    def store(self, picture: Picture, destination: str = None) -> str:
+        """
+        Stores a picture, unless the same picture was already stored in the destination.
+
+        In a destination, the picture is named after its description in the PICTURE block (or
+        'cover', if it has none). If a different picture already has that name, the hash of the
+        contents is added to the name.
+
+        :param picture:
+            The picture
+        :param destination:
+            The directory where the picture is stored (a temporary directory by default)
+        :return:
+            The name of the picture file
+        """
+        digest = sha256(picture.data).hexdigest()
+        directory = self._directory(destination)
+        key = (directory, digest)
+        with self._lock:
+            lock = self._locks.setdefault(directory, Lock())
+
+        # Only the first track of the album writes the picture; the others wait for it (the lock
+        # covers the whole directory, as different pictures may compete for the same name)
+        with lock:
+            cover = self._covers.get(key)
+            if cover is not None and Path(cover).is_file():
+                return cover
+
+            extension = EXTENSIONS.get(picture.mime, '')
+            if destination is None:
+                names = [digest + extension]
+            else:
+                name = Path(picture.description).name
+                if is_string_empty(name):
+                    name = 'cover' + extension
+                names = [name, '{}-{}{}'.format(Path(name).stem, digest[:12], Path(name).suffix)]
+
+            for name in names:
+                cover = join(directory, name)
+                if not Path(cover).is_file():
+                    _write_file(cover, picture.data)
+                    break
+                if _has_contents(cover, picture.data, digest):
+                    break
+            else:
+                _write_file(cover, picture.data)
+
+            self._covers[key] = cover
+            return cover
+
+    def acquire(self):
+        """
+        Starts using the cache (for a batch or a single job), so it isn't closed until it's
+        released.
+        """
+        with self._lock:
+            self._users += 1
+
+    def release(self):
+        """
+        Stops using the cache: once every user released it, it's closed.
+        """
+        with self._lock:
+            self._users -= 1
+            if self._users <= 0:
+                self._users = 0
+                self._clear()
+
+    def _clear(self):
+        self._covers.clear()
+        self._locks.clear()
+        if self._scratch is not None:
+            self._scratch.cleanup()
+            self._scratch = None
+
+    def close(self):
+        """
+        Forgets the stored pictures and removes the temporary directory.
+        """
+        with self._lock:
+            self._clear()
+
+
+def _write_file(filename: str, data: bytes):
+    # The file is renamed into place, so a track never sees a half-written picture
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(data)
+    replace(temporary, filename)
+
+
+def _has_contents(filename: str, data: bytes, digest: str) -> bool:
+    path = Path(filename)
+    if path.stat().st_size != len(data):
+        return False
+    return sha256(path.read_bytes()).hexdigest() == digest
+
+
+_covers = CoverCache()
+
+
+def get_cover(filename: str, destination: str, cache: CoverCache = None) -> str:
     """
     Retrieves the front cover art file from a FLAC audio file and stores it in the destination
     directory.
 
+    The picture is named after its description in the PICTURE block (or 'cover', if it has none).
+    Each unique picture is only written once per destination (see 'CoverCache').
+
     :param filename:
         The input audio file name
     :param destination:
         The destination where the output file will be stored
+    :param cache:
+        The cache of cover art pictures (a cache shared by the whole process by default)
     :return:
         The name of the album art file
     """
-    # Prepares the 'metaflac' program arguments:
-    # --list       => Lists the full stack of metadata
-    # --block-type => Comma-separated list of block types to be included
-    metaflac = [Program.METAFLAC.value, '--list', '--block-type=PICTURE', filename]
-
-    # Prepares the 'grep' program arguments (looks for description parameter)
-    grep = [Program.GREP.value, 'description:']
-
-    # Prepares the 'sed' program arguments (the regular expression removes the parameter name)
-    sed = [Program.SED.value, 's/.*: //']
-
-    # Invokes the 'metaflac', 'grep' and 'sed' programs to retrieve the cover file name
-    p1 = Popen(metaflac, stdout=PIPE)
-    p2 = Popen(grep, stdin=p1.stdout, stdout=PIPE)
-    p3 = Popen(sed, stdin=p2.stdout, stdout=PIPE)
-    cover = p3.stdout.read().decode(ENCODING).rstrip('\n')
- 
-    # Checks if the audio file has a cover
-    if is_string_empty(cover):
-        return None
+    with stage('cover', filename, audio=False) as current:
+        picture = get_front_cover(read_flac_metadata(filename))
 
-    # Prepares the 'metaflac' program arguments:
-    # --export-picture-to => Export PICTURE block to a file
-    cover = join(destination, cover)
-    call([Program.METAFLAC.value, '--export-picture-to=' + cover, filename])
+        # Checks if the audio file has a cover
+        if picture is None:
+            return None
+
+        cover = (cache or _covers).store(picture, destination)
+        current.output = cover
 
     return cover
 
 
+def get_cover_cache() -> CoverCache:
+    """
+    Retrieves the cache of cover art pictures shared by the whole process (scoped to the batches
+    that use it; see 'CoverCache').
+
+    :return:
+        The cache of cover art pictures
+    """
+    return _covers
+
+
 def read_tags(filename: str) -> str:
     """
     Reads a JSON file with ID3 tags.
@@ -103,7 +461,7 @@ def read_tags(filename: str) -> str:
     return tags
 
 
-def write_tags(filename: str, tags: list(str)):
+def write_tags(filename: str, tags: dict):
     """
     Writes ID3 tags to a JSON file.
 
@@ -120,19 +478,131 @@ def get_tags(filename: str) -> dict:
     """
     Retrieves the tag values of a FLAC audio file.
 
+    The Vorbis comments are read straight from the metadata blocks of the file. If a tag has more
+    than one value, the first one is used.
+
     :param filename:
         The input audio file name
     :return:
         The list of ID3 tags retrieved from the audio file
     """
-    tags = {}
-    for tag in TAGS:
+    with stage('metadata', filename, audio=False):
+        comments = read_flac_metadata(filename, pictures=False).tags
+    return {tag: comments[tag][0] for tag in TAGS if tag in comments}
 
-        # Invokes the 'metaflac' program with the following arguments:
-        # --show-tag => Shows the value of the given tag
-        p = Popen([Program.METAFLAC.value, '--show-tag=' + tag, filename], stdout=PIPE)
-        value = p.stdout.read().decode(ENCODING).rstrip('\n')
-        if value:
-            tags[tag] = value.split('=')[1]
 
-    return tags
+def get_lame_arguments(tags: Dict[str, List[str]], cover: str = None) -> List[str]:
+    """
+    Builds the arguments of the 'lame' program that write the given tags (and front cover) into
+    the ID3 tag of the MP3 audio file.
+
+    The tags are mapped to the 'lame' options in TAGS. If a tag has more than one value, the first
+    one is used. The number of tracks is written along with the track number (e.g. '3/12').
+
+    :param tags:
+        The Vorbis comments of a FLAC audio file
+    :param cover:
+        The name of the front cover file (JPEG, PNG or GIF)
+    :return:
+        The arguments of the 'lame' program
+    """
+    arguments = []
+    for tag, option in TAGS.items():
+        if not option or not tags.get(tag):
+            continue
+
+        value = tags[tag][0]
+        if tag == 'TRACKNUMBER' and tags.get('TRACKTOTAL') and '/' not in value:
+            value = '{}/{}'.format(value, tags['TRACKTOTAL'][0])
+        if isinstance(option, list):
+            arguments += [option[0], option[1] + value]
+        else:
+            arguments += [option, value]
+
+    if cover is not None:
+        arguments += ['--ti', cover]
+
+    return arguments
+
+
+def get_flac_arguments(tags: Dict[str, List[str]], cover: str = None) -> List[str]:
+    """
+    Builds the arguments of the 'flac' program that write the given tags (and front cover) into
+    the FLAC audio file it encodes.
+
+    Only the tags in TAGS are copied (with every one of their values), as in the ID3 tag; the
+    other comments (e.g. an embedded METADATA_BLOCK_PICTURE) never reach the command line.
+
+    :param tags:
+        The Vorbis comments of a FLAC audio file
+    :param cover:
+        The name of the front cover file (JPEG, PNG or GIF)
+    :return:
+        The arguments of the 'flac' program
+    """
+    arguments = ['--tag={}={}'.format(tag, value) for tag, values in tags.items() if tag in TAGS
+                 for value in values]
+    if cover is not None:
+        arguments.append('--picture={}'.format(cover))
+
+    return arguments
+
+
+class AudioHeader(NamedTuple):
+    """
+    Properties of the audio of a FLAC or WAV audio file, read from its header.
+    """
+    duration: float
+    data_size: int
+
+
+@lru_cache(maxsize=HEADER_CACHE_SIZE)
+def _read_audio_header(filename: str, size: int, mtime: int) -> Optional[AudioHeader]:
+    # The size and modification time are part of the key, so a changed file is read again
+    extension = Path(filename).suffix.lower()
+    try:
+        if extension == AudioFile.FLAC.value:
+            info = read_flac_metadata(filename, pictures=False).stream_info
+            return AudioHeader(info.duration,
+                               info.total_samples * info.channels * info.bits_per_sample // 8)
+        if extension == AudioFile.WAV.value:
+            info = read_wav_info(filename)
+            return AudioHeader(info.duration, info.data_size)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def read_audio_header(filename: str) -> Optional[AudioHeader]:
+    """
+    Reads the properties of the audio of a FLAC or WAV audio file from its header.
+
+    The properties of the last HEADER_CACHE_SIZE files are kept (while the files don't change), so
+    the planner, the scratch space and the statistics read each header only once.
+
+    :param filename:
+        The input audio file name
+    :return:
+        The duration and the size of the decoded audio (None if the file type isn't supported or
+        the header is invalid)
+    """
+    try:
+        status = stat(str(filename))
+    except OSError:
+        return None
+
+    return _read_audio_header(str(filename), status.st_size, status.st_mtime_ns)
+
+
+def get_duration(filename: str) -> float:
+    """
+    Retrieves the duration of a FLAC or WAV audio file from its header.
+
+    :param filename:
+        The input audio file name
+    :return:
+        The duration in seconds (0 if the file type isn't supported or the header is invalid)
+    """
+    header = read_audio_header(filename)
+    return header.duration if header is not None else 0.0
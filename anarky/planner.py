@@ -0,0 +1,190 @@
+# -*- coding: utf8 -*-
+
+"""
+Planning of the order in which a batch of files is converted.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from heapq import heapify, heapreplace
+from os.path import getsize
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List
+
+from anarky.metadata import get_duration
+from anarky.utils import get_header_executor
+
+# Bytes per second of CD quality audio, used to estimate the duration of files without a header
+BYTES_PER_SECOND = 44100 * 2 * 2
+
+SUMMARY = 'Planned {} file(s) ({:.0f} s of audio) on {} job(s): predicted {:.1f} s ({:.1f} s in ' \
+          'the given order), actual {:.1f} s'
+
+
+def estimate_cost(filename: str) -> float:
+    """
+    Estimates the cost of converting a file, which is proportional to the duration of its audio.
+
+    The duration is read from the STREAMINFO block of FLAC audio files or the 'data' chunk of WAV
+    audio files. Other files are assumed to hold CD quality audio.
+
+    :param filename:
+        The input audio file name
+    :return:
+        The duration of the audio in seconds
+    """
+    duration = get_duration(filename)
+    if duration:
+        return duration
+
+    try:
+        return getsize(str(filename)) / BYTES_PER_SECOND
+    except OSError:
+        return 0.0
+
+
+def makespan(costs: Iterable[float], jobs: int) -> float:
+    """
+    Calculates the time a batch takes when each job goes to the first worker that is free.
+
+    :param costs:
+        The cost of each job, in the order they are started
+    :param jobs:
+        The number of workers
+    :return:
+        The time at which the last job finishes
+    """
+    loads = [0.0] * max(1, jobs)
+    heapify(loads)
+    for cost in costs:
+        heapreplace(loads, loads[0] + cost)
+
+    return max(loads)
+
+
+class Plan:
+    """
+    Order in which a batch of files is converted.
+
+    The files are started longest first: a long file started last would run alone at the end while
+    the other workers are idle. The predicted makespan is in seconds of audio; once the batch runs,
+    the speed of the conversions turns it into seconds of wall time.
+    """
+
+    def __init__(self, files: List[str], costs: Dict[str, float], jobs: int):
+        """
+        :param files:
+            The input audio file names, in the given order
+        :param costs:
+            The cost of each file
+        :param jobs:
+            The number of files converted at the same time
+        """
+        self.costs = costs
+        self.jobs = jobs
+        self.files = sorted(files, key=lambda filename: costs[filename], reverse=True)
+        self.makespan = makespan((costs[filename] for filename in self.files), jobs)
+        self.naive_makespan = makespan((costs[filename] for filename in files), jobs)
+        self.walls = {}
+        self._lock = Lock()
+        self._start = None
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def track(self, function: Callable[[str, str], str]) -> Callable[[str, str], str]:
+        """
+        Wraps a conversion function, so the wall time of each conversion is measured.
+
+        :param function:
+            The conversion function (e.g. 'encode_wav_flac')
+        :return:
+            The wrapped conversion function
+        """
+        def convert(filename: str, destination: str) -> str:
+            with self._lock:
+                if self._start is None:
+                    self._start = perf_counter()
+            start = perf_counter()
+            try:
+                return function(filename, destination)
+            finally:
+                with self._lock:
+                    self.walls[filename] = perf_counter() - start
+
+        return convert
+
+    def report(self, wall: float = None) -> dict:
+        """
+        Compares the predicted and actual wall time of the batch.
+
+        The speed of the conversions (seconds of audio per second of wall time of each job) is
+        measured over the files converted so far and applied to the predicted makespan.
+
+        :param wall:
+            The actual wall time of the batch (defaults to the time since the first conversion
+            started)
+        :return:
+            The prediction and the outcome of the batch
+        """
+        with self._lock:
+            walls = dict(self.walls)
+            if wall is None:
+                wall = perf_counter() - self._start if self._start is not None else 0.0
+
+        busy = sum(walls.values())
+        speed = sum(self.costs[filename] for filename in walls) / busy if busy else 0.0
+        return {
+            'files': len(self.files),
+            'jobs': self.jobs,
+            'audio_seconds': sum(self.costs.values()),
+            'predicted_makespan': self.makespan,
+            'naive_makespan': self.naive_makespan,
+            'speed': speed,
+            'predicted_wall': self.makespan / speed if speed else 0.0,
+            'naive_wall': self.naive_makespan / speed if speed else 0.0,
+            'actual_wall': wall
+        }
+
+    def summary(self, wall: float = None) -> str:
+        """
+        Describes the prediction and the outcome of the batch in a single line.
+
+        :param wall:
+            The actual wall time of the batch
+        :return:
+            The description of the batch
+        """
+        report = self.report(wall)
+        return SUMMARY.format(report['files'], report['audio_seconds'], report['jobs'],
+                              report['predicted_wall'], report['naive_wall'],
+                              report['actual_wall'])
+
+
+def plan_jobs(files: Iterable[str], jobs: int,
+              cost: Callable[[str], float] = estimate_cost) -> Plan:
+    """
+    Plans the order in which a batch of files is converted.
+
+    Every file is listed (and its header read) before the first conversion starts. The headers are
+    small, so several of them are read at the same time by the shared pool of header readers (see
+    'get_header_executor').
+
+    :param files:
+        The input audio file names
+    :param jobs:
+        The number of files converted at the same time
+    :param cost:
+        The function that estimates the cost of converting a file
+    :return:
+        The plan of the batch
+    """
+    files = list(files)
+    costs = dict(zip(files, get_header_executor().map(cost, files)))
+
+    return Plan(files, costs, jobs)
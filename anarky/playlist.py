@@ -0,0 +1,248 @@
+# -*- coding: utf8 -*-
+
+"""
+Extended M3U playlists of the output files of a batch, written as the conversions finish.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from collections import deque
+from os import replace
+from os.path import relpath
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import re
+
+from anarky.audio.wav import read_wav_info
+from anarky.enum.audio_file import AudioFile
+from anarky.metadata import read_flac_metadata
+from anarky.scheduler import describe_job, is_job_described, Result
+from anarky.utils import ENCODING, get_partial_path
+
+HEADER = '#EXTM3U'
+ENTRY = '#EXTINF:{},{}'
+
+# Playlists with the '.m3u8' extension are UTF-8; the others use the legacy Latin-1 encoding
+UTF8_EXTENSION = '.m3u8'
+LEGACY_ENCODING = 'latin-1'
+
+# Maximum number of entries waiting for the files listed before them
+BUFFER_SIZE = 256
+
+# Line breaks inside a title would break the structure of the playlist
+LINE_BREAKS = re.compile(r'[\r\n]+')
+
+
+class PlaylistEntry(NamedTuple):
+    """
+    Entry of an extended M3U playlist.
+    """
+    path: str
+    duration: int
+    title: str
+
+    def __str__(self) -> str:
+        return '{}\n{}\n'.format(ENTRY.format(self.duration, self.title), self.path)
+
+
+def read_description(filename: str) -> Tuple[float, Dict[str, List[str]]]:
+    """
+    Reads the duration and tags of an audio file from its header (only FLAC audio files have tags).
+
+    :param filename:
+        The input audio file name
+    :return:
+        The duration in seconds (0 if it's unknown) and the tags
+    """
+    duration = 0.0
+    tags = {}
+    extension = Path(filename).suffix.lower()
+    try:
+        if extension == AudioFile.FLAC.value:
+            metadata = read_flac_metadata(filename, pictures=False)
+            duration = metadata.stream_info.duration
+            tags = metadata.tags
+        elif extension == AudioFile.WAV.value:
+            duration = read_wav_info(filename).duration
+    except (OSError, ValueError):
+        pass
+
+    return duration, tags
+
+
+def get_title(filename: str, tags: Dict[str, List[str]]) -> str:
+    """
+    Builds the title of an entry from the ARTIST and TITLE tags of an audio file.
+
+    :param filename:
+        The input audio file name
+    :param tags:
+        The tags of the audio file
+    :return:
+        The title ('ARTIST - TITLE', or the file name without the extension if there's no TITLE
+        tag), in a single line
+    """
+    title = ' - '.join(tags[tag][0] for tag in ('ARTIST', 'TITLE') if tags.get(tag))
+    if not tags.get('TITLE'):
+        title = Path(filename).stem
+    return LINE_BREAKS.sub(' ', title).strip()
+
+
+class Playlist:
+    """
+    Extended M3U playlist of the output files of a batch, built from the outcome of the
+    conversions.
+
+    The durations and titles are carried on the results of the conversions, so neither the input
+    nor the output files are read again: the header of an input file is only read here if it was
+    never read while converting it (e.g. skipped files). The entries follow the order in which the
+    input files were listed: each one is written as soon as the conversions of the files listed
+    before it finished (the failed conversions are left out). At most BUFFER_SIZE entries wait for
+    the files listed before them; past that (e.g. with '--plan', which converts the longest files
+    first), the earliest files still running are written whenever they finish. The playlist is
+    written into a partial file, which replaces the playlist when it's closed.
+
+    Example::
+
+        with Playlist('/srv/mp3/album.m3u8') as playlist:
+            for result in playlist.record(run(playlist.track(function), playlist.queue(files))):
+                ...
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename:
+            The playlist file name (UTF-8 if its extension is '.m3u8')
+        """
+        self.path = Path(filename).resolve()
+        self.count = 0
+        self._partial = get_partial_path(str(self.path))
+        encoding = ENCODING if self.path.suffix.lower() == UTF8_EXTENSION else LEGACY_ENCODING
+        self._file = open(self._partial, 'w', encoding=encoding, errors='replace')
+        self._file.write(HEADER + '\n')
+        self._order = {}
+        self._listed = 0
+        self._written = 0
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return str(Path(filename).resolve())
+
+    def _entry(self, result: Result) -> Optional[PlaylistEntry]:
+        if result.failed or result.output is None:
+            return None
+
+        duration, tags = result.duration, result.tags
+        if duration is None or tags is None:
+            duration, tags = read_description(result.filename)
+        try:
+            path = relpath(str(result.output), str(self.path.parent))
+        except ValueError:
+            # On Windows, a file on another drive can't be reached by a relative path
+            path = str(result.output)
+        return PlaylistEntry(path, round(duration) if duration else -1,
+                             get_title(result.filename, tags))
+
+    def _write(self, entry: Optional[PlaylistEntry]):
+        if entry is not None:
+            self._file.write(str(entry))
+            self.count += 1
+
+    def _flush(self):
+        while True:
+            if self._written not in self._pending:
+                if len(self._pending) <= BUFFER_SIZE:
+                    break
+                # Too many entries are waiting: the files listed before them are written later
+                self._written = min(self._pending)
+            self._write(self._pending.pop(self._written))
+            self._written += 1
+        self._file.flush()
+
+    def track(self, function: Callable[[str, str], str]) -> Callable[[str, str], str]:
+        """
+        Wraps a conversion function, so the header of the input file is read (by the worker that
+        converted it) if the conversion didn't read it.
+
+        :param function:
+            The conversion function (e.g. 'encode_wav_flac')
+        :return:
+            The wrapped conversion function
+        """
+        def convert(filename: str, destination: str) -> str:
+            output = function(filename, destination)
+            if not is_job_described():
+                describe_job(*read_description(filename))
+            return output
+
+        return convert
+
+    def queue(self, files: Iterable[str]) -> Iterator[str]:
+        """
+        Records the order of the input files as they are listed.
+
+        :param files:
+            The input audio file names
+        :return:
+            The same input audio file names
+        """
+        for filename in files:
+            self._order.setdefault(self._key(filename), deque()).append(self._listed)
+            self._listed += 1
+            yield filename
+
+    def add(self, result: Result):
+        """
+        Adds the output file of a conversion to the playlist.
+
+        :param result:
+            The outcome of the conversion of a listed file (a file listed several times takes the
+            place of its first listing that wasn't added yet)
+        """
+        key = self._key(result.filename)
+        indexes = self._order.get(key)
+        if not indexes:
+            return
+
+        index = indexes.popleft()
+        if not indexes:
+            del self._order[key]
+
+        entry = self._entry(result)
+        if index < self._written:
+            self._write(entry)
+            self._file.flush()
+        else:
+            self._pending[index] = entry
+            self._flush()
+
+    def record(self, results: Iterable[Result]) -> Iterator[Result]:
+        """
+        Adds the output files to the playlist as the conversions finish.
+
+        :param results:
+            The outcome of each conversion
+        :return:
+            The same outcomes
+        """
+        for result in results:
+            self.add(result)
+            yield result
+
+    def close(self):
+        """
+        Writes the entries still waiting for the files listed before them (which were never
+        converted, e.g. because the batch was interrupted) and replaces the playlist.
+        """
+        for index in sorted(self._pending):
+            self._write(self._pending.pop(index))
+        self._file.close()
+        replace(str(self._partial), str(self.path))
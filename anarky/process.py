@@ -0,0 +1,579 @@
+# -*- coding: utf8 -*-
+
+"""
+Execution of the external programs used in the encoding and decoding operations.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from contextlib import ExitStack
+from queue import Queue
+from subprocess import CalledProcessError, DEVNULL, PIPE, Popen, TimeoutExpired
+from tempfile import TemporaryFile
+from threading import Event, Lock, Thread, Timer
+from typing import AsyncIterable, AsyncIterator, Awaitable, BinaryIO, Callable, Iterable, List, \
+    Optional, Sequence, TYPE_CHECKING, Union
+import os
+
+from anarky.scheduler import default_jobs, describing, Result
+from anarky.stats import add_child_time, stage
+from anarky.utils import ENCODING, get_outputs
+
+if TYPE_CHECKING:
+    from asyncio import Semaphore
+
+    from anarky.manifest import Manifest
+
+# Size of the chunks copied from a program into several consumers, and number of chunks each
+# consumer can fall behind before the copy waits for it
+TEE_BUFFER_SIZE = 64 * 1024
+TEE_QUEUE_SIZE = 16
+
+# Held while a program is reaped or killed, so a program is never killed after its PID was released
+# (and possibly reused by another process)
+_reap_lock = Lock()
+
+
+class ProcessError(CalledProcessError):
+    """
+    Error raised when an external program exits with a non-zero status.
+
+    Unlike its parent class, the error message includes the last lines written by the program to
+    stderr, which usually explain what went wrong.
+    """
+
+    def __str__(self):
+        message = super().__str__()
+        if self.stderr:
+            lines = self.stderr.decode(ENCODING, errors='replace').strip().splitlines()
+            message += ' ({})'.format(' / '.join(lines[-3:]))
+        return message
+
+
+def _kill(process: Popen):
+    # Kills a program, unless it was already reaped
+    with _reap_lock:
+        if process.returncode is None:
+            process.kill()
+
+
+def _reap(process: Popen) -> int:
+    # Waits for the program with 'wait4' (instead of letting 'Popen' do it) to find out how much
+    # processor time it used, which is then added to the statistics of the running stage
+    if not hasattr(os, 'wait4') or not hasattr(os, 'waitid'):
+        return process.wait()
+
+    # The program is only waited for here: it stays a zombie (so its PID can't be reused) until it's
+    # reaped along with its return code, which is what '_kill' checks
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        pass
+    with _reap_lock:
+        if process.returncode is not None:
+            return process.returncode
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            # Already reaped by 'Popen' itself (e.g. when it was polled before being killed)
+            return process.wait()
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+    add_child_time(usage.ru_utime + usage.ru_stime)
+
+    return process.returncode
+
+
+def _wait(processes: List[Popen], timeout: float = None) -> bool:
+    # Waits for every program, killing all of them if they run for longer than the timeout
+    expired = Event()
+
+    def expire():
+        expired.set()
+        for process in processes:
+            _kill(process)
+
+    timer = None
+    if timeout is not None:
+        timer = Timer(timeout, expire)
+        timer.start()
+    try:
+        for process in processes:
+            _reap(process)
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    return expired.is_set()
+
+
+def run_process(arguments: List[str], timeout: float = None) -> bytes:
+    """
+    Runs an external program and waits for it to finish.
+
+    :param arguments:
+        The program and its arguments
+    :param timeout:
+        The maximum number of seconds the program is allowed to run (no limit by default)
+    :return:
+        The output written by the program to stderr
+    :raise ProcessError:
+        If the program exits with a non-zero status
+    :raise TimeoutExpired:
+        If the program runs for longer than the timeout (the program is killed)
+    """
+    # The error output goes to a temporary file, so a chatty program can't fill a pipe nobody reads
+    with TemporaryFile() as errors:
+        process = Popen([str(argument) for argument in arguments], stdin=DEVNULL, stdout=DEVNULL,
+                        stderr=errors)
+        if _wait([process], timeout):
+            raise TimeoutExpired(process.args, timeout)
+
+        errors.seek(0)
+        stderr = errors.read()
+
+    if process.returncode != 0:
+        raise ProcessError(process.returncode, process.args, stderr=stderr)
+
+    return stderr
+
+
+def run_pipeline(producer: List[str], consumer: List[str], timeout: float = None):
+    """
+    Runs two external programs, piping the output of the first into the input of the second.
+
+    :param producer:
+        The program that writes to stdout and its arguments
+    :param consumer:
+        The program that reads from stdin and its arguments
+    :param timeout:
+        The maximum number of seconds the programs are allowed to run (no limit by default)
+    :raise ProcessError:
+        If either program exits with a non-zero status (the consumer is checked first: once it
+        fails, the producer usually fails too, only because its output was cut short)
+    :raise TimeoutExpired:
+        If the programs run for longer than the timeout (both programs are killed)
+    """
+    with TemporaryFile() as producer_errors, TemporaryFile() as consumer_errors:
+        first = Popen([str(argument) for argument in producer], stdin=DEVNULL, stdout=PIPE,
+                      stderr=producer_errors)
+        try:
+            second = Popen([str(argument) for argument in consumer], stdin=first.stdout,
+                           stdout=DEVNULL, stderr=consumer_errors)
+        except OSError:
+            first.kill()
+            _reap(first)
+            raise
+        finally:
+            # Only the consumer holds the read end of the pipe, so the producer gets a SIGPIPE if
+            # the consumer exits early
+            first.stdout.close()
+
+        if _wait([second, first], timeout):
+            raise TimeoutExpired(first.args, timeout)
+
+        for process, errors in ((second, consumer_errors), (first, producer_errors)):
+            if process.returncode != 0:
+                errors.seek(0)
+                raise ProcessError(process.returncode, process.args, stderr=errors.read())
+
+
+class _Sink:
+    # Copies the chunks of a shared stream into an output (the input of a program or a file) from
+    # its own thread, so a slow output doesn't hold back the others until its queue is full. An
+    # output that fails is drained without writing, so the stream is never blocked by it
+
+    def __init__(self, output: BinaryIO, process: Popen = None, errors: BinaryIO = None):
+        self.output = output
+        self.process = process
+        self.errors = errors
+        self.error = None
+        self.queue = Queue(TEE_QUEUE_SIZE)
+        self.thread = Thread(target=self._copy, daemon=True)
+        self.thread.start()
+
+    def _copy(self):
+        for chunk in iter(self.queue.get, None):
+            if self.error is None:
+                try:
+                    self.output.write(chunk)
+                except OSError as e:
+                    self.error = e
+        try:
+            self.output.close()
+        except OSError as e:
+            self.error = self.error or e
+
+    def result(self) -> Optional[Exception]:
+        if self.process is not None and self.process.returncode != 0:
+            self.errors.seek(0)
+            return ProcessError(self.process.returncode, self.process.args,
+                                stderr=self.errors.read())
+        return self.error
+
+
+def run_tee(producer: List[str], consumers: Sequence[List[str]], files: Sequence[str] = (),
+            timeout: float = None) -> List[Optional[Exception]]:
+    """
+    Runs an external program and copies its output into the input of several programs (and into
+    several files), so the output is produced only once however many consumers there are.
+
+    A consumer that fails doesn't stop the others.
+
+    :param producer:
+        The program that writes to stdout and its arguments
+    :param consumers:
+        The programs that read from stdin and their arguments
+    :param files:
+        The names of the files where the output is also written
+    :param timeout:
+        The maximum number of seconds the programs are allowed to run (no limit by default)
+    :return:
+        The error of each consumer, followed by the error of each file (None if it succeeded)
+    :raise ProcessError:
+        If the producer exits with a non-zero status
+    :raise TimeoutExpired:
+        If the programs run for longer than the timeout (every program is killed)
+    """
+    with ExitStack() as stack:
+        producer_errors = stack.enter_context(TemporaryFile())
+        first = Popen([str(argument) for argument in producer], stdin=DEVNULL, stdout=PIPE,
+                      stderr=producer_errors)
+        processes = [first]
+        sinks = []
+        try:
+            for consumer in consumers:
+                errors = stack.enter_context(TemporaryFile())
+                process = Popen([str(argument) for argument in consumer], stdin=PIPE,
+                                stdout=DEVNULL, stderr=errors)
+                processes.append(process)
+                sinks.append(_Sink(process.stdin, process, errors))
+            for filename in files:
+                sinks.append(_Sink(open(str(filename), 'wb')))
+        except OSError:
+            for process in processes:
+                process.kill()
+            for sink in sinks:
+                sink.queue.put(None)
+                sink.thread.join()
+            first.stdout.close()
+            for process in processes:
+                _reap(process)
+            raise
+
+        expired = Event()
+
+        def expire():
+            expired.set()
+            for process in processes:
+                _kill(process)
+
+        timer = None
+        if timeout is not None:
+            timer = Timer(timeout, expire)
+            timer.start()
+        try:
+            for chunk in iter(lambda: first.stdout.read(TEE_BUFFER_SIZE), b''):
+                for sink in sinks:
+                    sink.queue.put(chunk)
+        finally:
+            first.stdout.close()
+            for sink in sinks:
+                sink.queue.put(None)
+            for sink in sinks:
+                sink.thread.join()
+            for process in processes:
+                _reap(process)
+            if timer is not None:
+                timer.cancel()
+
+        if expired.is_set():
+            raise TimeoutExpired(first.args, timeout)
+        if first.returncode != 0:
+            producer_errors.seek(0)
+            raise ProcessError(first.returncode, first.args, stderr=producer_errors.read())
+
+        return [sink.result() for sink in sinks]
+
+
+async def _communicate(process, arguments: List[str]) -> bytes:
+    try:
+        _, stderr = await process.communicate()
+    except BaseException:
+        # Covers both timeouts and cancellations: the program must not outlive its job
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise ProcessError(process.returncode, arguments, stderr=stderr)
+
+    return stderr
+
+
+async def run_process_async(arguments: List[str], timeout: float = None) -> bytes:
+    """
+    Runs an external program without blocking the event loop.
+
+    :param arguments:
+        The program and its arguments
+    :param timeout:
+        The maximum number of seconds the program is allowed to run (no limit by default)
+    :return:
+        The output written by the program to stderr
+    :raise ProcessError:
+        If the program exits with a non-zero status
+    :raise TimeoutExpired:
+        If the program runs for longer than the timeout (the program is killed)
+    """
+    # asyncio is imported on first use, so the programs that never run an event loop start faster
+    from asyncio import create_subprocess_exec, TimeoutError as AsyncTimeoutError, wait_for
+
+    arguments = [str(argument) for argument in arguments]
+    process = await create_subprocess_exec(*arguments, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE)
+    try:
+        return await wait_for(_communicate(process, arguments), timeout)
+    except AsyncTimeoutError:
+        raise TimeoutExpired(arguments, timeout)
+
+
+async def run_pipeline_async(producer: List[str], consumer: List[str], timeout: float = None):
+    """
+    Runs two external programs without blocking the event loop, piping the output of the first
+    into the input of the second.
+
+    :param producer:
+        The program that writes to stdout and its arguments
+    :param consumer:
+        The program that reads from stdin and its arguments
+    :param timeout:
+        The maximum number of seconds the programs are allowed to run (no limit by default)
+    :raise ProcessError:
+        If either program exits with a non-zero status (the consumer is checked first, as in
+        'run_pipeline')
+    :raise TimeoutExpired:
+        If the programs run for longer than the timeout (both programs are killed)
+    """
+    from asyncio import create_subprocess_exec, gather, TimeoutError as AsyncTimeoutError, \
+        wait_for
+
+    producer = [str(argument) for argument in producer]
+    consumer = [str(argument) for argument in consumer]
+    read_end, write_end = os.pipe()
+    try:
+        first = await create_subprocess_exec(*producer, stdin=DEVNULL, stdout=write_end,
+                                             stderr=PIPE)
+        try:
+            second = await create_subprocess_exec(*consumer, stdin=read_end, stdout=DEVNULL,
+                                                  stderr=PIPE)
+        except OSError:
+            first.kill()
+            await first.wait()
+            raise
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+
+    # If one of the programs fails, the other one either gets a SIGPIPE or reaches the end of its
+    # input, so both always finish
+    try:
+        errors = await wait_for(gather(_communicate(first, producer),
+                                       _communicate(second, consumer), return_exceptions=True),
+                                timeout)
+    except AsyncTimeoutError:
+        raise TimeoutExpired(producer, timeout)
+
+    for error in reversed(errors):
+        if isinstance(error, BaseException):
+            raise error
+
+
+async def run_blocking(function: Callable, *args):
+    """
+    Runs a blocking function (e.g. one that reads a file) in the default executor, so it doesn't
+    block the event loop. The function runs in the context of the calling job, so what it records
+    on the job is kept (see 'describe_job').
+
+    :param function:
+        The blocking function
+    :param args:
+        The arguments of the function
+    :return:
+        The result of the function
+    """
+    from asyncio import get_event_loop
+    from contextvars import copy_context
+
+    return await get_event_loop().run_in_executor(None, copy_context().run, function, *args)
+
+
+async def iter_blocking(iterable: Iterable) -> AsyncIterator:
+    """
+    Consumes an iterable whose items are slow to produce (e.g. the files found by walking a
+    directory) in the default executor, so it doesn't block the event loop.
+
+    :param iterable:
+        The iterable
+    :return:
+        The items of the iterable
+    """
+    end = object()
+    iterator = iter(iterable)
+    while True:
+        item = await run_blocking(next, iterator, end)
+        if item is end:
+            return
+        yield item
+
+
+async def run_bounded(awaitables: Union[Iterable[Awaitable], AsyncIterable[Awaitable]],
+                      limit: int) -> AsyncIterator:
+    """
+    Runs the awaitables of an iterable, which is consumed lazily so no more than a given number of
+    them are pending at any given time.
+
+    :param awaitables:
+        The awaitables (e.g. coroutines, created as the iterable is consumed), from a regular or an
+        asynchronous iterable
+    :param limit:
+        The maximum number of pending awaitables
+    :return:
+        The result of each awaitable, in order of completion (the pending ones are cancelled if
+        the iteration stops early)
+    """
+    from asyncio import ensure_future, FIRST_COMPLETED, wait
+
+    pending = set()
+    asynchronous = hasattr(awaitables, '__aiter__')
+    awaitables = awaitables.__aiter__() if asynchronous else iter(awaitables)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max(1, limit):
+                try:
+                    awaitable = await awaitables.__anext__() if asynchronous else next(awaitables)
+                except (StopAsyncIteration, StopIteration):
+                    exhausted = True
+                else:
+                    pending.add(ensure_future(awaitable))
+
+            if not pending:
+                return
+
+            done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class Engine:
+    """
+    Runs conversion jobs from a single event loop.
+
+    Each job is a coroutine function with the same arguments as the regular conversion functions
+    (e.g. 'encode_wav_flac_async'). No more than a given number of jobs run at the same time and
+    each job can be given a time limit. A job that times out or is cancelled kills its external
+    programs.
+
+    The jobs and their stages are recorded in the statistics (if they're being collected), without
+    their processor time (see 'stage'). The conversion programs run their jobs on an engine when
+    they're given a time limit ('--timeout').
+    """
+
+    def __init__(self, jobs: int = None, timeout: float = None):
+        """
+        :param jobs:
+            The maximum number of jobs running at the same time (defaults to the processor count)
+        :param timeout:
+            The maximum number of seconds each job is allowed to run (no limit by default)
+        """
+        self.jobs = jobs or default_jobs()
+        self.timeout = timeout
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> 'Semaphore':
+        """
+        Retrieves the semaphore that bounds the number of running jobs, creating it on first use
+        (so it belongs to the running event loop).
+
+        :return:
+            The semaphore
+        """
+        if self._semaphore is None:
+            from asyncio import Semaphore
+
+            self._semaphore = Semaphore(self.jobs)
+        return self._semaphore
+
+    async def convert(self, function: Callable[[str, str], Awaitable], filename: str,
+                      destination: str, manifest: 'Manifest' = None) -> Result:
+        """
+        Runs a conversion job, trapping any error it raises.
+
+        :param function:
+            The conversion coroutine function (e.g. 'encode_wav_flac_async')
+        :param filename:
+            The input audio file name
+        :param destination:
+            The destination where the output file will be stored
+        :param manifest:
+            The manifest of previous conversions (if given, up to date files are skipped)
+        :return:
+            The outcome of the conversion job
+        """
+        from asyncio import TimeoutError as AsyncTimeoutError, wait_for
+
+        if manifest is not None and manifest.is_up_to_date(filename):
+            return Result(filename, manifest.get_output(filename), skipped=True)
+
+        async with self.semaphore:
+            try:
+                with describing() as description, \
+                        stage('job', filename, cpu=False) as current:
+                    outputs = get_outputs(await wait_for(function(filename, destination),
+                                                         self.timeout))
+                    current.output = outputs[0] if outputs else None
+                if manifest is not None and outputs:
+                    manifest.update(filename, outputs)
+                    manifest.checkpoint()
+            except AsyncTimeoutError:
+                return Result(filename, error='TimeoutExpired: the conversion took longer than '
+                                              '{} seconds'.format(self.timeout))
+            except Exception as e:
+                return Result(filename, error='{}: {}'.format(type(e).__name__, e))
+
+        return Result(filename, outputs[0] if outputs else None,
+                      duration=description.get('duration'), tags=description.get('tags'))
+
+    async def run(self, function: Callable[[str, str], Awaitable], files: Iterable[str],
+                  destination: str, manifest: 'Manifest' = None) -> AsyncIterator[Result]:
+        """
+        Runs a conversion job for each of the given files.
+
+        The input files are consumed lazily and only a couple of jobs per worker are pending at any
+        given time (see 'run_bounded').
+
+        :param function:
+            The conversion coroutine function (e.g. 'encode_wav_flac_async')
+        :param files:
+            The input audio file names
+        :param destination:
+            The destination where the output files will be stored
+        :param manifest:
+            The manifest of previous conversions (if given, up to date files are skipped)
+        :return:
+            The outcome of each conversion job, in order of completion
+        """
+        # The input files are listed off the event loop, since they may be found by walking
+        # directories
+        jobs = (self.convert(function, filename, destination, manifest)
+                async for filename in iter_blocking(files))
+        async for result in run_bounded(jobs, self.jobs * 2):
+            yield result
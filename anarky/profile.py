@@ -0,0 +1,147 @@
+# -*- coding: utf8 -*-
+
+"""
+Encoder profiles, which trade encoding speed for compression and quality.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from threading import Lock
+from typing import List, NamedTuple
+
+# Name of the file that selects the profile of the files in a directory (and its subdirectories)
+PROFILE_FILE = '.anarky-profile'
+
+ERROR_PROFILE = "Profile '{}' is not available (expected one of: {})!"
+
+CBR = 'cbr'
+VBR = 'vbr'
+
+
+class Profile(NamedTuple):
+    """
+    Settings of the FLAC and MP3 encoders.
+    """
+    name: str
+    compression_level: int
+    verify: bool
+    quality: int
+    mode: str
+    bitrate: int = 320
+    vbr_quality: int = 0
+    preset: str = ''
+
+    def flac_arguments(self) -> List[str]:
+        """
+        Builds the arguments of the 'flac' program:
+          * -f      => Force overwriting of output files
+          * -0..-8  => Compression level (-8 is the slowest and smallest)
+          * -V      => Verify a correct encoding (decodes the output again, so it's slower)
+
+        :return:
+            The arguments of the 'flac' program
+        """
+        return ['-f', '-{}'.format(self.compression_level)] + (['-V'] if self.verify else [])
+
+    def lame_arguments(self) -> List[str]:
+        """
+        Builds the arguments of the 'lame' program:
+          * -b BITRATE     => Constant bitrate in kbps (CBR mode)
+          * -V QUALITY     => Variable bitrate quality, 0 being the best (VBR mode)
+          * -q QUALITY     => Algorithm quality, from 0 (highest quality, very slow) to 9 (fastest)
+          * --preset NAME  => Type of the quality settings
+          * --id3v2-only   => Add only a version 2 tag
+
+        :return:
+            The arguments of the 'lame' program
+        """
+        if self.mode == CBR:
+            arguments = ['-b', str(self.bitrate)]
+        else:
+            arguments = ['-V', str(self.vbr_quality)]
+        arguments += ['-q', str(self.quality)]
+        if self.preset:
+            arguments += ['--preset', self.preset]
+
+        return arguments + ['--id3v2-only']
+
+
+ARCHIVAL = Profile('archival', compression_level=8, verify=True, quality=0, mode=CBR, bitrate=320,
+                   preset='insane')
+STANDARD = Profile('standard', compression_level=5, verify=True, quality=2, mode=VBR,
+                   vbr_quality=2)
+PREVIEW = Profile('preview', compression_level=0, verify=False, quality=7, mode=CBR, bitrate=128)
+
+PROFILES = {profile.name: profile for profile in (ARCHIVAL, STANDARD, PREVIEW)}
+DEFAULT_PROFILE = ARCHIVAL
+
+
+def get_profile(name: str) -> Profile:
+    """
+    Retrieves a profile by name.
+
+    :param name:
+        The name of the profile
+    :return:
+        The profile
+    :raise ValueError:
+        If there's no profile with the given name
+    """
+    try:
+        return PROFILES[name.strip().lower()]
+    except KeyError:
+        raise ValueError(ERROR_PROFILE.format(name, ', '.join(PROFILES)))
+
+
+class ProfileSelector:
+    """
+    Selects the profile of each input file.
+
+    A profile chosen for the whole run takes precedence. Otherwise, the profile is named in a
+    '.anarky-profile' file in the directory of the input file or in the nearest of its parent
+    directories. Files without any of these use the default (archival) profile.
+    """
+
+    def __init__(self, profile: Profile = None):
+        """
+        :param profile:
+            The profile chosen for the whole run (None to look for the profile files)
+        """
+        self.profile = profile
+        self._directories = {}
+        self._lock = Lock()
+
+    def _lookup(self, directory: Path) -> Profile:
+        with self._lock:
+            if directory in self._directories:
+                return self._directories[directory]
+
+        profile_file = directory / PROFILE_FILE
+        if profile_file.is_file():
+            profile = get_profile(profile_file.read_text())
+        elif directory.parent != directory:
+            profile = self._lookup(directory.parent)
+        else:
+            profile = DEFAULT_PROFILE
+
+        with self._lock:
+            self._directories[directory] = profile
+        return profile
+
+    def select(self, filename: str) -> Profile:
+        """
+        Selects the profile of an input file.
+
+        :param filename:
+            The input audio file name
+        :return:
+            The profile used to encode the file
+        :raise ValueError:
+            If a profile file names a profile that doesn't exist
+        """
+        if self.profile is not None:
+            return self.profile
+
+        return self._lookup(Path(filename).resolve().parent)
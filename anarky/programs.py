@@ -0,0 +1,195 @@
+# -*- coding: utf8 -*-
+
+"""
+Registry of the external programs used in the encoding and decoding operations.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from json import dump, load
+from os import environ, replace, stat
+from pathlib import Path
+from shutil import which
+from subprocess import DEVNULL, PIPE, run, SubprocessError
+from threading import Lock
+from typing import Iterable, List, NamedTuple, Optional
+
+from anarky.enum.program import Program
+from anarky.utils import ENCODING
+
+CACHE_FILE = 'programs.json'
+ERROR_PROGRAMS = 'The following programs are required but not available: {}'
+VERSION_TIMEOUT = 5
+
+
+class Tool(NamedTuple):
+    """
+    External program resolved in the operating system.
+    """
+    name: str
+    path: str
+    mtime: int
+    version: str
+
+
+def get_cache_directory() -> Path:
+    """
+    Retrieves the directory where Anarky caches data between runs.
+
+    :return:
+        The cache directory ('$XDG_CACHE_HOME/anarky' or '~/.cache/anarky')
+    """
+    return Path(environ.get('XDG_CACHE_HOME') or Path.home() / '.cache', 'anarky')
+
+
+def get_version(path: str) -> str:
+    """
+    Retrieves the version of an external program, as reported by its '--version' option.
+
+    :param path:
+        The absolute path of the external program
+    :return:
+        The first line of the version report (empty if the program doesn't provide one)
+    """
+    try:
+        output = run([path, '--version'], stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+                     timeout=VERSION_TIMEOUT)
+    except (OSError, SubprocessError):
+        return ''
+
+    for line in (output.stdout + output.stderr).decode(ENCODING, errors='replace').splitlines():
+        if line.strip():
+            return line.strip()
+
+    return ''
+
+
+class Registry:
+    """
+    Resolves the external programs to absolute paths, once per process.
+
+    The program paths are found by searching the PATH environment variable, without spawning
+    any process. The versions are cached on disk and only read again (by running the program)
+    when the modification time of the binary changes.
+    """
+
+    def __init__(self, cache_file: Path = None):
+        """
+        :param cache_file:
+            The file where the program versions are cached (defaults to the Anarky cache directory)
+        """
+        self.cache_file = cache_file
+        self.tools = {}
+        self._default_cache = cache_file is None
+        self._lock = Lock()
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_file, 'r') as cache:
+                return load(cache)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: dict):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            temporary = self.cache_file.with_name(self.cache_file.name + '.tmp')
+            with open(temporary, 'w') as cache_file:
+                dump(cache, cache_file, indent=4)
+            replace(str(temporary), str(self.cache_file))
+        except OSError:
+            # The cache is an optimization: a read-only home directory must not stop a conversion
+            pass
+
+    def find(self, name: str) -> Optional[Tool]:
+        """
+        Finds an external program in the operating system.
+
+        :param name:
+            The name of the external program
+        :return:
+            The resolved program (None if the program isn't available)
+        """
+        with self._lock:
+            if name in self.tools:
+                return self.tools[name]
+
+            if self.cache_file is None:
+                self.cache_file = get_cache_directory() / CACHE_FILE
+
+            tool = None
+            path = which(name)
+            if path is not None:
+                path = str(Path(path).resolve())
+                mtime = stat(path).st_mtime_ns
+                cache = self._load_cache()
+                entry = cache.get(name, {})
+                if entry.get('path') == path and entry.get('mtime') == mtime:
+                    version = entry.get('version', '')
+                else:
+                    version = get_version(path)
+                    cache[name] = {'path': path, 'mtime': mtime, 'version': version}
+                    self._save_cache(cache)
+                tool = Tool(name, path, mtime, version)
+
+            self.tools[name] = tool
+            return tool
+
+    def clear(self):
+        """
+        Forgets the programs resolved so far (and the default cache directory), so they are
+        resolved again on next use.
+        """
+        with self._lock:
+            self.tools.clear()
+            if self._default_cache:
+                self.cache_file = None
+
+
+_registry = Registry()
+
+
+def find_program(name: str) -> Optional[Tool]:
+    """
+    Finds an external program in the operating system.
+
+    :param name:
+        The name of the external program
+    :return:
+        The resolved program (None if the program isn't available)
+    """
+    return _registry.find(name)
+
+
+def get_program(program: Program) -> str:
+    """
+    Retrieves the path used to invoke an external program.
+
+    :param program:
+        The external program
+    :return:
+        The absolute path of the program (or its name, if it isn't available, so that running it
+        fails with the usual error)
+    """
+    tool = _registry.find(program.value)
+    return program.value if tool is None else tool.path
+
+
+def get_missing_programs(programs: Iterable[Program]) -> List[str]:
+    """
+    Checks which of the given external programs aren't available.
+
+    :param programs:
+        The external programs
+    :return:
+        The names of the missing programs
+    """
+    return [program.value for program in programs if _registry.find(program.value) is None]
+
+
+def reset_programs():
+    """
+    Forgets the programs resolved so far (e.g. after the PATH environment variable changes).
+    """
+    _registry.clear()
@@ -0,0 +1,272 @@
+# -*- coding: utf8 -*-
+
+"""
+Parallel scheduling of encoding and decoding operations.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import cpu_count
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, TYPE_CHECKING
+
+from anarky.stats import stage
+from anarky.utils import get_outputs
+
+if TYPE_CHECKING:
+    from anarky.manifest import Manifest
+
+
+class Result(NamedTuple):
+    """
+    Outcome of a single conversion job.
+    """
+    filename: str
+    output: Optional[str] = None
+    error: Optional[str] = None
+    skipped: bool = False
+    duration: Optional[float] = None
+    tags: Optional[Dict[str, List[str]]] = None
+
+    @property
+    def failed(self) -> bool:
+        """
+        Checks if the conversion job failed.
+
+        :return:
+            True if the job raised an error; False otherwise
+        """
+        return self.error is not None
+
+
+# Duration and tags of the input file of the running job (a context variable rather than a thread
+# local one, so each job of the event loop engine has its own)
+_description = ContextVar('description', default=None)
+
+
+@contextmanager
+def describing() -> Iterator[dict]:
+    """
+    Collects the duration and tags of the input file that the stages of a job find while it runs
+    (see 'describe_job').
+
+    :return:
+        The duration and tags found so far (keys 'duration' and 'tags')
+    """
+    description = {}
+    token = _description.set(description)
+    try:
+        yield description
+    finally:
+        _description.reset(token)
+
+
+def describe_job(duration: float = None, tags: Dict[str, List[str]] = None):
+    """
+    Records the duration and tags of the input file of the running job, so they are carried on its
+    result (e.g. into a playlist) instead of being read from the file again. Outside of a job, it
+    does nothing.
+
+    :param duration:
+        The duration of the audio in seconds
+    :param tags:
+        The tags of the input file
+    """
+    description = _description.get()
+    if description is None:
+        return
+    if duration is not None:
+        description['duration'] = duration
+    if tags is not None:
+        description['tags'] = tags
+
+
+def is_job_described() -> bool:
+    """
+    Checks if the duration of the input file of the running job was recorded.
+
+    :return:
+        True if the duration was recorded; False otherwise
+    """
+    return 'duration' in (_description.get() or {})
+
+
+def default_jobs() -> int:
+    """
+    Retrieves the default number of parallel jobs.
+
+    :return:
+        The number of processors available in the operating system
+    """
+    return cpu_count() or 1
+
+
+def execute(function: Callable, filename: str, destination: str,
+            manifest: 'Manifest' = None) -> Result:
+    """
+    Runs a conversion function over a single file, trapping any error it raises.
+
+    :param function:
+        The conversion function (e.g. 'encode_wav_flac'), which returns the name of the output
+        file or a list of them (see 'get_outputs')
+    :param filename:
+        The input audio file name
+    :param destination:
+        The destination where the output file will be stored
+    :param manifest:
+        The manifest of previous conversions (if given, up to date files are skipped)
+    :return:
+        The outcome of the conversion job
+    """
+    try:
+        if manifest is not None and manifest.is_up_to_date(filename):
+            return Result(filename, manifest.get_output(filename), skipped=True)
+
+        with describing() as description, stage('job', filename) as current:
+            outputs = get_outputs(function(filename, destination))
+            current.output = outputs[0] if outputs else None
+        if manifest is not None and outputs:
+            manifest.update(filename, outputs)
+            manifest.checkpoint()
+    except Exception as e:
+        return Result(filename, error='{}: {}'.format(type(e).__name__, e))
+
+    return Result(filename, outputs[0] if outputs else None,
+                  duration=description.get('duration'), tags=description.get('tags'))
+
+
+class Scheduler:
+    """
+    Runs conversion jobs on a bounded pool of worker threads.
+
+    The actual work is carried out by external programs, so threads are enough to keep every
+    processor busy. The pool is kept alive between batches until the scheduler is closed.
+    """
+
+    def __init__(self, jobs: int = None):
+        """
+        :param jobs:
+            The maximum number of jobs running at the same time (defaults to the processor count)
+        """
+        self.jobs = jobs or default_jobs()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        Retrieves the pool of worker threads, creating it on first use.
+
+        :return:
+            The pool of worker threads
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='anarky')
+        return self._executor
+
+    def close(self):
+        """
+        Waits for the running jobs and releases the pool of worker threads.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def submit(self, function: Callable, filename: str, destination: str,
+               manifest: 'Manifest' = None) -> Future:
+        """
+        Queues a conversion job.
+
+        :param function:
+            The conversion function (e.g. 'encode_wav_flac')
+        :param filename:
+            The input audio file name
+        :param destination:
+            The destination where the output file will be stored
+        :param manifest:
+            The manifest of previous conversions (if given, up to date files are skipped)
+        :return:
+            The future outcome of the conversion job
+        """
+        return self.executor.submit(execute, function, filename, destination, manifest)
+
+    def run(self, function: Callable, files: Iterable[str], destination: str,
+            manifest: 'Manifest' = None,
+            known: Callable[[str], Optional[Result]] = None) -> Iterator[Result]:
+        """
+        Runs a conversion function over a set of files.
+
+        The input files are consumed lazily and only a couple of jobs per worker are queued at any
+        given time. The results are yielded as soon as each job finishes.
+
+        :param function:
+            The conversion function (e.g. 'encode_wav_flac')
+        :param files:
+            The input audio file names
+        :param destination:
+            The destination where the output files will be stored
+        :param manifest:
+            The manifest of previous conversions (if given, up to date files are skipped)
+        :param known:
+            The function that retrieves the outcome of a file that is already known (None if the
+            file must be converted); those outcomes are yielded as soon as the files are listed
+        :return:
+            The outcome of each conversion job, in order of completion
+        """
+        pending = set()
+        files = iter(files)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.jobs * 2:
+                    try:
+                        filename = next(files)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    result = None if known is None else known(filename)
+                    if result is not None:
+                        yield result
+                        continue
+                    pending.add(self.submit(function, filename, destination, manifest))
+
+                if not pending:
+                    return
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # If the batch is interrupted (or abandoned), the jobs that haven't started are dropped
+            for future in pending:
+                future.cancel()
+
+
+def run_jobs(function: Callable, files: Iterable[str], destination: str, jobs: int = None,
+             manifest: 'Manifest' = None) -> List[Result]:
+    """
+    Runs a conversion function over a set of files on a bounded pool of workers.
+
+    :param function:
+        The conversion function (e.g. 'encode_wav_flac')
+    :param files:
+        The input audio file names
+    :param destination:
+        The destination where the output files will be stored
+    :param jobs:
+        The maximum number of jobs running at the same time (defaults to the processor count)
+    :param manifest:
+        The manifest of previous conversions (if given, up to date files are skipped)
+    :return:
+        The outcome of each conversion job, in order of completion
+    """
+    with Scheduler(jobs) as scheduler:
+        return list(scheduler.run(function, files, destination, manifest))
@@ -0,0 +1,286 @@
+# -*- coding: utf8 -*-
+
+"""
+Scratch space on a fast local file system, where the intermediate and output files are written
+before the outputs are moved to their destination.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from os import access, close, getpid, open as open_file, O_RDWR, scandir, unlink, W_OK
+from os.path import getsize, isdir
+from pathlib import Path
+from shutil import disk_usage, rmtree
+from tempfile import gettempdir, mkdtemp, mkstemp
+from threading import Condition
+from typing import Callable, Iterator
+import re
+
+try:
+    from fcntl import flock, LOCK_EX, LOCK_NB
+except ImportError:
+    # Not available on Windows, where the scratch directories of other processes are kept
+    flock = None
+
+from anarky.metadata import read_audio_header
+from anarky.utils import set_workspace
+
+# Memory backed file system available in most Linux distributions
+SHARED_MEMORY = '/dev/shm'
+
+# Prefix of the scratch directories, followed by the process identifier of their owner
+PREFIX = 'anarky-scratch-'
+STALE = re.compile(re.escape(PREFIX) + r'(\d+)-')
+
+# Suffix of the lock file next to each scratch directory, which its owner keeps locked
+LOCK_SUFFIX = '.lock'
+
+# Share of the free space of the scratch file system used when there's no explicit budget
+BUDGET_SHARE = 0.5
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+ERROR_SIZE = "Size '{}' is invalid (expected a number of bytes, optionally followed by K, M, " \
+             "G or T)!"
+
+
+def default_scratch_directory() -> str:
+    """
+    Retrieves the default scratch directory: the shared memory file system if it's available or
+    the temporary directory of the operating system otherwise.
+
+    :return:
+        The name of the scratch directory
+    """
+    if isdir(SHARED_MEMORY) and access(SHARED_MEMORY, W_OK):
+        return SHARED_MEMORY
+
+    return gettempdir()
+
+
+def parse_size(value: str) -> int:
+    """
+    Converts a size with an optional binary unit (e.g. '512M' or '4G') into a number of bytes.
+
+    :param value:
+        The size
+    :return:
+        The number of bytes
+    :raise ValueError:
+        If the size isn't a positive number of bytes
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*', str(value), re.IGNORECASE)
+    if match is None or float(match.group(1)) <= 0:
+        raise ValueError(ERROR_SIZE.format(value))
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def estimate_scratch_size(filename: str) -> int:
+    """
+    Estimates the scratch space used by the conversion of a file: the decoded audio (which is
+    the largest intermediate or output file) plus the size of the input file (which bounds the
+    encoded outputs).
+
+    :param filename:
+        The input audio file name
+    :return:
+        The number of bytes
+    """
+    try:
+        size = getsize(str(filename))
+    except OSError:
+        return 0
+
+    # The header is usually read already (e.g. by the planner), so it isn't read again
+    header = read_audio_header(filename)
+    if header is not None and header.data_size:
+        return header.data_size + size
+
+    return 2 * size
+
+
+def remove_stale(directory: str) -> int:
+    """
+    Removes the scratch directories left behind by processes that no longer exist (e.g. killed
+    or crashed ones).
+
+    The owner of a scratch directory keeps the lock file next to it locked while it's alive (the
+    lock is released by the operating system when the process ends, however it ends), so a
+    directory is stale once its lock file can be locked. Unlike the process identifier in its
+    name, the lock can't be mistaken for another process that reused the identifier.
+
+    :param directory:
+        The scratch directory where the directories of each process are created
+    :return:
+        The number of directories removed
+    """
+    if flock is None:
+        return 0
+
+    try:
+        with scandir(directory) as entries:
+            candidates = [entry.path for entry in entries
+                          if entry.is_dir(follow_symlinks=False) and STALE.match(entry.name)]
+    except OSError:
+        return 0
+
+    removed = 0
+    for path in candidates:
+        lock = path + LOCK_SUFFIX
+        try:
+            descriptor = open_file(lock, O_RDWR)
+        except FileNotFoundError:
+            # The lock file is created (and locked) before the directory, so its owner is gone
+            descriptor = None
+        except OSError:
+            continue
+
+        try:
+            if descriptor is not None:
+                try:
+                    flock(descriptor, LOCK_EX | LOCK_NB)
+                except OSError:
+                    continue
+            rmtree(path, ignore_errors=True)
+            removed += 1
+            if descriptor is not None:
+                _unlink(lock)
+        finally:
+            if descriptor is not None:
+                close(descriptor)
+
+    return removed
+
+
+def _unlink(filename: str):
+    try:
+        unlink(filename)
+    except OSError:
+        pass
+
+
+class Scratch:
+    """
+    Scratch space for the conversions, on a fast local file system (such as '/dev/shm').
+
+    Each conversion reserves an estimate of the space it needs and gets a private directory, where
+    its intermediate and output files are written. The outputs are moved to their destination
+    (which may be a slow network share) once they're complete, each one in a single sequential
+    write. When the reservations reach the budget, the next conversion waits until enough space
+    is released. A conversion larger than the whole budget runs alone.
+
+    The scratch directories are removed when the conversions finish, when the scratch space is
+    closed and, for the processes that were killed, the next time a scratch space is created in
+    the same directory (see 'remove_stale'). The conversions waiting for space are served in the
+    order they asked for it, so a large one isn't overtaken forever by smaller ones.
+    """
+
+    def __init__(self, directory: str = None, budget: int = None):
+        """
+        :param directory:
+            The directory where the scratch space is created (defaults to '/dev/shm' or the
+            temporary directory)
+        :param budget:
+            The maximum number of bytes reserved at the same time (defaults to half of the free
+            space of the file system)
+        """
+        directory = str(directory or default_scratch_directory())
+        remove_stale(directory)
+
+        # The lock is held (by keeping the file open) for as long as the scratch space exists
+        self._lock, lock = mkstemp(prefix='{}{}-'.format(PREFIX, getpid()), suffix=LOCK_SUFFIX,
+                                   dir=directory)
+        if flock is not None:
+            flock(self._lock, LOCK_EX)
+        self._lock_file = lock
+        self.root = Path(lock[:-len(LOCK_SUFFIX)])
+        self.root.mkdir()
+
+        self.budget = budget or int(disk_usage(str(self.root)).free * BUDGET_SHARE)
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self._condition = Condition()
+        self._waiting = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def reserve(self, size: int) -> Iterator[Path]:
+        """
+        Reserves scratch space, waiting until it's available.
+
+        :param size:
+            The number of bytes
+        :return:
+            The private scratch directory, which is removed when the context exits
+        """
+        ticket = object()
+
+        def ready() -> bool:
+            return self._waiting[0] is ticket and \
+                (not self.used or self.used + size <= self.budget)
+
+        with self._condition:
+            self._waiting.append(ticket)
+            try:
+                if not ready():
+                    self.waits += 1
+                    self._condition.wait_for(ready)
+            finally:
+                # The next conversion in line may fit as well (or take over if this one gave up)
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+        try:
+            workspace = Path(mkdtemp(dir=str(self.root)))
+            try:
+                yield workspace
+            finally:
+                rmtree(str(workspace), ignore_errors=True)
+        finally:
+            with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+    def track(self, function: Callable[[str, str], str],
+              size: Callable[[str], int] = estimate_scratch_size) -> Callable[[str, str], str]:
+        """
+        Wraps a conversion function, so each conversion writes its files into the scratch space.
+
+        :param function:
+            The conversion function (e.g. 'encode_flac_mp3')
+        :param size:
+            The function that estimates the scratch space used by the conversion of a file
+        :return:
+            The wrapped conversion function
+        """
+        def convert(filename: str, destination: str) -> str:
+            with self.reserve(size(filename)) as workspace:
+                set_workspace(workspace)
+                try:
+                    return function(filename, destination)
+                finally:
+                    set_workspace(None)
+
+        return convert
+
+    def close(self):
+        """
+        Removes the scratch space.
+        """
+        rmtree(str(self.root), ignore_errors=True)
+        if self._lock is not None:
+            _unlink(self._lock_file)
+            close(self._lock)
+            self._lock = None
@@ -0,0 +1,24 @@
+# -*- coding: utf8 -*-
+
+"""
+Decodes FLAC files once and encodes them into several formats at the same time.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from anarky.api import fan_out_conversion
+from anarky.enum.audio_file import AudioFile
+from anarky.enum.description import Description
+from anarky.enum.program import Program
+from anarky.enum.script import Script
+from anarky.interface import configure_logging, convert, get_options
+
+def run():
+    """
+    Runs the program that decodes FLAC files once and encodes them into several formats.
+    """
+    configure_logging()
+    (files, options) = get_options(Script.FLAC2MANY.value, Description.FLAC2MANY.value, True,
+                                   [Program.FLAC], [AudioFile.FLAC.value], fanout=True)
+    return convert(Script.FLAC2MANY.value, files, options, fan_out_conversion(options.targets))
@@ -7,15 +7,17 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
-from anarky.audio.encode import encode_flac_mp3
+from anarky.enum.audio_file import AudioFile
 from anarky.enum.description import Description
+from anarky.enum.program import Program
 from anarky.enum.script import Script
-from anarky.interface import get_options
+from anarky.interface import configure_logging, convert, get_options
 
 def run():
     """
     Runs the progrm to encode FLAC files into MP3 files.
     """
-    (files, destination) = get_options(Script.FLAC2MP3.value, Description.FLAC2MP3.value, True)
-    for item in files:
-        encode_flac_mp3(item, destination)
+    configure_logging()
+    (files, options) = get_options(Script.FLAC2MP3.value, Description.FLAC2MP3.value, True,
+                                   [Program.FLAC, Program.LAME], [AudioFile.FLAC.value])
+    return convert(Script.FLAC2MP3.value, files, options)
@@ -7,12 +7,17 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
-from anarky.audio.decode import decode_flac_wav
+from anarky.enum.audio_file import AudioFile
 from anarky.enum.description import Description
+from anarky.enum.program import Program
 from anarky.enum.script import Script
-from anarky.interface import get_options
+from anarky.interface import configure_logging, convert, get_options
 
 def run():
-    (files, destination) = get_options(Script.FLAC2WAV.value, Description.FLAC2WAV.value, True)
-    for item in files:
-        decode_flac_wav(item, destination)
+    """
+    Runs the program to decode FLAC files into WAV files.
+    """
+    configure_logging()
+    (files, options) = get_options(Script.FLAC2WAV.value, Description.FLAC2WAV.value, True,
+                                   [Program.FLAC], [AudioFile.FLAC.value])
+    return convert(Script.FLAC2WAV.value, files, options)
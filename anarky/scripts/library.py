@@ -0,0 +1,126 @@
+# -*- coding: utf8 -*-
+
+"""
+Indexes an audio library and lists the files that match a query on their tags and properties.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+import argparse
+import logging
+import sys
+
+from anarky.__version__ import __version__
+from anarky.enum.audio_file import AudioFile
+from anarky.enum.description import Description
+from anarky.enum.script import Script
+from anarky.interface import configure_logging, directory_exists
+
+ERROR_TAG = "Tag '{}' is invalid (expected NAME=VALUE)!"
+INDEXED = '{} file(s) added, {} updated, {} unchanged, {} removed, {} unreadable'
+
+_logger = logging.getLogger(__name__)
+
+
+def tag_filter(value: str) -> tuple:
+    """
+    Converts a command line argument into a tag name and value.
+    :param value: The value of the command line argument (e.g. 'ARTIST=Nina Simone')
+    :return: The tag name and value
+    """
+    name, separator, tag_value = value.partition('=')
+    if not separator or not name.strip():
+        raise argparse.ArgumentTypeError(ERROR_TAG.format(value))
+
+    return name.strip().upper(), tag_value
+
+
+def get_library_options(program, description):
+    """
+    Parses, retrieves and validates the values for the command line arguments of the library
+    index.
+    :param program: The name of the program
+    :param description: The description of the program
+    :return: The command line arguments
+    """
+    parser = argparse.ArgumentParser(prog=program, description=description)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('--index', metavar='FILE', dest='index',
+        help='file where the library index is stored (default: library.db in the cache directory)')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    update = commands.add_parser('update', help='index the new and changed files')
+    update.add_argument('-f', '--files', nargs='+', metavar='FILES', dest='input_files',
+        help='input files and directories', required=True)
+    update.add_argument('--include', metavar='GLOB', dest='include', action='append', default=[],
+        help='only index the files (inside directories) that match the pattern')
+    update.add_argument('--exclude', metavar='GLOB', dest='exclude', action='append', default=[],
+        help='skip the files and directories that match the pattern')
+
+    query = commands.add_parser('query', help='list the indexed files that match every filter')
+    query.add_argument('--format', metavar='FORMAT', dest='format',
+        choices=[AudioFile.FLAC.name.lower(), AudioFile.WAV.name.lower()],
+        help='format of the files (flac or wav)')
+    query.add_argument('--tag', metavar='NAME=VALUE', dest='tags', type=tag_filter,
+        action='append', default=[], help='value of a tag of the files (case insensitive)')
+    cover = query.add_mutually_exclusive_group()
+    cover.add_argument('--cover', action='store_true', dest='cover', default=None,
+        help='only list the files with embedded pictures')
+    cover.add_argument('--no-cover', action='store_false', dest='cover',
+        help='only list the files without embedded pictures')
+    query.add_argument('--missing-in', metavar='OUTPUT', dest='missing_in',
+        help='only list the files not yet converted into the output directory')
+    query.add_argument('--missing-format', metavar='FORMAT', dest='missing_format',
+        choices=[audio_file.name.lower() for audio_file in AudioFile], default='mp3',
+        help='format of the converted files looked up with --missing-in (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.command == 'query' and args.missing_in is not None and \
+            not directory_exists(args.missing_in):
+        sys.exit(1)
+
+    return args
+
+
+def library(options: argparse.Namespace) -> int:
+    """
+    Runs a command of the library index: updates it or lists the files that match a query (one per
+    line, so they can be passed on to a conversion).
+    :param options: The command line arguments of the library index
+    :return: The exit status of the program (0 if the command succeeded; 1 if the index can't be
+        used)
+    """
+    from anarky.library import LibraryIndex, without_output
+    import sqlite3
+
+    try:
+        index = LibraryIndex(options.index)
+    except (OSError, sqlite3.Error) as e:
+        _logger.error(str(e))
+        return 1
+
+    with index:
+        if options.command == 'update':
+            summary = index.update(options.input_files, options.include, options.exclude)
+            _logger.info(INDEXED.format(*summary))
+            return 0
+
+        extension = '.' + options.format if options.format else None
+        files = index.select(extension, dict(options.tags), options.cover)
+        if options.missing_in is not None:
+            files = without_output(files, options.missing_in, '.' + options.missing_format)
+        for filename in files:
+            print(filename)
+
+    return 0
+
+
+def run():
+    """
+    Runs the program that indexes an audio library and queries the index.
+    """
+    configure_logging()
+    options = get_library_options(Script.LIBRARY.value, Description.LIBRARY.value)
+    return library(options)
@@ -0,0 +1,69 @@
+# -*- coding: utf8 -*-
+
+"""
+Runs any of the Anarky programs as a command of a single 'anarky' program.
+
+Only the modules of the selected command are imported, so a command that's run once per file
+spends as little time as possible starting up.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from importlib import import_module
+import sys
+
+# Commands, each one run by the module of the same name in this package
+COMMANDS = ('flac2mp3', 'flac2many', 'flac2wav', 'wav2flac', 'wav2mp3', 'watch', 'verify', 'queue',
+            'library')
+
+USAGE = 'usage: anarky [-h] [-v] COMMAND ...'
+ERROR_COMMAND = "anarky: error: invalid command '{}' (choose from {})"
+
+
+def print_help(file=None):
+    """
+    Prints the list of commands along with their descriptions.
+
+    :param file:
+        The stream where the help is printed (stdout by default)
+    """
+    from anarky.enum.description import Description
+
+    lines = [USAGE, '', Description.ANARKY.value, '', 'commands:']
+    lines += ['  {:<11} {}'.format(command, Description[command.upper()].value)
+              for command in COMMANDS]
+    lines += ['', "Run 'anarky COMMAND -h' to see the options of a command."]
+    print('\n'.join(lines), file=file)
+
+
+def run(arguments=None):
+    """
+    Runs the command selected by the first argument, with the remaining arguments.
+
+    :param arguments:
+        The command line arguments (defaults to the ones of the process)
+    :return:
+        The exit status of the command
+    """
+    arguments = sys.argv[1:] if arguments is None else list(arguments)
+    if not arguments:
+        print_help(sys.stderr)
+        return 2
+    if arguments[0] in ('-h', '--help'):
+        print_help()
+        return 0
+
+    command = arguments[0]
+    if command in ('-v', '--version'):
+        from anarky.__version__ import __version__
+        print('anarky ' + __version__)
+        return 0
+    if command not in COMMANDS:
+        print(USAGE, file=sys.stderr)
+        print(ERROR_COMMAND.format(command, ', '.join(COMMANDS)), file=sys.stderr)
+        return 2
+
+    # The command parses the arguments that follow its name
+    sys.argv = ['anarky ' + command] + arguments[1:]
+    return import_module('anarky.scripts.' + command).run()
@@ -0,0 +1,195 @@
+# -*- coding: utf8 -*-
+
+"""
+Spreads the conversion of a batch of audio files across several hosts through a shared job queue.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from signal import SIGTERM, signal
+from threading import Event
+from typing import TYPE_CHECKING
+import argparse
+import logging
+import sys
+
+from anarky.__version__ import __version__
+from anarky.api import ConversionError, CONVERSIONS, Converter
+from anarky.enum.description import Description
+from anarky.enum.script import Script
+from anarky.interface import add_profile_option, add_scratch_options, configure_logging, \
+    directory_exists, ERROR_JOB, iter_input_files, positive_integer, positive_number, \
+    report_result
+from anarky.scheduler import default_jobs
+
+if TYPE_CHECKING:
+    from anarky.cluster import JobQueue
+
+ERROR_QUEUE_CONVERSION = "Queue '{}' holds '{}' jobs, not '{}' ones!"
+ERROR_QUEUE_EMPTY = "Queue '{}' has no jobs (add them with 'submit' first)!"
+SUBMITTED = "{} job(s) added to '{}'"
+QUEUE_STATUS = '{} queued, {} running, {} done, {} failed'
+REQUEUED = '{} job(s) of crashed workers queued again'
+
+_logger = logging.getLogger(__name__)
+
+
+def get_queue_options(program, description):
+    """
+    Parses, retrieves and validates the values for the command line arguments of the distributed
+    conversion (the coordinator that submits jobs, the workers that convert them and the status of
+    the queue).
+    :param program: The name of the program
+    :param description: The description of the program
+    :return: The command line arguments
+    """
+    from anarky.cluster import LEASE
+
+    parser = argparse.ArgumentParser(prog=program, description=description)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    submit = commands.add_parser('submit', help='add the input files to the queue')
+    submit.add_argument('queue', metavar='QUEUE', help='queue file on the shared storage')
+    submit.add_argument('conversion', metavar='CONVERSION', choices=sorted(CONVERSIONS),
+        help='conversion of the input files ({})'.format(', '.join(sorted(CONVERSIONS))))
+    submit.add_argument('-f', '--files', nargs='+', metavar='FILES', dest='input_files',
+        help='input files and directories', required=True)
+    submit.add_argument('-o', '--output', metavar='OUTPUT', dest='output_dir',
+        help='output directory', required=True)
+    add_profile_option(submit)
+    submit.add_argument('--include', metavar='GLOB', dest='include', action='append', default=[],
+        help='only convert the files (inside directories) that match the pattern')
+    submit.add_argument('--exclude', metavar='GLOB', dest='exclude', action='append', default=[],
+        help='skip the files and directories that match the pattern')
+
+    work = commands.add_parser('work', help='convert the jobs of the queue until it\'s drained')
+    work.add_argument('queue', metavar='QUEUE', help='queue file on the shared storage')
+    work.add_argument('-j', '--jobs', metavar='JOBS', dest='jobs', type=positive_integer,
+        default=default_jobs(), help='number of files converted in parallel (default: %(default)s)')
+    work.add_argument('--lease', metavar='SECONDS', dest='lease', type=positive_number,
+        default=LEASE, help='time after which the jobs of a crashed worker are queued again '
+        '(default: %(default)s)')
+    add_scratch_options(work)
+
+    status = commands.add_parser('status', help='show the progress of the queue')
+    status.add_argument('queue', metavar='QUEUE', help='queue file on the shared storage')
+    args = parser.parse_args()
+
+    directories = []
+    if args.command == 'submit':
+        directories = [args.output_dir]
+    elif args.command == 'work':
+        directories = [args.scratch]
+    for directory in directories:
+        if directory is not None and not directory_exists(directory):
+            sys.exit(1)
+
+    return args
+
+
+def queue(options: argparse.Namespace) -> int:
+    """
+    Runs a command of the distributed conversion.
+    :param options: The command line arguments of the distributed conversion
+    :return: The exit status of the program (0 if every job succeeded; 1 if any failed or the
+        queue can't be used; 130 if the program was interrupted)
+    """
+    from anarky.cluster import DONE, FAILED, JobQueue, LEASE, QUEUED, RUNNING
+    import sqlite3
+
+    try:
+        job_queue = JobQueue(options.queue, getattr(options, 'lease', LEASE))
+    except (OSError, ValueError, sqlite3.Error) as e:
+        _logger.error(str(e))
+        return 1
+
+    with job_queue:
+        if options.command == 'submit':
+            return submit_jobs(job_queue, options)
+        if options.command == 'work':
+            return work_jobs(job_queue, options)
+
+        counts = job_queue.counts()
+        for result in job_queue.failures():
+            _logger.error(ERROR_JOB.format(result.filename, result.error))
+        _logger.info(QUEUE_STATUS.format(counts[QUEUED], counts[RUNNING], counts[DONE],
+                                         counts[FAILED]))
+        return 1 if counts[FAILED] else 0
+
+
+def submit_jobs(job_queue: 'JobQueue', options: argparse.Namespace) -> int:
+    """
+    Adds the input files to the queue, along with the settings of the conversion.
+    :param job_queue: The shared queue of jobs
+    :param options: The command line arguments of the coordinator
+    :return: The exit status of the program (0 if the jobs were added; 1 otherwise)
+    """
+    conversion = job_queue.settings.get('conversion', options.conversion)
+    if conversion != options.conversion:
+        _logger.error(ERROR_QUEUE_CONVERSION.format(options.queue, conversion, options.conversion))
+        return 1
+
+    job_queue.configure(conversion=options.conversion,
+                        destination=str(Path(options.output_dir).resolve()),
+                        profile=options.profile)
+    files = iter_input_files(options.input_files, [CONVERSIONS[options.conversion].extension],
+                             options.include, options.exclude)
+    _logger.info(SUBMITTED.format(job_queue.add(files), options.queue))
+    return 0
+
+
+def work_jobs(job_queue: 'JobQueue', options: argparse.Namespace) -> int:
+    """
+    Converts the jobs claimed from the queue until it's drained, or the worker is interrupted or
+    terminated.
+    :param job_queue: The shared queue of jobs
+    :param options: The command line arguments of the worker
+    :return: The exit status of the program (0 if every job succeeded; 1 if any failed or the
+        conversion can't be set up; 130 if the program was interrupted)
+    """
+    from anarky.cluster import QueueWorker
+
+    settings = job_queue.settings
+    if 'conversion' not in settings:
+        _logger.error(ERROR_QUEUE_EMPTY.format(options.queue))
+        return 1
+
+    try:
+        converter = Converter(settings['conversion'], settings['destination'], options.jobs,
+                              profile=settings.get('profile'), scratch=options.scratch,
+                              scratch_budget=options.scratch_budget)
+    except ConversionError as e:
+        _logger.error(str(e))
+        return 1
+
+    # Terminating the worker lets the running conversions finish and re-queues the claimed jobs
+    stop = Event()
+    signal(SIGTERM, lambda signum, frame: stop.set())
+
+    failed = 0
+    with converter:
+        try:
+            for result in QueueWorker(converter, job_queue).run(stop):
+                report_result(result)
+                failed += result.failed
+        except KeyboardInterrupt:
+            _logger.warning('\nThe program execution was interrupted! The jobs that were claimed '
+                            'but not started are back in the queue.\n')
+            return 130
+
+    if job_queue.requeued:
+        _logger.info(REQUEUED.format(job_queue.requeued))
+    return 1 if failed else 0
+
+
+def run():
+    """
+    Runs the program that submits, converts or shows the jobs of a shared queue.
+    """
+    configure_logging()
+    options = get_queue_options(Script.QUEUE.value, Description.QUEUE.value)
+    return queue(options)
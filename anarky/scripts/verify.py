@@ -0,0 +1,113 @@
+# -*- coding: utf8 -*-
+
+"""
+Verifies the integrity of FLAC files that changed since their last verification.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from signal import SIGTERM, signal
+from threading import Event
+from typing import Iterable
+import argparse
+import logging
+import sys
+
+from anarky.__version__ import __version__
+from anarky.enum.audio_file import AudioFile
+from anarky.enum.description import Description
+from anarky.enum.program import Program
+from anarky.enum.script import Script
+from anarky.interface import configure_logging, iter_input_files, positive_integer
+from anarky.programs import ERROR_PROGRAMS, get_missing_programs
+from anarky.scheduler import default_jobs
+
+ERROR_CORRUPT = "File '{}' is corrupt or couldn't be tested: {}"
+VERIFIED = '{} file(s) verified, {} unchanged since their last verification, {} corrupt'
+
+_logger = logging.getLogger(__name__)
+
+
+def get_verify_options(program, description):
+    """
+    Parses, retrieves and validates the values for the command line arguments of the integrity
+    verification.
+    :param program: The name of the program
+    :param description: The description of the program
+    :return: The input files (found lazily) and the remaining command line arguments
+    """
+    parser = argparse.ArgumentParser(prog=program, description=description)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    group = parser.add_argument_group('options')
+    group.add_argument('-f', '--files', nargs='+', metavar='FILES', dest='input_files',
+        help='input files and directories', required=True)
+    group.add_argument('-j', '--jobs', metavar='JOBS', dest='jobs', type=positive_integer,
+        default=default_jobs(), help='number of files tested in parallel (default: %(default)s)')
+    group.add_argument('--include', metavar='GLOB', dest='include', action='append', default=[],
+        help='only verify the files (inside directories) that match the pattern')
+    group.add_argument('--exclude', metavar='GLOB', dest='exclude', action='append', default=[],
+        help='skip the files and directories that match the pattern')
+    group.add_argument('--index', metavar='FILE', dest='index',
+        help='file where the outcome of each verification is stored (default: '
+        'verification.json in the cache directory)')
+    group.add_argument('--force', action='store_true', dest='force',
+        help='test every file, even the ones that didn\'t change since their last verification')
+    args = parser.parse_args()
+
+    missing = get_missing_programs([Program.FLAC])
+    if missing:
+        _logger.error(ERROR_PROGRAMS.format(', '.join(missing)))
+        sys.exit(1)
+
+    files = iter_input_files(args.input_files, [AudioFile.FLAC.value], args.include, args.exclude)
+    return files, args
+
+
+def verify(files: Iterable[str], options: argparse.Namespace) -> int:
+    """
+    Verifies the integrity of the input files and reports the outcome.
+    :param files: The input files
+    :param options: The command line arguments of the integrity verification
+    :return: The exit status of the program (0 if every file is intact; 1 if any is corrupt; 130
+        if the program was interrupted)
+    """
+    from anarky.verify import VerificationIndex, Verifier
+
+    verifier = Verifier(VerificationIndex(options.index), options.jobs, options.force)
+
+    # Terminating the sweep lets the running tests finish and saves the index
+    stop = Event()
+    signal(SIGTERM, lambda signum, frame: stop.set())
+
+    verified = unchanged = corrupt = 0
+    results = verifier.verify(files)
+    try:
+        for result in results:
+            if result.failed:
+                _logger.error(ERROR_CORRUPT.format(result.filename, result.error))
+                corrupt += 1
+            elif result.skipped:
+                unchanged += 1
+            else:
+                verified += 1
+            if stop.is_set():
+                break
+    except KeyboardInterrupt:
+        _logger.warning('\nThe program execution was interrupted! The files verified so far are '
+                        'skipped by the next run.\n')
+        return 130
+    finally:
+        results.close()
+        _logger.info(VERIFIED.format(verified, unchanged, corrupt))
+
+    return 1 if corrupt else 0
+
+
+def run():
+    """
+    Runs the program that verifies the integrity of FLAC files.
+    """
+    configure_logging()
+    (files, options) = get_verify_options(Script.VERIFY.value, Description.VERIFY.value)
+    return verify(files, options)
@@ -0,0 +1,109 @@
+# -*- coding: utf8 -*-
+
+"""
+Converts the WAV or FLAC files dropped into a set of directories as soon as they are complete.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from signal import SIGTERM, signal
+from threading import Event
+import argparse
+import logging
+import sys
+
+from anarky.__version__ import __version__
+from anarky.api import ConversionError, CONVERSIONS, Converter
+from anarky.enum.description import Description
+from anarky.enum.script import Script
+from anarky.interface import add_profile_option, add_scratch_options, configure_logging, \
+    directory_exists, positive_integer, positive_number, report_result
+from anarky.scheduler import default_jobs
+
+WATCHING = "Watching {} for new '{}' files ({}), converting them into '{}'"
+
+_logger = logging.getLogger(__name__)
+
+
+def get_watch_options(program, description):
+    """
+    Parses, retrieves and validates the values for the command line arguments of the watch daemon.
+    :param program: The name of the program
+    :param description: The description of the program
+    :return: The command line arguments
+    """
+    from anarky.watch import INTERVAL, SETTLE
+
+    parser = argparse.ArgumentParser(prog=program, description=description)
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('conversion', metavar='CONVERSION', choices=sorted(CONVERSIONS),
+        help='conversion of the new files ({})'.format(', '.join(sorted(CONVERSIONS))))
+    group = parser.add_argument_group('options')
+    group.add_argument('-d', '--directories', nargs='+', metavar='DIRS', dest='input_dirs',
+        help='directories where the input files are dropped', required=True)
+    group.add_argument('-o', '--output', metavar='OUTPUT', dest='output_dir',
+        help='output directory', required=True)
+    group.add_argument('-j', '--jobs', metavar='JOBS', dest='jobs', type=positive_integer,
+        default=default_jobs(), help='number of files converted in parallel (default: %(default)s)')
+    add_profile_option(group)
+    group.add_argument('--settle', metavar='SECONDS', dest='settle', type=positive_number,
+        default=SETTLE, help='time a file must stay unchanged before it\'s converted (default: '
+        '%(default)s)')
+    group.add_argument('--interval', metavar='SECONDS', dest='interval', type=positive_number,
+        default=INTERVAL, help='time between scans when the directories are polled (default: '
+        '%(default)s)')
+    group.add_argument('--polling', action='store_true', dest='polling',
+        help='poll the directories even if inotify is available')
+    add_scratch_options(group)
+    args = parser.parse_args()
+
+    for directory in args.input_dirs + [args.output_dir, args.scratch]:
+        if directory is not None and not directory_exists(directory):
+            sys.exit(1)
+
+    return args
+
+
+def watch(options: argparse.Namespace) -> int:
+    """
+    Converts the files dropped into the input directories until the program is interrupted or
+    terminated.
+    :param options: The command line arguments of the watch daemon
+    :return: The exit status of the program (0 once it's stopped; 1 if the conversion can't be set
+        up)
+    """
+    from anarky.watch import Watcher
+
+    try:
+        converter = Converter(options.conversion, options.output_dir, options.jobs,
+                              incremental=True, profile=options.profile, scratch=options.scratch,
+                              scratch_budget=options.scratch_budget)
+    except ConversionError as e:
+        _logger.error(str(e))
+        return 1
+
+    # Terminating the daemon (e.g. from the service manager) lets the running conversions finish
+    stop = Event()
+    signal(SIGTERM, lambda signum, frame: stop.set())
+
+    with Watcher(converter, options.input_dirs, options.settle, options.interval,
+                 options.polling, report_result) as watcher:
+        _logger.info(WATCHING.format(', '.join(options.input_dirs),
+                                     converter.conversion.extension, options.conversion,
+                                     options.output_dir))
+        try:
+            watcher.run(stop)
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+
+def run():
+    """
+    Runs the program that converts the files dropped into a set of directories.
+    """
+    configure_logging()
+    options = get_watch_options(Script.WATCH.value, Description.WATCH.value)
+    return watch(options)
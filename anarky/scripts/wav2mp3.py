@@ -7,12 +7,17 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
-from anarky.audio.encode import encode_wav_mp3
+from anarky.enum.audio_file import AudioFile
 from anarky.enum.description import Description
+from anarky.enum.program import Program
 from anarky.enum.script import Script
-from anarky.interface import get_options
+from anarky.interface import configure_logging, convert, get_options
 
 def run():
-    (files, destination) = get_options(Script.WAV2MP3.value, Description.WAV2MP3.value, True)
-    for item in files:
-        encode_wav_mp3(item, destination)
+    """
+    Runs the program to encode WAV files into MP3 files.
+    """
+    configure_logging()
+    (files, options) = get_options(Script.WAV2MP3.value, Description.WAV2MP3.value, True,
+                                   [Program.LAME], [AudioFile.WAV.value])
+    return convert(Script.WAV2MP3.value, files, options)
@@ -0,0 +1,292 @@
+# -*- coding: utf8 -*-
+
+"""
+Timing and throughput statistics of the encoding and decoding operations.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from contextlib import contextmanager
+from json import dump
+from os.path import getsize
+from threading import local, Lock
+from time import perf_counter, thread_time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+PERCENTILES = (50, 90, 99)
+SLOWEST = 10
+
+_local = local()
+_recorder = None
+
+
+class Record(NamedTuple):
+    """
+    Statistics of a single stage (e.g. 'encode') of the conversion of a file.
+    """
+    stage: str
+    filename: str
+    wall: float
+    cpu: float
+    bytes_in: int
+    bytes_out: int
+    duration: float
+
+    @property
+    def realtime_factor(self) -> Optional[float]:
+        """
+        Calculates how many seconds of audio were processed per second of wall time.
+
+        :return:
+            The real-time factor (None if the audio duration is unknown)
+        """
+        if not self.duration or not self.wall:
+            return None
+        return self.duration / self.wall
+
+
+def percentile(values: List[float], rank: int) -> float:
+    """
+    Calculates a percentile with the nearest-rank method.
+
+    :param values:
+        The sorted values
+    :param rank:
+        The percentile rank (between 0 and 100)
+    :return:
+        The percentile (0 if there are no values)
+    """
+    if not values:
+        return 0.0
+    index = max(0, -(-rank * len(values) // 100) - 1)
+    return values[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Summarizes a set of values with their total, percentiles and maximum.
+
+    :param values:
+        The values
+    :return:
+        The summary of the values
+    """
+    values = sorted(values)
+    summary = {'total': sum(values)}
+    for rank in PERCENTILES:
+        summary['p{}'.format(rank)] = percentile(values, rank)
+    summary['max'] = values[-1] if values else 0.0
+    return summary
+
+
+def add_child_time(seconds: float):
+    """
+    Adds the processor time used by an external program to the stage running in the current
+    thread.
+
+    :param seconds:
+        The user and system time of the external program
+    """
+    _local.child_time = getattr(_local, 'child_time', 0.0) + seconds
+
+
+def _cpu_time() -> float:
+    return thread_time() + getattr(_local, 'child_time', 0.0)
+
+
+def _size(filename: str) -> int:
+    try:
+        return getsize(str(filename))
+    except (OSError, TypeError):
+        return 0
+
+
+class Recorder:
+    """
+    Collects the statistics of every stage of a batch of conversions.
+
+    The processor time of a stage includes the time used by the external programs it ran, which is
+    where most of the work happens.
+    """
+
+    def __init__(self, duration: Callable[[str], float] = None):
+        """
+        :param duration:
+            The function that retrieves the duration of an audio file, used to calculate the
+            real-time factors (no durations are calculated by default)
+        """
+        self.records = []
+        self._duration = duration
+        self._durations = {}
+        self._lock = Lock()
+        self._start = perf_counter()
+
+    def duration(self, filename: str) -> float:
+        """
+        Retrieves the duration of an audio file (only calculated once per file).
+
+        :param filename:
+            The audio file name
+        :return:
+            The duration in seconds (0 if unknown)
+        """
+        if self._duration is None:
+            return 0.0
+
+        key = str(filename)
+        with self._lock:
+            if key in self._durations:
+                return self._durations[key]
+        try:
+            seconds = self._duration(key) or 0.0
+        except Exception:
+            seconds = 0.0
+        with self._lock:
+            self._durations[key] = seconds
+        return seconds
+
+    def add(self, record: Record):
+        """
+        Adds the statistics of a stage.
+
+        :param record:
+            The statistics of the stage
+        """
+        with self._lock:
+            self.records.append(record)
+
+    def report(self, jobs: int = None) -> dict:
+        """
+        Builds the report of the batch, with the statistics of each stage and each file.
+
+        The 'job' stage covers the full conversion of each file, so its records are used for the
+        batch throughput and the list of slowest files.
+
+        :param jobs:
+            The number of parallel jobs used in the batch
+        :return:
+            The report of the batch
+        """
+        wall = perf_counter() - self._start
+        with self._lock:
+            records = list(self.records)
+
+        stages = {}
+        for name in sorted({record.stage for record in records}):
+            selected = [record for record in records if record.stage == name]
+            factors = [record.realtime_factor for record in selected
+                       if record.realtime_factor is not None]
+            stages[name] = {
+                'count': len(selected),
+                'wall': summarize([record.wall for record in selected]),
+                'cpu': summarize([record.cpu for record in selected]),
+                'bytes_in': sum(record.bytes_in for record in selected),
+                'bytes_out': sum(record.bytes_out for record in selected),
+                'realtime_factor': summarize(factors)
+            }
+
+        jobs_records = [record for record in records if record.stage == 'job']
+        bytes_in = sum(record.bytes_in for record in jobs_records)
+        duration = sum(record.duration for record in jobs_records)
+        slowest = sorted(jobs_records, key=lambda record: record.wall, reverse=True)[:SLOWEST]
+        return {
+            'batch': {
+                'jobs': jobs,
+                'files': len(jobs_records),
+                'wall': wall,
+                'files_per_second': len(jobs_records) / wall if wall else 0.0,
+                'megabytes_per_second': bytes_in / wall / 1e6 if wall else 0.0,
+                'audio_seconds': duration,
+                'realtime_factor': duration / wall if wall else 0.0
+            },
+            'stages': stages,
+            'slowest': [self._as_dict(record) for record in slowest],
+            'files': [self._as_dict(record) for record in records]
+        }
+
+    @staticmethod
+    def _as_dict(record: Record) -> dict:
+        values = record._asdict()
+        values['realtime_factor'] = record.realtime_factor
+        return values
+
+    def save(self, filename: str, jobs: int = None):
+        """
+        Writes the report of the batch to a JSON file.
+
+        :param filename:
+            The name of the report file
+        :param jobs:
+            The number of parallel jobs used in the batch
+        """
+        with open(filename, 'w') as report_file:
+            dump(self.report(jobs), report_file, indent=4)
+
+
+def get_recorder() -> Optional[Recorder]:
+    """
+    Retrieves the active recorder of statistics.
+
+    :return:
+        The active recorder (None if statistics aren't being collected)
+    """
+    return _recorder
+
+
+def set_recorder(recorder: Optional[Recorder]):
+    """
+    Activates a recorder of statistics (or disables statistics, if None).
+
+    :param recorder:
+        The recorder of statistics
+    """
+    global _recorder
+    _recorder = recorder
+
+
+class _Stage:
+    # Mutable holder for the output of a stage, which is only known at the end
+    output = None
+
+
+@contextmanager
+def stage(name: str, filename: str, cpu: bool = True, audio: bool = True) -> Iterator[_Stage]:
+    """
+    Measures a stage of the conversion of a file, if statistics are being collected.
+
+    The output file of the stage can be set on the yielded object, so its size is recorded::
+
+        with stage('encode', filename) as current:
+            current.output = encode(filename)
+
+    :param name:
+        The name of the stage (e.g. 'decode', 'encode', 'metadata')
+    :param filename:
+        The input file name
+    :param cpu:
+        Flag that indicates if the processor time is measured (the stages that run on an event
+        loop share its thread with every other job, and their programs are reaped by asyncio, so
+        their processor time is recorded as 0)
+    :param audio:
+        Flag that indicates if the stage processes the audio of the file (the duration of the
+        audio, and so the real-time factor, is only recorded for the stages that do)
+    :return:
+        The holder of the output file of the stage
+    """
+    current = _Stage()
+    recorder = _recorder
+    if recorder is None:
+        yield current
+        return
+
+    wall = perf_counter()
+    start = _cpu_time() if cpu else 0.0
+    try:
+        yield current
+    finally:
+        wall = perf_counter() - wall
+        cpu = _cpu_time() - start if cpu else 0.0
+        recorder.add(Record(name, str(filename), wall, cpu, _size(filename),
+                            _size(current.output) if current.output is not None else 0,
+                            recorder.duration(filename) if audio else 0.0))
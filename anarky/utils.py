@@ -7,10 +7,40 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from os import replace, scandir
+from os.path import join, relpath
 from pathlib import Path
+from queue import Full, Queue
+from shutil import copyfile
+from tempfile import mkdtemp
+from threading import Event, local, Lock, Thread
+from typing import Iterable, Iterator, List, Optional
 
 ENCODING = 'utf-8'
 
+# Message of the files and directories that can't be used (e.g. 'Directory', '/srv/mp3')
+ERROR_UNAVAILABLE = "{} '{}' is not available (doesn't exist or no privileges to access it)!"
+
+# Marker in the names of the output files that are still being written
+PARTIAL = '.anarky-partial'
+
+# Maximum number of items produced ahead of the consumer by 'prefetch'
+PREFETCH_SIZE = 1024
+
+# Marker of the end of the items produced by 'prefetch'
+_END = object()
+
+# Number of file headers read at the same time (see 'get_header_executor')
+HEADER_THREADS = 32
+
+_header_executor = None
+_header_lock = Lock()
+
+_workspace = local()
+
 
 def is_string_empty(string: str) -> bool:
     """
@@ -54,3 +84,284 @@ def update_path(filename: str, directory: str, extension: str = '') -> Path:
         The name of the file updated with the given directory and extension
     """
     return Path(directory, Path(update_extension(filename, extension)).name).resolve()
+
+
+def get_partial_path(filename: str) -> Path:
+    """
+    Builds the name under which an output file is written until it's complete.
+
+    The partial file is hidden, lives in the same directory (so renaming it is atomic) and keeps
+    the extension, which some programs use to choose the output format.
+
+    :param filename:
+        The name of the output file
+    :return:
+        The name of the partial file (e.g. '.song.anarky-partial.mp3' for 'song.mp3')
+    """
+    path = Path(filename)
+    return path.with_name('.{}{}{}'.format(path.stem, PARTIAL, path.suffix))
+
+
+def get_workspace() -> Optional[Path]:
+    """
+    Retrieves the scratch directory of the conversion running in the current thread (see
+    'anarky.scratch').
+
+    :return:
+        The scratch directory (None if the outputs are written straight into their destination)
+    """
+    return getattr(_workspace, 'directory', None)
+
+
+def set_workspace(directory: Optional[Path]):
+    """
+    Sets the scratch directory of the conversion running in the current thread.
+
+    :param directory:
+        The scratch directory (None to write the outputs straight into their destination)
+    """
+    _workspace.directory = directory
+
+
+def stage_output(filename: str) -> Path:
+    """
+    Builds the name under which an output file is written until it's complete.
+
+    The output file is written into the scratch directory of the current thread (if there's one
+    and the output file isn't already inside it) or under its partial name otherwise.
+
+    :param filename:
+        The name of the output file
+    :return:
+        The name of the staged file
+    """
+    workspace = get_workspace()
+    if workspace is None or Path(workspace) in Path(filename).resolve().parents:
+        return get_partial_path(filename)
+
+    # Each output gets its own directory, since several outputs may share the same name
+    return Path(mkdtemp(dir=str(workspace)), Path(filename).name)
+
+
+def commit_output(staged: Path, filename: str):
+    """
+    Moves a complete output file from its staged name to its final name.
+
+    A partial file is simply renamed. A file in the scratch directory is copied (in a single
+    sequential write) under the partial name and then renamed, so the destination never holds a
+    half-written output either.
+
+    :param staged:
+        The name of the staged file (see 'stage_output')
+    :param filename:
+        The name of the output file
+    """
+    partial = get_partial_path(filename)
+    if Path(staged) != partial:
+        try:
+            copyfile(str(staged), str(partial))
+        except BaseException:
+            discard_output(partial)
+            raise
+        finally:
+            discard_output(staged)
+
+    replace(str(partial), str(filename))
+
+
+def discard_output(staged: Path):
+    """
+    Removes an output file that won't be completed.
+
+    :param staged:
+        The name of the staged file (see 'stage_output')
+    """
+    if Path(staged).is_file():
+        Path(staged).unlink()
+
+
+@contextmanager
+def atomic_output(filename: str) -> Iterator[Path]:
+    """
+    Writes an output file under a staged name (see 'stage_output'), which is moved to the final
+    name once the context exits normally. If anything goes wrong (including an interruption), the
+    staged file is removed, so a half-written output is never left under the final name::
+
+        with atomic_output(output_filename) as partial:
+            run_process(['flac', '-o', partial, filename])
+
+    :param filename:
+        The name of the output file
+    :return:
+        The name of the staged file
+    """
+    staged = stage_output(filename)
+    try:
+        yield staged
+    except BaseException:
+        discard_output(staged)
+        raise
+
+    commit_output(staged, filename)
+
+
+def matches(path: str, patterns: Iterable[str]) -> bool:
+    """
+    Checks if a path matches any of the given glob patterns.
+    The patterns are checked against both the full path and the name of the file.
+
+    :param path:
+        The path
+    :param patterns:
+        The glob patterns (e.g. '*.flac' or 'live/*')
+    :return:
+        True if the path matches at least one of the patterns; False otherwise
+    """
+    name = Path(path).name
+    return any(fnmatch(path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk_files(directory: str, extensions: Iterable[str] = (), include: Iterable[str] = (),
+               exclude: Iterable[str] = ()) -> Iterator[str]:
+    """
+    Lazily walks a directory tree, yielding the files as they are found.
+    The patterns are matched against the paths relative to the given directory.
+
+    :param directory:
+        The root of the directory tree
+    :param extensions:
+        The accepted file extensions, in any case (all files are accepted if empty)
+    :param include:
+        The glob patterns that files must match (all files are accepted if empty)
+    :param exclude:
+        The glob patterns of the files and directories that are skipped
+    :return:
+        The paths of the files in the directory tree
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    include = tuple(include)
+    exclude = tuple(exclude)
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with scandir(current) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        directories = []
+        for entry in entries:
+            path = join(current, entry.name)
+            relative = relpath(path, directory)
+            if exclude and matches(relative, exclude):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(path)
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if extensions and not entry.name.lower().endswith(extensions):
+                continue
+            if PARTIAL in entry.name:
+                continue
+            if include and not matches(relative, include):
+                continue
+            yield path
+
+        # Subdirectories are visited in alphabetical order, after the files of their parent (like
+        # os.walk, symbolic links to directories are not followed)
+        pending.extend(reversed(directories))
+
+
+def get_outputs(output) -> List[str]:
+    """
+    Lists the output files returned by a conversion function: the name of a single output file, or
+    a sequence of them (e.g. one per target of a fan-out conversion) whose first one is the one
+    reported in the results.
+
+    :param output:
+        The value returned by the conversion function
+    :return:
+        The names of the output files (empty if there's none)
+    """
+    if output is None:
+        return []
+    if isinstance(output, (list, tuple)):
+        return [str(name) for name in output]
+    return [str(output)]
+
+
+def get_header_executor() -> ThreadPoolExecutor:
+    """
+    Retrieves the pool of threads that read the headers of the input files, creating it on first
+    use.
+
+    Reading a header takes a few bytes, so the time is spent waiting for the file system and
+    several headers are read at the same time. The pool is shared by every reader (e.g. the
+    detection of the file types and the planning of a batch), so they don't each start their own
+    threads.
+
+    :return:
+        The pool of threads
+    """
+    global _header_executor
+    with _header_lock:
+        if _header_executor is None:
+            _header_executor = ThreadPoolExecutor(max_workers=HEADER_THREADS,
+                                                  thread_name_prefix='anarky-header')
+        return _header_executor
+
+
+def prefetch(iterable: Iterable, size: int = PREFETCH_SIZE) -> Iterator:
+    """
+    Consumes an iterable in a background thread, so its next items are produced while the previous
+    ones are being used (e.g. a directory tree is walked while its first files are converted).
+
+    At most 'size' items are held until they're used. An error raised by the iterable is raised
+    again once the items produced before it were used; if the consumer stops early, so does the
+    background thread.
+
+    :param iterable:
+        The iterable
+    :param size:
+        The maximum number of items produced ahead of the consumer
+    :return:
+        The items of the iterable, in the same order
+    """
+    items = Queue(maxsize=max(1, size))
+    stop = Event()
+
+    def put(item, error: Exception = None) -> bool:
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_END, e)
+            return
+        put(_END)
+
+    Thread(target=produce, name='anarky-prefetch', daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
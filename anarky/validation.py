@@ -7,12 +7,16 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
-from subprocess import call, CalledProcessError, check_output, PIPE, Popen
-from re import match
-import sys
+from typing import Iterable, Iterator, Optional, Tuple
 
-from anarky.enum.program import Program
-from anarky.utils import ENCODING
+from anarky.enum.audio_file import AudioFile
+from anarky.metadata import get_id3_size, ID3_SIGNATURE
+from anarky.programs import find_program
+from anarky.stats import stage
+from anarky.utils import get_header_executor
+
+# Number of bytes read from the beginning of a file to detect its type
+HEADER_SIZE = 64
 
 
 def is_program_available(program: str) -> bool:
@@ -24,51 +28,110 @@ def is_program_available(program: str) -> bool:
     :return:
         True if the program is present in the operating system; False otherwise
     """
-    # The output of the following command should be something like:
-    # flac: /usr/bin/flac /usr/share/man/man1/flac.1.gz
-    output = Popen([Program.WHEREIS.value, program], stdout=PIPE).communicate()[0]
-    return len(output.split()) > 1
+    return find_program(program) is not None
+
+
+def is_mpeg_frame(header: bytes) -> bool:
+    """
+    Checks if the given bytes start with a valid MPEG audio frame header.
+
+    :param header:
+        The first bytes of the frame
+    :return:
+        True if the bytes match an MPEG audio frame header; False otherwise
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return False
+
+    version = (header[1] >> 3) & 0x03
+    layer = (header[1] >> 1) & 0x03
+    bitrate = header[2] >> 4
+    sample_rate = (header[2] >> 2) & 0x03
+    return version != 0x01 and layer != 0x00 and bitrate != 0x0F and sample_rate != 0x03
+
+
+def detect_file_type(filename: str) -> Optional[AudioFile]:
+    """
+    Detects the type of an audio file from the first bytes of its contents.
+
+    The following signatures are recognized:
+      * 'RIFF' followed by 'WAVE' => WAV
+      * 'fLaC' => FLAC
+      * An MPEG audio frame header => MP3
+
+    Any of the above may be preceded by an ID3v2 tag, which is skipped.
+
+    :param filename:
+        The input audio file name
+    :return:
+        The type of the audio file (None if the type isn't recognized or the file can't be read)
+    """
+    try:
+        with stage('validation', filename, audio=False), open(filename, 'rb') as handle:
+            header = handle.read(HEADER_SIZE)
+            if header[:3] == ID3_SIGNATURE and len(header) >= 10:
+                handle.seek(get_id3_size(header))
+                header = handle.read(HEADER_SIZE)
+    except (OSError, TypeError):
+        return None
+
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return AudioFile.WAV
+    if header[:4] == b'fLaC':
+        return AudioFile.FLAC
+    if is_mpeg_frame(header):
+        return AudioFile.MP3
+
+    return None
+
+
+def detect_file_types(filenames: Iterable[str]) -> Iterator[Tuple[str, AudioFile]]:
+    """
+    Detects the type of several audio files at once.
+
+    Each detection only reads a few bytes, so several files are read at the same time by the
+    shared pool of header readers (see 'get_header_executor').
+
+    :param filenames:
+        The input audio file names
+    :return:
+        The name and type of each file (None if the type isn't recognized), in the given order
+    """
+    filenames = list(filenames)
+    yield from zip(filenames, get_header_executor().map(detect_file_type, filenames))
 
 
 def is_flac_file(filename: str) -> bool:
     """
     Checks if the given file is a valid FLAC audio file.
 
-    The 'metaflac' program is executed with the following arguments:
-      * --show-md5sum => Show the MD5 signature from the STREAMINFO block
-
     :param filename:
         The input audio file name
     :return:
         True if the input file is a FLAC audio file; False otherwise
     """
-    output = ''
-    try:
-        output = check_output([Program.METAFLAC.value, '--show-md5sum', filename]).decode(ENCODING)
-    except CalledProcessError as e:
-        if e.returncode == 1:
-            return False
+    return detect_file_type(filename) is AudioFile.FLAC
 
-    return match(r'[a-z0-9]+', output)
+
+def is_mp3_file(filename: str) -> bool:
+    """
+    Checks if the given file is a valid MP3 audio file.
+
+    :param filename:
+        The input audio file name
+    :return:
+        True if the input file is a MP3 audio file; False otherwise
+    """
+    return detect_file_type(filename) is AudioFile.MP3
 
 
 def is_wav_file(filename: str) -> bool:
     """
     Checks if the given file is a valid WAV audio file.
 
-    The 'file' program is executed with the following arguments:
-      * --mime-type => Output the MIME type
-
     :param filename:
         The input audio file name
     :return:
         True if the input file is a WAV audio file; False otherwise
     """
-    output = ''
-    try:
-        output = check_output([Program.FILE.value, '--mime-type', filename]).decode(ENCODING)
-    except CalledProcessError as e:
-        if e.returncode == 1:
-            return False
-
-    return 'audio/x-wav' in output
+    return detect_file_type(filename) is AudioFile.WAV
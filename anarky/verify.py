@@ -0,0 +1,259 @@
+# -*- coding: utf8 -*-
+
+"""
+Bulk integrity verification of FLAC audio files.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from json import dump, load
+from os import replace, stat_result
+from pathlib import Path
+from threading import Lock
+from time import monotonic, time
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from anarky.enum.program import Program
+from anarky.metadata import read_flac_metadata
+from anarky.process import ProcessError, run_process
+from anarky.programs import get_cache_directory, get_program
+from anarky.scheduler import Result, Scheduler
+
+INDEX_FILE = 'verification.json'
+VERSION = 1
+
+# The index is saved during a sweep once this many files were tested or this many seconds passed
+# since it was last saved, so a killed sweep only has to test those files again
+CHECKPOINT_FILES = 100
+CHECKPOINT_SECONDS = 60.0
+
+# Arguments of the 'flac' program used to test a FLAC audio file
+TEST_ARGUMENTS = ['-ts']
+
+
+def flac_test_command(filename: str) -> List[str]:
+    """
+    Builds the command that tests a FLAC audio file.
+
+    The 'flac' program is executed with the following arguments:
+      * -t => Test (decodes the whole file and compares the audio with the MD5 signature in the
+              STREAMINFO block)
+      * -s => Silent mode
+
+    :param filename:
+        The input audio file name
+    :return:
+        The program and its arguments
+    """
+    return [get_program(Program.FLAC)] + TEST_ARGUMENTS + [filename]
+
+
+class VerificationIndex:
+    """
+    Index of the FLAC audio files verified so far, stored in the Anarky cache directory.
+
+    Each file is recorded with its size and modification time, along with the outcome of its last
+    verification. The outcome stays valid while the size and modification time of the file are
+    unchanged, so a periodic sweep only tests the new and changed files.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path:
+            The file where the index is stored (defaults to the Anarky cache directory)
+        """
+        self.path = Path(path) if path else get_cache_directory() / INDEX_FILE
+        self.entries = {}
+        self._lock = Lock()
+        self._changed = False
+        self._updates = 0
+        self._saved = monotonic()
+
+        try:
+            with open(self.path, 'r') as index_file:
+                content = load(index_file)
+            if content.get('version') == VERSION:
+                self.entries = content.get('files', {})
+        except (OSError, ValueError):
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return str(Path(filename).resolve())
+
+    def get(self, filename: str) -> Optional[dict]:
+        """
+        Retrieves the outcome of the last verification of a file, if it's still valid.
+
+        :param filename:
+            The input audio file name
+        :return:
+            The entry of the file (with the 'error' found, None if the file is intact), or None if
+            the file was never verified or changed since then
+        """
+        try:
+            status = Path(filename).stat()
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self.entries.get(self._key(filename))
+        if entry is None or (entry['size'], entry['mtime']) != (status.st_size, status.st_mtime_ns):
+            return None
+
+        return entry
+
+    def update(self, filename: str, error: str = None, status: stat_result = None):
+        """
+        Records the outcome of the verification of a file.
+
+        :param filename:
+            The input audio file name
+        :param error:
+            The error found in the file (None if the file is intact)
+        :param status:
+            The status of the file taken before it was tested (by default, it's taken now), so a
+            file rewritten while it was tested is tested again by the next sweep
+        """
+        status = status or Path(filename).stat()
+        entry = {
+            'size': status.st_size,
+            'mtime': status.st_mtime_ns,
+            'error': error,
+            'verified': time()
+        }
+        with self._lock:
+            self.entries[self._key(filename)] = entry
+            self._changed = True
+            self._updates += 1
+
+    def checkpoint(self):
+        """
+        Writes the index to disk if enough files were recorded or enough time passed since it was
+        last written (see CHECKPOINT_FILES and CHECKPOINT_SECONDS).
+        """
+        with self._lock:
+            due = self._updates >= CHECKPOINT_FILES or \
+                monotonic() - self._saved >= CHECKPOINT_SECONDS
+        if due:
+            self.save()
+
+    def save(self):
+        """
+        Writes the index to disk, if anything changed.
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                temporary = self.path.with_name(self.path.name + '.tmp')
+                with open(temporary, 'w') as index_file:
+                    dump({'version': VERSION, 'files': self.entries}, index_file)
+                replace(str(temporary), str(self.path))
+            except OSError:
+                # The index is an optimization: the next sweep tests the files again
+                return
+            self._changed = False
+            self._updates = 0
+            self._saved = monotonic()
+
+
+def verify_flac(filename: str, command: Callable[[str], List[str]] = flac_test_command):
+    """
+    Verifies the integrity of a FLAC audio file.
+
+    The metadata blocks are parsed natively first, so a file with a damaged header is reported
+    without starting the decoder. The audio is then decoded by the given command, which compares
+    it with the MD5 signature in the STREAMINFO block.
+
+    :param filename:
+        The input audio file name
+    :param command:
+        The function that builds the command which tests the file
+    :raise ValueError:
+        If the metadata blocks are damaged
+    :raise ProcessError:
+        If the decoder reports an error
+    """
+    read_flac_metadata(filename, pictures=False)
+    run_process(command(filename))
+
+
+class Verifier:
+    """
+    Verifies the integrity of batches of FLAC audio files on a bounded pool of workers.
+
+    The files whose size and modification time didn't change since their last verification are
+    skipped (and reported with the outcome of that verification as soon as they're listed). Only
+    the errors reported by the decoder (or found in the metadata blocks) are recorded in the index;
+    a file that couldn't be tested (e.g. because it can't be read) is tested again by the next
+    sweep. The index is saved periodically during the sweep and once it ends.
+
+    Example::
+
+        verifier = Verifier(jobs=8)
+        for result in verifier.verify(walk_files('/srv/flac', ['.flac'])):
+            if result.failed:
+                print(result.filename, result.error)
+    """
+
+    def __init__(self, index: VerificationIndex = None, jobs: int = None, force: bool = False,
+                 command: Callable[[str], List[str]] = flac_test_command):
+        """
+        :param index:
+            The index of the files verified so far (defaults to the one in the cache directory)
+        :param jobs:
+            The maximum number of files tested at the same time (defaults to the processor count)
+        :param force:
+            Flag that indicates if every file is tested, even if its last verification is valid
+        :param command:
+            The function that builds the command which tests a file
+        """
+        self.index = index if index is not None else VerificationIndex()
+        self.jobs = jobs
+        self.force = force
+        self.command = command
+
+    def _test(self, filename: str, destination: str = None) -> str:
+        status = Path(filename).stat()
+        try:
+            verify_flac(filename, self.command)
+        except (ProcessError, ValueError) as e:
+            self.index.update(filename, '{}: {}'.format(type(e).__name__, e), status)
+            raise
+
+        self.index.update(filename, status=status)
+        return filename
+
+    def _known(self, filename: str) -> Optional[Result]:
+        entry = None if self.force else self.index.get(filename)
+        if entry is None:
+            return None
+        return Result(filename, filename, entry['error'], skipped=True)
+
+    def verify(self, files: Iterable[str]) -> Iterator[Result]:
+        """
+        Verifies a batch of FLAC audio files.
+
+        :param files:
+            The input audio file names
+        :return:
+            The outcome of each verification (skipped if it comes from the index), as soon as it's
+            known
+        """
+        try:
+            with Scheduler(self.jobs) as scheduler:
+                for result in scheduler.run(self._test, files, None, known=self._known):
+                    if not result.skipped:
+                        self.index.checkpoint()
+                    yield result
+        finally:
+            self.index.save()
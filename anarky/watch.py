@@ -0,0 +1,449 @@
+# -*- coding: utf8 -*-
+
+"""
+Continuous conversion of the audio files dropped into a set of directories.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from ctypes import CDLL, c_char_p, c_int, c_uint32, get_errno
+from ctypes.util import find_library
+from os import close, fsencode, fsdecode, read, stat, strerror
+from os.path import join
+from pathlib import Path
+from select import select
+from struct import calcsize, unpack_from
+from threading import Event
+from time import monotonic, sleep
+from typing import Callable, Iterable, List, Optional, Tuple
+import logging
+import sys
+
+from anarky.api import Converter
+from anarky.scheduler import Result
+from anarky.utils import PARTIAL, walk_files
+
+# Events of the inotify API (see 'man 7 inotify')
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT = 'iIII'
+EVENT_SIZE = calcsize(EVENT)
+BUFFER_SIZE = 64 * 1024
+
+# Seconds a file must stay unchanged before it's converted
+SETTLE = 2.0
+
+# Seconds between the scans of the polling monitor
+INTERVAL = 2.0
+
+# Longest wait for file system events, so finished conversions are reported promptly
+TICK = 0.25
+
+ERROR_WATCH = "Directory '{}' can't be watched: {}"
+WARNING_POLLING = 'The inotify API is not available ({}), polling every {} s instead'
+
+_logger = logging.getLogger(__name__)
+
+
+def get_signature(filename: str) -> Optional[Tuple[int, int]]:
+    """
+    Retrieves the size and modification time of a file, which change while it's being written.
+
+    :param filename:
+        The name of the file
+    :return:
+        The size and modification time (in nanoseconds) of the file, or None if it doesn't exist
+    """
+    try:
+        status = stat(filename)
+    except OSError:
+        return None
+
+    return status.st_size, status.st_mtime_ns
+
+
+class Inotify:
+    """
+    Monitor of a set of directory trees based on the inotify API of Linux, called through ctypes.
+
+    Every subdirectory gets its own watch, including the ones created after the monitor started
+    (whose files are picked up by a scan, since they may be written before the watch exists).
+    """
+
+    def __init__(self, directories: Iterable[str], extensions: Iterable[str] = ()):
+        """
+        :param directories:
+            The roots of the directory trees
+        :param extensions:
+            The extensions of the files that are reported (all files are reported if empty)
+        :raise OSError:
+            If the inotify API isn't available or a directory can't be watched
+        """
+        self.roots = [str(directory) for directory in directories]
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self._directories = {}
+        self._found = []
+
+        if not sys.platform.startswith('linux'):
+            raise OSError('not supported on {}'.format(sys.platform))
+        try:
+            self._libc = CDLL(find_library('c'), use_errno=True)
+            self._libc.inotify_init1.argtypes = [c_int]
+            self._libc.inotify_add_watch.argtypes = [c_int, c_char_p, c_uint32]
+        except (OSError, AttributeError) as e:
+            raise OSError(str(e))
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno))
+
+        try:
+            for directory in self.roots:
+                self._watch_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _add_watch(self, directory: str):
+        descriptor = self._libc.inotify_add_watch(self._fd, fsencode(directory), WATCH_MASK)
+        if descriptor < 0:
+            errno = get_errno()
+            raise OSError(errno, strerror(errno), directory)
+        self._directories[descriptor] = directory
+
+    def _watch_tree(self, root: str):
+        # The subdirectories are watched before they're scanned, so no file is missed in between
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            self._add_watch(directory)
+            try:
+                pending.extend(str(path) for path in Path(directory).iterdir()
+                               if path.is_dir() and not path.is_symlink())
+            except OSError:
+                continue
+
+        self._found.extend(walk_files(root, self.extensions))
+
+    def _accepts(self, name: str) -> bool:
+        return PARTIAL not in name and \
+            (not self.extensions or name.lower().endswith(self.extensions))
+
+    def changes(self, timeout: float) -> List[str]:
+        """
+        Waits for files to be created or written.
+
+        :param timeout:
+            The longest wait, in seconds
+        :return:
+            The names of the files that changed
+        """
+        if not self._found:
+            select([self._fd], [], [], timeout)
+
+        changed = []
+        while True:
+            try:
+                content = read(self._fd, BUFFER_SIZE)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(content):
+                descriptor, mask, _, length = unpack_from(EVENT, content, offset)
+                name = fsdecode(content[offset + EVENT_SIZE:offset + EVENT_SIZE + length]
+                                .rstrip(b'\0'))
+                offset += EVENT_SIZE + length
+
+                directory = self._directories.get(descriptor)
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, so every tree is scanned again
+                    for root in self.roots:
+                        changed.extend(walk_files(root, self.extensions))
+                elif mask & IN_IGNORED:
+                    self._directories.pop(descriptor, None)
+                elif directory is None:
+                    continue
+                elif mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self._watch_tree(join(directory, name))
+                        except OSError as e:
+                            _logger.warning(ERROR_WATCH.format(join(directory, name), e))
+                elif self._accepts(name):
+                    changed.append(join(directory, name))
+
+        changed.extend(self._found)
+        self._found = []
+        return changed
+
+    def close(self):
+        """
+        Releases the inotify instance and every watch.
+        """
+        if self._fd >= 0:
+            close(self._fd)
+            self._fd = -1
+
+
+class Poller:
+    """
+    Monitor of a set of directory trees that scans them periodically, for the file systems (and
+    operating systems) without inotify.
+    """
+
+    def __init__(self, directories: Iterable[str], extensions: Iterable[str] = (),
+                 interval: float = INTERVAL):
+        """
+        :param directories:
+            The roots of the directory trees
+        :param extensions:
+            The extensions of the files that are reported (all files are reported if empty)
+        :param interval:
+            The time between scans, in seconds
+        """
+        self.directories = [str(directory) for directory in directories]
+        self.extensions = tuple(extensions)
+        self.interval = interval
+        self._signatures = {}
+        self._next = monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def changes(self, timeout: float) -> List[str]:
+        """
+        Waits for the next scan and reports the files that are new or changed since the previous
+        one.
+
+        :param timeout:
+            The longest wait, in seconds
+        :return:
+            The names of the files that changed
+        """
+        remaining = self._next - monotonic()
+        if remaining > timeout:
+            sleep(timeout)
+            return []
+        if remaining > 0:
+            sleep(remaining)
+        self._next = monotonic() + self.interval
+
+        signatures = {}
+        for directory in self.directories:
+            for filename in walk_files(directory, self.extensions):
+                signatures[filename] = get_signature(filename)
+
+        changed = [filename for filename, signature in signatures.items()
+                   if signature is not None and self._signatures.get(filename) != signature]
+        self._signatures = signatures
+        return changed
+
+    def close(self):
+        """
+        Stops monitoring the directories.
+        """
+        self._signatures = {}
+
+
+def open_monitor(directories: Iterable[str], extensions: Iterable[str] = (),
+                 interval: float = INTERVAL, polling: bool = False):
+    """
+    Starts monitoring a set of directory trees, with inotify if it's available or by polling
+    otherwise.
+
+    :param directories:
+        The roots of the directory trees
+    :param extensions:
+        The extensions of the files that are reported (all files are reported if empty)
+    :param interval:
+        The time between scans when polling, in seconds
+    :param polling:
+        Flag that indicates if the directories are polled even if inotify is available
+    :return:
+        The monitor of the directories
+    """
+    directories = [str(directory) for directory in directories]
+    if not polling:
+        try:
+            return Inotify(directories, extensions)
+        except OSError as e:
+            _logger.warning(WARNING_POLLING.format(e, interval))
+
+    return Poller(directories, extensions, interval)
+
+
+class Debouncer:
+    """
+    Holds back the files that are still being written.
+
+    A file is ready once its size and modification time stayed the same for the settle time. A
+    file copied over a network share, for instance, is reported as changed many times while it
+    grows.
+    """
+
+    def __init__(self, settle: float = SETTLE, clock: Callable[[], float] = monotonic):
+        """
+        :param settle:
+            The time a file must stay unchanged, in seconds
+        :param clock:
+            The function that retrieves the current time, in seconds
+        """
+        self.settle = settle
+        self.clock = clock
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def touch(self, filename: str):
+        """
+        Records a change in a file, which restarts its settle time.
+
+        :param filename:
+            The name of the file
+        """
+        self.pending[filename] = (get_signature(filename), self.clock())
+
+    def ready(self) -> List[str]:
+        """
+        Retrieves (and forgets) the files that stayed unchanged for the settle time.
+
+        :return:
+            The names of the files that are ready to be converted
+        """
+        now = self.clock()
+        ready = []
+        for filename, (signature, since) in list(self.pending.items()):
+            current = get_signature(filename)
+            if current is None:
+                del self.pending[filename]
+            elif current != signature:
+                self.pending[filename] = (current, now)
+            elif now - since >= self.settle:
+                del self.pending[filename]
+                ready.append(filename)
+
+        return ready
+
+
+class Watcher:
+    """
+    Converts the audio files dropped into a set of directories as soon as they're complete.
+
+    The converter (and its pool of workers) is created once and kept warm for as long as the
+    watcher runs. Every conversion is recorded in the manifest of the output directory, which is
+    saved after each conversion, so the files that are already converted are skipped when the
+    watcher is restarted.
+    """
+
+    def __init__(self, converter: Converter, directories: Iterable[str], settle: float = SETTLE,
+                 interval: float = INTERVAL, polling: bool = False,
+                 callback: Callable[[Result], None] = None):
+        """
+        :param converter:
+            The converter (incremental, so a restarted watcher skips the converted files)
+        :param directories:
+            The directories where the input audio files are dropped
+        :param settle:
+            The time a file must stay unchanged before it's converted, in seconds
+        :param interval:
+            The time between scans when polling, in seconds
+        :param polling:
+            Flag that indicates if the directories are polled even if inotify is available
+        :param callback:
+            The function called with the outcome of each conversion
+        """
+        self.converter = converter
+        self.callback = callback
+        self.debouncer = Debouncer(settle)
+        self.running = {}
+        self._destination = Path(converter.destination).resolve()
+        self._monitor = open_monitor(directories, [converter.conversion.extension], interval,
+                                     polling)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _is_output(self, filename: str) -> bool:
+        # The output directory may be inside a watched directory
+        path = Path(filename).resolve()
+        return path == self._destination or self._destination in path.parents
+
+    def step(self, timeout: float = TICK) -> List[Result]:
+        """
+        Waits for changes in the directories, starts the conversion of the files that are ready
+        and collects the outcome of the conversions that finished.
+
+        :param timeout:
+            The longest wait for changes, in seconds
+        :return:
+            The outcome of the conversions that finished
+        """
+        for filename in self._monitor.changes(timeout):
+            if not self._is_output(filename):
+                self.debouncer.touch(filename)
+
+        for filename in self.debouncer.ready():
+            if filename in self.running:
+                # Changed again while it's being converted, so it's converted once more afterwards
+                self.debouncer.touch(filename)
+                continue
+            self.running[filename] = self.converter.start(filename)
+
+        results = []
+        for filename, future in list(self.running.items()):
+            if future.done():
+                del self.running[filename]
+                results.append(future.result())
+        if results:
+            self.converter.save()
+            if self.callback is not None:
+                for result in results:
+                    self.callback(result)
+
+        return results
+
+    def run(self, stop: Event = None):
+        """
+        Converts the files dropped into the directories until it's stopped.
+
+        :param stop:
+            The event that stops the watcher (it runs forever if not given)
+        """
+        stop = stop or Event()
+        while not stop.is_set():
+            self.step()
+
+    def close(self):
+        """
+        Stops monitoring the directories and waits for the running conversions.
+        """
+        self._monitor.close()
+        self.converter.close()
+        if self.callback is not None:
+            for future in self.running.values():
+                self.callback(future.result())
+        self.running = {}
@@ -0,0 +1,8 @@
+# -*- coding: utf8 -*-
+
+"""
+Benchmarks for the encoding and decoding operations (run with 'python -m benchmarks').
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
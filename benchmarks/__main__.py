@@ -0,0 +1,97 @@
+# -*- coding: utf8 -*-
+
+"""
+Runs the benchmarks of the conversion paths.
+
+Usage: python -m benchmarks [-h] [--count N] [--duration SECONDS] ...
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import sys
+
+from anarky.api import CONVERSIONS
+from anarky.profile import DEFAULT_PROFILE, PROFILES
+from anarky.programs import get_cache_directory
+from anarky.scheduler import default_jobs
+
+from benchmarks.harness import available_paths, compare, format_table, load_baseline, \
+    prepare_inputs, run_benchmarks, save_baseline
+from benchmarks.signals import create_fixtures
+from benchmarks.startup import check_startup, format_startup, run_startup, STARTUP_BUDGET, \
+    startup_commands
+
+BASELINE = str(Path(__file__).with_name('baseline.json'))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Times the conversion paths over synthetic audio')
+    parser.add_argument('--paths', nargs='+', choices=sorted(CONVERSIONS),
+                        default=sorted(CONVERSIONS), help='conversion paths to time')
+    parser.add_argument('--count', type=int, default=8, help='number of files (default: 8)')
+    parser.add_argument('--duration', type=float, default=30.0,
+                        help='duration of each file in seconds (default: 30)')
+    parser.add_argument('--channels', type=int, default=2, help='number of channels (default: 2)')
+    parser.add_argument('--sample-rate', type=int, default=44100,
+                        help='samples per second (default: 44100)')
+    parser.add_argument('--bits', type=int, choices=(16, 24), default=16,
+                        help='bits per sample (default: 16)')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default=DEFAULT_PROFILE.name,
+                        help='encoder profile (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs(),
+                        help='files converted in parallel (default: %(default)s)')
+    parser.add_argument('--fixtures', default=str(get_cache_directory() / 'benchmarks'),
+                        help='directory where the fixtures are kept (default: %(default)s)')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='throughput loss tolerated before failing (default: 0.1)')
+    parser.add_argument('--startup', action='store_true',
+                        help='time the start up of the programs instead of the conversion paths')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET,
+                        help='seconds each program may take to start up (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.startup:
+        with TemporaryDirectory() as directory:
+            measurements = run_startup(startup_commands(directory))
+        print(format_startup(measurements))
+        problems = check_startup(measurements, args.startup_budget)
+        for problem in problems:
+            print('Over budget: ' + problem)
+        return 1 if problems else 0
+
+    paths = available_paths(args.paths)
+    skipped = sorted(set(args.paths) - set(paths))
+    if skipped:
+        print('Skipping (external programs not available): {}'.format(', '.join(skipped)))
+    if not paths:
+        return 0
+
+    fixtures = create_fixtures(args.fixtures, args.count, args.duration, args.channels,
+                               args.sample_rate, args.bits)
+    inputs = prepare_inputs(fixtures, args.fixtures)
+    measurements = run_benchmarks(paths, inputs, args.jobs, args.profile)
+
+    baseline = load_baseline(args.baseline)
+    print(format_table(measurements, baseline))
+    if args.save_baseline:
+        save_baseline(args.baseline, measurements)
+        return 0
+
+    regressions = compare(measurements, baseline, args.tolerance)
+    for regression in regressions:
+        print('Regression: ' + regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
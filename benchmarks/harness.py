@@ -0,0 +1,250 @@
+# -*- coding: utf8 -*-
+
+"""
+Timing of the conversion paths over synthetic audio fixtures.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from json import dump, load
+from os.path import getsize
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, Iterable, List, NamedTuple
+
+from anarky.api import CONVERSIONS
+from anarky.audio.encode import encode_wav_flac
+from anarky.enum.audio_file import AudioFile
+from anarky.metadata import get_duration
+from anarky.profile import DEFAULT_PROFILE, get_profile, ProfileSelector
+from anarky.programs import get_missing_programs
+from anarky.scheduler import run_jobs
+
+SERIAL = 'serial'
+PARALLEL = 'parallel'
+METRICS = ('files_per_second', 'megabytes_per_second', 'realtime_factor')
+
+
+class Measurement(NamedTuple):
+    """
+    Timing of a conversion path over a set of files.
+    """
+    path: str
+    mode: str
+    jobs: int
+    files: int
+    wall: float
+    bytes_in: int
+    audio_seconds: float
+    profile: str = DEFAULT_PROFILE.name
+
+    @property
+    def key(self) -> str:
+        # The archival profile keeps the plain key, so older baselines remain comparable
+        if self.profile == DEFAULT_PROFILE.name:
+            return '{}/{}'.format(self.path, self.mode)
+        return '{}/{}/{}'.format(self.path, self.mode, self.profile)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.wall
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes_in / self.wall / 1e6
+
+    @property
+    def realtime_factor(self) -> float:
+        return self.audio_seconds / self.wall
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        Retrieves the throughput metrics of the measurement.
+
+        :return:
+            The files per second, megabytes per second and real-time factor
+        """
+        return {metric: getattr(self, metric) for metric in METRICS}
+
+
+def available_paths(paths: Iterable[str]) -> List[str]:
+    """
+    Filters the conversion paths whose external programs are available.
+
+    :param paths:
+        The names of the conversion paths (e.g. 'wav2flac')
+    :return:
+        The names of the conversion paths that can run
+    """
+    return [path for path in paths if not get_missing_programs(CONVERSIONS[path].programs)]
+
+
+def prepare_inputs(fixtures: List[str], directory: str) -> Dict[str, List[str]]:
+    """
+    Prepares the input files of every conversion path from the WAV fixtures.
+
+    :param fixtures:
+        The WAV fixtures
+    :param directory:
+        The directory where the FLAC versions of the fixtures are stored
+    :return:
+        The input files for each input extension
+    """
+    inputs = {AudioFile.WAV.value: fixtures}
+    if not get_missing_programs(CONVERSIONS['wav2flac'].programs):
+        flac_files = []
+        for fixture in fixtures:
+            flac_file = Path(directory, Path(fixture).with_suffix(AudioFile.FLAC.value).name)
+            if not flac_file.is_file():
+                encode_wav_flac(fixture, directory)
+            flac_files.append(str(flac_file))
+        inputs[AudioFile.FLAC.value] = flac_files
+
+    return inputs
+
+
+def measure(path: str, files: List[str], jobs: int,
+            profile: str = DEFAULT_PROFILE.name) -> Measurement:
+    """
+    Times a conversion path over a set of files.
+
+    :param path:
+        The name of the conversion path (e.g. 'wav2flac')
+    :param files:
+        The input files
+    :param jobs:
+        The number of files converted in parallel
+    :param profile:
+        The name of the encoder profile
+    :return:
+        The timing of the conversions
+    :raise RuntimeError:
+        If any conversion fails
+    """
+    with TemporaryDirectory(prefix='anarky-benchmark-') as destination:
+        start = perf_counter()
+        function = CONVERSIONS[path].job(ProfileSelector(get_profile(profile)))
+        results = run_jobs(function, files, destination, jobs)
+        wall = perf_counter() - start
+
+    failures = [result for result in results if result.failed]
+    if failures:
+        raise RuntimeError('{} failed for {}: {}'.format(path, failures[0].filename,
+                                                         failures[0].error))
+
+    return Measurement(path, SERIAL if jobs == 1 else PARALLEL, jobs, len(files), wall,
+                       sum(getsize(filename) for filename in files),
+                       sum(get_duration(filename) for filename in files), profile)
+
+
+def run_benchmarks(paths: Iterable[str], inputs: Dict[str, List[str]], jobs: int,
+                   profile: str = DEFAULT_PROFILE.name) -> List[Measurement]:
+    """
+    Times each conversion path serially and in parallel.
+
+    :param paths:
+        The names of the conversion paths
+    :param inputs:
+        The input files for each input extension
+    :param jobs:
+        The number of files converted in parallel
+    :param profile:
+        The name of the encoder profile
+    :return:
+        The timings of the conversion paths
+    """
+    measurements = []
+    for path in paths:
+        files = inputs.get(CONVERSIONS[path].extension)
+        if not files:
+            continue
+        measurements.append(measure(path, files, 1, profile))
+        if jobs > 1:
+            measurements.append(measure(path, files, jobs, profile))
+
+    return measurements
+
+
+def load_baseline(filename: str) -> Dict[str, Dict[str, float]]:
+    """
+    Loads the stored baseline.
+
+    :param filename:
+        The baseline file name
+    :return:
+        The metrics of each conversion path and mode (empty if there's no baseline)
+    """
+    try:
+        with open(filename, 'r') as baseline_file:
+            return load(baseline_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_baseline(filename: str, measurements: List[Measurement]):
+    """
+    Stores the measurements as the new baseline.
+
+    :param filename:
+        The baseline file name
+    :param measurements:
+        The timings of the conversion paths
+    """
+    with open(filename, 'w') as baseline_file:
+        dump({measurement.key: measurement.metrics() for measurement in measurements},
+             baseline_file, indent=4, sort_keys=True)
+
+
+def compare(measurements: List[Measurement], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[str]:
+    """
+    Compares the measurements with the baseline.
+
+    :param measurements:
+        The timings of the conversion paths
+    :param baseline:
+        The metrics of each conversion path and mode
+    :param tolerance:
+        The fraction of throughput that can be lost before it counts as a regression
+    :return:
+        The descriptions of the regressions
+    """
+    regressions = []
+    for measurement in measurements:
+        reference = baseline.get(measurement.key)
+        if not reference:
+            continue
+        for metric, value in measurement.metrics().items():
+            expected = reference.get(metric)
+            if expected and value < expected * (1 - tolerance):
+                regressions.append('{} {}: {:.2f} (baseline {:.2f}, {:+.1%})'.format(
+                    measurement.key, metric, value, expected, value / expected - 1))
+
+    return regressions
+
+
+def format_table(measurements: List[Measurement], baseline: Dict[str, Dict[str, float]]) -> str:
+    """
+    Formats the measurements as a text table.
+
+    :param measurements:
+        The timings of the conversion paths
+    :param baseline:
+        The metrics of each conversion path and mode
+    :return:
+        The text table
+    """
+    lines = ['{:<28} {:>5} {:>6} {:>9} {:>8} {:>8} {:>9} {:>9}'.format(
+        'path', 'jobs', 'files', 'wall (s)', 'files/s', 'MB/s', 'RTF', 'vs base')]
+    for measurement in measurements:
+        reference = baseline.get(measurement.key, {}).get('realtime_factor')
+        change = '{:+.1%}'.format(measurement.realtime_factor / reference - 1) if reference \
+            else '-'
+        lines.append('{:<28} {:>5} {:>6} {:>9.2f} {:>8.2f} {:>8.2f} {:>9.1f} {:>9}'.format(
+            measurement.key, measurement.jobs, measurement.files, measurement.wall,
+            measurement.files_per_second, measurement.megabytes_per_second,
+            measurement.realtime_factor, change))
+
+    return '\n'.join(lines)
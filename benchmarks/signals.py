@@ -0,0 +1,135 @@
+# -*- coding: utf8 -*-
+
+"""
+Deterministic synthetic audio signals used as benchmark fixtures.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from array import array
+from math import pi, sin
+from pathlib import Path
+from random import Random
+from sys import byteorder
+import wave
+
+# Frequencies (in Hz) of the tones mixed in each channel; a bit of noise is added on top so the
+# encoders can't get away with trivially predictable audio
+TONES = (220.0, 330.0, 440.0, 554.37, 659.25)
+NOISE = 0.05
+AMPLITUDE = 0.5
+SEED = 2019
+
+
+def generate_samples(duration: float, channels: int = 2, sample_rate: int = 44100,
+                     bits_per_sample: int = 16, seed: int = SEED) -> bytes:
+    """
+    Generates interleaved PCM samples of a mix of tones and noise.
+
+    The same parameters always generate exactly the same samples.
+
+    :param duration:
+        The duration of the signal in seconds
+    :param channels:
+        The number of channels
+    :param sample_rate:
+        The number of samples per second
+    :param bits_per_sample:
+        The sample size (16 or 24 bits)
+    :param seed:
+        The seed of the noise generator
+    :return:
+        The little-endian PCM samples
+    """
+    if bits_per_sample not in (16, 24):
+        raise ValueError('Only 16 and 24 bits per sample are supported')
+
+    random = Random(seed)
+    peak = (1 << (bits_per_sample - 1)) - 1
+    frames = int(duration * sample_rate)
+    steps = [[2 * pi * TONES[(channel + tone) % len(TONES)] / sample_rate
+              for tone in range(2)] for channel in range(channels)]
+
+    samples = array('h' if bits_per_sample == 16 else 'i')
+    for frame in range(frames):
+        for channel in range(channels):
+            first, second = steps[channel]
+            value = 0.6 * sin(first * frame) + 0.4 * sin(second * frame)
+            value = AMPLITUDE * value + NOISE * (2 * random.random() - 1)
+            samples.append(int(value * peak))
+
+    if byteorder != 'little':
+        samples.byteswap()
+    if bits_per_sample == 16:
+        return samples.tobytes()
+
+    # Each 24-bit sample is stored in 4 bytes, of which only the lowest 3 are kept
+    data = samples.tobytes()
+    return b''.join(data[offset:offset + 3] for offset in range(0, len(data), 4))
+
+
+def write_wav(filename: str, duration: float, channels: int = 2, sample_rate: int = 44100,
+              bits_per_sample: int = 16, seed: int = SEED) -> str:
+    """
+    Writes a synthetic signal to a WAV file (see 'generate_samples').
+
+    :param filename:
+        The output file name
+    :param duration:
+        The duration of the signal in seconds
+    :param channels:
+        The number of channels
+    :param sample_rate:
+        The number of samples per second
+    :param bits_per_sample:
+        The sample size (16 or 24 bits)
+    :param seed:
+        The seed of the noise generator
+    :return:
+        The output file name
+    """
+    with wave.open(str(filename), 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(bits_per_sample // 8)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(generate_samples(duration, channels, sample_rate, bits_per_sample,
+                                              seed))
+
+    return str(filename)
+
+
+def create_fixtures(directory: str, count: int, duration: float, channels: int = 2,
+                    sample_rate: int = 44100, bits_per_sample: int = 16) -> list:
+    """
+    Creates a set of WAV fixtures, each one with a different seed.
+
+    The fixtures are named after their parameters, so existing ones are reused.
+
+    :param directory:
+        The directory where the fixtures are stored
+    :param count:
+        The number of fixtures
+    :param duration:
+        The duration of each fixture in seconds
+    :param channels:
+        The number of channels
+    :param sample_rate:
+        The number of samples per second
+    :param bits_per_sample:
+        The sample size (16 or 24 bits)
+    :return:
+        The file names of the fixtures
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    fixtures = []
+    for index in range(count):
+        name = 'signal-{}s-{}ch-{}hz-{}bit-{:03d}.wav'.format(duration, channels, sample_rate,
+                                                             bits_per_sample, index)
+        filename = Path(directory, name)
+        if not filename.is_file():
+            write_wav(str(filename), duration, channels, sample_rate, bits_per_sample,
+                      SEED + index)
+        fixtures.append(str(filename))
+
+    return fixtures
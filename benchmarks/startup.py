@@ -0,0 +1,170 @@
+# -*- coding: utf8 -*-
+
+"""
+Timing of the start up of the Anarky programs, which dominates when a program is run once per file.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from json import loads
+from os.path import join
+from pathlib import Path
+from subprocess import check_output, DEVNULL
+from typing import Iterable, List, NamedTuple, Sequence, Tuple
+import sys
+
+from anarky.scripts.main import COMMANDS
+
+# Modules only needed by some commands (the event loop, the inotify bindings and the databases),
+# which no program may import as it starts
+HEAVY_MODULES = ('asyncio', 'ctypes', 'sqlite3', 'ssl')
+
+# Time (in seconds) a program may take to import its modules, parse its options and run over a
+# single file, on top of the interpreter itself
+STARTUP_BUDGET = 0.1
+
+# Runs a program in a fresh interpreter and reports how long it took to import, parse its options
+# and run, and which of the heavy modules it imported as it started (the report itself is only
+# imported afterwards)
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+loaded = [module for module in {heavy!r} if module in sys.modules]
+sys.argv = [{module!r}] + {arguments!r}
+try:
+    {module}.run()
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+import json
+print(json.dumps({{'seconds': elapsed, 'import_seconds': imported, 'modules': loaded}}))
+'''
+
+
+class StartupMeasurement(NamedTuple):
+    """
+    Time taken by a program to start up: import its modules, parse its options and run.
+    """
+    module: str
+    seconds: float
+    modules: Tuple[str, ...]
+    import_seconds: float = 0.0
+
+
+def startup_commands(directory: str) -> List[Tuple[str, List[str]]]:
+    """
+    Lists the invocations of the programs that are timed, which run over a single empty input file
+    (so the external programs fail right away) and keep their files in the given directory.
+
+    The watch daemon never stops on its own, so its input directory doesn't exist and only its
+    options are parsed.
+
+    :param directory:
+        The directory where the input, output and index files are kept
+    :return:
+        The module name and command line arguments of each program
+    """
+    flac = join(directory, 'empty.flac')
+    wav = join(directory, 'empty.wav')
+    output = join(directory, 'output')
+    for filename in (flac, wav):
+        Path(filename).touch()
+    Path(output).mkdir(exist_ok=True)
+
+    arguments = {
+        'flac2mp3': ['-f', flac, '-o', output],
+        'flac2many': ['-f', flac, '-o', output, '--targets', 'wav'],
+        'flac2wav': ['-f', flac, '-o', output],
+        'wav2flac': ['-f', wav, '-o', output],
+        'wav2mp3': ['-f', wav, '-o', output],
+        'watch': ['wav2flac', '-d', join(directory, 'missing'), '-o', output],
+        'verify': ['-f', flac, '--index', join(directory, 'verification.json')],
+        'queue': ['status', join(directory, 'queue.db')],
+        'library': ['--index', join(directory, 'library.db'), 'query']
+    }
+    return [('anarky.scripts.main', ['--help'])] + \
+        [('anarky.scripts.' + command, arguments[command]) for command in COMMANDS]
+
+
+def measure_startup(module: str, arguments: Sequence[str] = ('--help',),
+                    repeat: int = 5) -> StartupMeasurement:
+    """
+    Times the start up of a program, each time in a fresh interpreter.
+
+    :param module:
+        The module name (whose 'run' function runs the program)
+    :param arguments:
+        The command line arguments of the program
+    :param repeat:
+        The number of times the program is run (the fastest time is kept)
+    :return:
+        The timing of the start up
+    """
+    probe = PROBE.format(module=module, heavy=HEAVY_MODULES, arguments=list(arguments))
+    reports = [loads(check_output([sys.executable, '-c', probe],
+                                  stderr=DEVNULL).splitlines()[-1])
+               for _ in range(repeat)]
+    return StartupMeasurement(module, min(report['seconds'] for report in reports),
+                              tuple(reports[-1]['modules']),
+                              min(report['import_seconds'] for report in reports))
+
+
+def run_startup(commands: Iterable[Tuple[str, Sequence[str]]],
+                repeat: int = 5) -> List[StartupMeasurement]:
+    """
+    Times the start up of each program.
+
+    :param commands:
+        The module name and command line arguments of each program (see 'startup_commands')
+    :param repeat:
+        The number of times each program is run
+    :return:
+        The timings of the start ups
+    """
+    return [measure_startup(module, arguments, repeat) for module, arguments in commands]
+
+
+def check_startup(measurements: List[StartupMeasurement],
+                  budget: float = STARTUP_BUDGET) -> List[str]:
+    """
+    Checks the timings of the start ups against the budget.
+
+    :param measurements:
+        The timings of the start ups
+    :param budget:
+        The time (in seconds) the start up of each program may take
+    :return:
+        The descriptions of the programs over the budget or that import heavy modules
+    """
+    problems = []
+    for measurement in measurements:
+        if measurement.seconds > budget:
+            problems.append('{}: {:.1f} ms (budget {:.1f} ms)'.format(
+                measurement.module, measurement.seconds * 1000, budget * 1000))
+        if measurement.modules:
+            problems.append('{}: imports {}'.format(measurement.module,
+                                                     ', '.join(measurement.modules)))
+
+    return problems
+
+
+def format_startup(measurements: List[StartupMeasurement]) -> str:
+    """
+    Formats the timings of the start ups as a text table.
+
+    :param measurements:
+        The timings of the start ups
+    :return:
+        The text table
+    """
+    lines = ['{:<28} {:>11} {:>10}  {}'.format('module', 'import (ms)', 'total (ms)',
+                                               'heavy modules')]
+    for measurement in measurements:
+        lines.append('{:<28} {:>11.1f} {:>10.1f}  {}'.format(
+            measurement.module, measurement.import_seconds * 1000, measurement.seconds * 1000,
+            ', '.join(measurement.modules) or '-'))
+
+    return '\n'.join(lines)
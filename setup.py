@@ -11,14 +11,20 @@ from setuptools import setup, find_packages
 
 setup(
     name='anarky',
-    version='0.0.4',
+    version='0.0.5',
     description='Encodes and decodes between several types of audio files.',
     author='Eduardo Ferreira',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     entry_points={
         'console_scripts': ['flac2mp3 = anarky.scripts.flac2mp3:run',
+                            'flac2many = anarky.scripts.flac2many:run',
                             'flac2wav = anarky.scripts.flac2wav:run',
                             'wav2flac = anarky.scripts.wav2flac:run',
-                            'wav2mp3 = anarky.scripts.wav2mp3:run'],
+                            'wav2mp3 = anarky.scripts.wav2mp3:run',
+                            'anarky-watch = anarky.scripts.watch:run',
+                            'anarky-verify = anarky.scripts.verify:run',
+                            'anarky-queue = anarky.scripts.queue:run',
+                            'anarky-library = anarky.scripts.library:run',
+                            'anarky = anarky.scripts.main:run'],
     }
 )
@@ -0,0 +1,111 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the API to run encoding and decoding operations.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import asyncio
+import tempfile
+import unittest
+
+from anarky.api import ConversionError, Converter
+from tests.helpers import install_programs
+
+
+class ApiTests(unittest.TestCase):
+    """
+    Tests for the API to run encoding and decoding operations.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        install_programs(self, self.directory, 'flac')
+
+        self.output = self.directory / 'output'
+        self.output.mkdir()
+        self.files = []
+        for name in ('one.wav', 'two.wav', 'bad.wav'):
+            filename = self.directory / name
+            filename.write_bytes(b'audio')
+            self.files.append(str(filename))
+
+    def test_converter_invalid_conversion(self):
+        with self.assertRaises(ConversionError):
+            Converter('ogg2mp3', str(self.output))
+
+    def test_converter_invalid_destination(self):
+        with self.assertRaises(ConversionError):
+            Converter('wav2flac', str(self.directory / 'missing'))
+
+    def test_converter_missing_programs(self):
+        with self.assertRaises(ConversionError):
+            Converter('wav2mp3', str(self.output))
+
+    def test_convert(self):
+        with Converter('wav2flac', str(self.output), jobs=2) as converter:
+            results = {Path(result.filename).name: result
+                       for result in converter.convert(self.files)}
+            again = converter.convert_all(self.files[:1])
+
+        self.assertEqual(results['one.wav'].output, str(self.output / 'one.flac'))
+        self.assertTrue(results['bad.wav'].failed)
+        self.assertFalse(again[0].failed)
+
+    def test_convert_directory(self):
+        (self.directory / 'notes.txt').write_text('not audio')
+        with Converter('wav2flac', str(self.output)) as converter:
+            results = converter.convert_all([str(self.directory)])
+
+        self.assertEqual(sorted(Path(result.filename).name for result in results),
+                         ['bad.wav', 'one.wav', 'two.wav'])
+
+    def test_convert_plan(self):
+        with Converter('wav2flac', str(self.output)) as converter:
+            results = converter.convert_all(self.files, plan=True)
+        self.assertEqual(sorted(Path(result.filename).name for result in results),
+                         ['bad.wav', 'one.wav', 'two.wav'])
+
+        # The predicted time is compared with the actual time of the conversions
+        report = converter.plan.report()
+        self.assertEqual(report['files'], 3)
+        self.assertGreater(report['actual_wall'], 0)
+        self.assertEqual(len(converter.plan.walls), 3)
+
+    def test_convert_incremental(self):
+        with Converter('wav2flac', str(self.output), incremental=True) as converter:
+            converter.convert_all(self.files[:1])
+            self.assertTrue(converter.convert_all(self.files[:1])[0].skipped)
+
+    def test_convert_profile(self):
+        with Converter('wav2flac', str(self.output), incremental=True) as converter:
+            converter.convert_all(self.files[:1])
+        with Converter('wav2flac', str(self.output), incremental=True,
+                       profile='preview') as converter:
+            self.assertFalse(converter.convert_all(self.files[:1])[0].skipped)
+            self.assertTrue(converter.convert_all(self.files[:1])[0].skipped)
+
+        with self.assertRaises(ConversionError):
+            Converter('wav2flac', str(self.output), profile='lossy')
+
+    def test_convert_async(self):
+        async def convert():
+            async with Converter('wav2flac', str(self.output)) as converter:
+                single = await converter.submit(self.files[0])
+                batch = [result async for result in converter.convert_async(self.files)]
+            return single, batch
+
+        single, batch = asyncio.run(convert())
+        self.assertEqual(single.output, str(self.output / 'one.flac'))
+        self.assertEqual(sorted(Path(result.filename).name for result in batch),
+                         ['bad.wav', 'one.wav', 'two.wav'])
+        self.assertEqual([result.failed for result in batch].count(True), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
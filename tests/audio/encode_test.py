@@ -7,16 +7,87 @@ Author: Eduardo Ferreira
 License: MIT (see LICENSE for details)
 """
 
+from pathlib import Path
+from unittest import mock
+import asyncio
+import os
+import tempfile
 import unittest
 
+from anarky.audio.encode import encode_flac_mp3, encode_flac_mp3_async
+from tests.helpers import flac_metadata, install_programs
+
 
 class EncodeTests(unittest.TestCase):
     """
     Tests for the encoding library.
     """
 
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        install_programs(self, self.directory, 'flac', 'lame')
+
+        self.source = self.directory / 'song.flac'
+        self.source.write_bytes(b'audio')
+        self.output = self.directory / 'output'
+        self.output.mkdir()
+
     def test_dummy(self):
         """
         Dummy test method.
         """
         self.assertEqual(True, True)
+
+    def test_encode_flac_mp3_stream(self):
+        output = encode_flac_mp3(str(self.source), str(self.output))
+        self.assertEqual(output, self.output / 'song.mp3')
+        self.assertEqual(output.read_bytes(), b'audio')
+        self.assertEqual(sorted(path.name for path in self.output.iterdir()), ['song.mp3'])
+
+    def test_encode_flac_mp3_fallback(self):
+        with mock.patch.dict(os.environ, {'FAKE_FLAC_FAIL': '1'}):
+            output = encode_flac_mp3(str(self.source), str(self.output))
+
+        self.assertEqual(output.read_bytes(), b'audio')
+        self.assertEqual(sorted(path.name for path in self.output.iterdir()), ['song.mp3'])
+
+    def test_encode_flac_mp3_without_stream(self):
+        output = encode_flac_mp3(str(self.source), str(self.output), stream=False)
+        self.assertEqual(output.read_bytes(), b'audio')
+        self.assertFalse((self.output / 'song.wav').exists())
+
+    def test_encode_flac_mp3_tags(self):
+        self.source.write_bytes(flac_metadata(['TITLE=Song', 'ARTIST=Band'],
+                                              [(3, '', b'png', 'image/png')]))
+        arguments = self.directory / 'arguments'
+        environment = mock.patch.dict(os.environ, {'FAKE_LAME_ARGUMENTS': str(arguments)})
+        environment.start()
+        self.addCleanup(environment.stop)
+        encode_flac_mp3(str(self.source), str(self.output))
+
+        words = arguments.read_text().split()
+        self.assertEqual(words[words.index('--tt') + 1], 'Song')
+        self.assertEqual(words[words.index('--ta') + 1], 'Band')
+        cover = Path(words[words.index('--ti') + 1])
+        self.assertEqual(cover.read_bytes(), b'png')
+
+        # The next track of the album shares the same cover file
+        encode_flac_mp3(str(self.source), str(self.output), stream=False)
+        self.assertIn(str(cover), arguments.read_text().split())
+
+    def test_encode_flac_mp3_async(self):
+        output = asyncio.run(encode_flac_mp3_async(str(self.source), str(self.output)))
+        self.assertEqual(output.read_bytes(), b'audio')
+
+    def test_encode_flac_mp3_async_fallback(self):
+        with mock.patch.dict(os.environ, {'FAKE_FLAC_FAIL': '1'}):
+            output = asyncio.run(encode_flac_mp3_async(str(self.source), str(self.output)))
+
+        self.assertEqual(output.read_bytes(), b'audio')
+        self.assertEqual(sorted(path.name for path in self.output.iterdir()), ['song.mp3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
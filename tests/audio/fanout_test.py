@@ -0,0 +1,95 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the audio fan-out library.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest import mock
+import os
+import tempfile
+import unittest
+
+from anarky.audio.fanout import fan_out, parse_target, parse_targets, Target
+from anarky.audio.wav import PCM, read_wav_info, WavFormat, WavWriter
+from anarky.enum.audio_file import AudioFile
+from anarky.process import ProcessError
+from anarky.profile import PREVIEW, STANDARD
+from tests.helpers import flac_file, install_programs
+
+
+class FanOutTests(unittest.TestCase):
+    """
+    Tests for the audio fan-out library.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        install_programs(self, self.directory, 'flac', 'lame')
+
+        # The stand-in decoder outputs the contents of the source, so the source is a WAV file
+        self.source = self.directory / 'song.flac'
+        with WavWriter(str(self.source), WavFormat(PCM, 2, 44100, 16)) as writer:
+            writer.write(bytes(range(256)) * 100)
+        self.output = self.directory / 'output'
+        self.output.mkdir()
+
+    def test_parse_target(self):
+        self.assertEqual(parse_target('mp3'), Target(AudioFile.MP3))
+        self.assertEqual(parse_target('MP3:Standard'), Target(AudioFile.MP3, STANDARD))
+        self.assertEqual(parse_target('flac:preview').name, 'flac-preview')
+        for specification in ('ogg', 'mp3:loud'):
+            with self.assertRaises(ValueError):
+                parse_target(specification)
+        with self.assertRaises(ValueError):
+            parse_targets(['mp3:standard', 'flac', 'mp3:standard'])
+
+    def test_target_arguments(self):
+        self.assertEqual(Target(AudioFile.FLAC).arguments(PREVIEW), ['flac', '-f', '-0'])
+        self.assertEqual(Target(AudioFile.FLAC, STANDARD).arguments(PREVIEW),
+                         ['flac-standard', '-f', '-5', '-V'])
+        self.assertEqual(Target(AudioFile.WAV).arguments(), ['wav'])
+
+    def test_fan_out(self):
+        targets = parse_targets(['mp3', 'mp3:standard', 'flac', 'wav'])
+        outputs = fan_out(str(self.source), str(self.output), targets)
+
+        content = self.source.read_bytes()
+        self.assertEqual(outputs, [self.output / 'mp3' / 'song.mp3',
+                                   self.output / 'mp3-standard' / 'song.mp3',
+                                   self.output / 'flac' / 'song.flac',
+                                   self.output / 'wav' / 'song.wav'])
+        for output in outputs:
+            self.assertEqual(output.read_bytes(), content)
+            self.assertEqual(sorted(path.name for path in output.parent.iterdir()), [output.name])
+        self.assertFalse(read_wav_info(str(outputs[-1])).damaged)
+
+    def test_fan_out_target_error(self):
+        targets = parse_targets(['flac', 'mp3'])
+        with mock.patch.dict(os.environ, {'FAKE_LAME_FAIL': '1'}):
+            with self.assertRaises(ProcessError) as context:
+                fan_out(str(self.source), str(self.output), targets)
+
+        self.assertIn('bad settings', str(context.exception))
+        self.assertEqual((self.output / 'flac' / 'song.flac').read_bytes(),
+                         self.source.read_bytes())
+        self.assertEqual(list((self.output / 'mp3').iterdir()), [])
+
+    def test_fan_out_tags(self):
+        flac_file(self.source, ['TITLE=Song', 'ARTIST=Band'], audio=b'')
+        arguments = self.directory / 'arguments'
+        with mock.patch.dict(os.environ, {'FAKE_FLAC_ARGUMENTS': str(arguments)}):
+            fan_out(str(self.source), str(self.output), [Target(AudioFile.FLAC)])
+
+        words = arguments.read_text().split()
+        self.assertIn('--tag=TITLE=Song', words)
+        self.assertIn('--tag=ARTIST=Band', words)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the native reading and writing of WAV audio files.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from io import BytesIO
+from pathlib import Path
+from struct import pack
+from unittest.mock import patch
+import tempfile
+import unittest
+import wave
+
+from anarky.audio.wav import EXTENSIBLE, IEEE_FLOAT, parse_wav, PCM, read_wav_info, \
+    repair_header, WavFormat, WavReader, WavWriter
+
+STEREO = WavFormat(PCM, 2, 44100, 16)
+FRAMES = bytes(range(256)) * 40
+
+
+class WavTests(unittest.TestCase):
+    """
+    Tests for the native reading and writing of WAV audio files.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.filename = str(Path(temporary.name, 'song.wav'))
+
+    def write(self, frames: bytes = FRAMES, wav_format: WavFormat = STEREO):
+        with WavWriter(self.filename, wav_format) as writer:
+            writer.write(frames[:1000])
+            writer.write(frames[1000:])
+
+    def test_writer(self):
+        self.write()
+        with wave.open(self.filename, 'rb') as wav_file:
+            self.assertEqual(wav_file.getnchannels(), 2)
+            self.assertEqual(wav_file.getframerate(), 44100)
+            self.assertEqual(wav_file.getsampwidth(), 2)
+            self.assertEqual(wav_file.readframes(wav_file.getnframes()), FRAMES)
+
+    def test_read_wav_info(self):
+        self.write()
+        info = read_wav_info(self.filename)
+        self.assertEqual(info.format, STEREO)
+        self.assertEqual(info.frames, len(FRAMES) // 4)
+        self.assertAlmostEqual(info.duration, len(FRAMES) / 4 / 44100)
+        self.assertFalse(info.damaged)
+
+    def test_read_extensible_format(self):
+        extensible = pack('<HHIIHHHHIH', EXTENSIBLE, 2, 48000, 384000, 8, 32, 22, 32, 3,
+                          IEEE_FLOAT) + bytes(14)
+        content = b'WAVE' + b'fmt ' + pack('<I', len(extensible)) + extensible + \
+            b'LIST' + pack('<I', 3) + b'abc\x00' + b'data' + pack('<I', 16) + bytes(16)
+        info = parse_wav(b'RIFF' + pack('<I', len(content)) + content)
+        self.assertEqual(info.format, WavFormat(IEEE_FLOAT, 2, 48000, 32))
+        self.assertEqual(info.frames, 2)
+
+    def test_read_invalid(self):
+        Path(self.filename).write_bytes(b'')
+        with self.assertRaises(ValueError):
+            read_wav_info(self.filename)
+        header = b'RIFF' + bytes(4) + b'WAVE'
+        for content in (header, header + b'fmt \x10' + bytes(3), b'ID3\x00'):
+            with self.assertRaises(ValueError):
+                parse_wav(content)
+
+    def test_buffers(self):
+        self.write()
+        with WavReader(self.filename) as reader:
+            buffers = list(reader.iter_buffers(1001))
+            output = BytesIO()
+            written = reader.write_to(output, 4096)
+
+        self.assertTrue(all(len(buffer) == 1000 for buffer in buffers[:-1]))
+        self.assertEqual(b''.join(buffers), FRAMES)
+        self.assertEqual(written, len(FRAMES))
+        self.assertEqual(output.getvalue(), FRAMES)
+
+    def test_reader_map_error(self):
+        # The file is closed when it can't be mapped (e.g. on a file system without mmap)
+        self.write()
+        opened = []
+
+        def record(*args):
+            opened.append(open(*args))
+            return opened[-1]
+
+        with patch('anarky.audio.wav.open', side_effect=record, create=True), \
+                patch('anarky.audio.wav.mmap', side_effect=OSError('mmap failed')):
+            with self.assertRaises(OSError):
+                WavReader(self.filename)
+        self.assertTrue(opened[0].closed)
+
+    def test_repair_header(self):
+        self.write()
+        self.assertFalse(repair_header(self.filename))
+
+        # Truncated in the middle of a frame, as if the encoder was killed
+        content = Path(self.filename).read_bytes()
+        Path(self.filename).write_bytes(content[:-1001])
+        self.assertTrue(read_wav_info(self.filename).damaged)
+        self.assertTrue(repair_header(self.filename))
+
+        info = read_wav_info(self.filename)
+        self.assertFalse(info.damaged)
+        self.assertEqual(info.data_size, len(FRAMES) - 1004)
+        with wave.open(self.filename, 'rb') as wav_file:
+            self.assertEqual(wav_file.getnframes(), info.frames)
+
+    def test_repair_unknown_sizes(self):
+        # Written to a pipe, where the sizes are left at zero
+        self.write()
+        content = bytearray(Path(self.filename).read_bytes())
+        content[4:8] = bytes(4)
+        content[40:44] = bytes(4)
+        Path(self.filename).write_bytes(bytes(content))
+
+        self.assertTrue(repair_header(self.filename))
+        self.assertEqual(read_wav_info(self.filename).data_size, len(FRAMES))
+
+
+if __name__ == '__main__':
+    unittest.main()
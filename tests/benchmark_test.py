@@ -0,0 +1,80 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the benchmark fixtures and harness.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import tempfile
+import unittest
+import wave
+
+from anarky.metadata import get_duration
+from benchmarks.harness import compare, Measurement
+from benchmarks.signals import create_fixtures, generate_samples
+from benchmarks.startup import check_startup, measure_startup, startup_commands, \
+    StartupMeasurement
+
+
+class BenchmarkTests(unittest.TestCase):
+    """
+    Tests for the benchmark fixtures and harness.
+    """
+
+    def test_generate_samples(self):
+        samples = generate_samples(0.1, channels=2, sample_rate=8000)
+        self.assertEqual(len(samples), 800 * 2 * 2)
+        self.assertEqual(samples, generate_samples(0.1, channels=2, sample_rate=8000))
+        self.assertNotEqual(samples, generate_samples(0.1, channels=2, sample_rate=8000, seed=1))
+
+    def test_generate_samples_24_bits(self):
+        self.assertEqual(len(generate_samples(0.1, channels=1, sample_rate=8000,
+                                              bits_per_sample=24)), 800 * 3)
+
+    def test_create_fixtures(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = temporary.name
+        fixtures = create_fixtures(directory, 2, 0.25, channels=1, sample_rate=16000)
+        self.assertEqual(len(fixtures), 2)
+        self.assertNotEqual(Path(fixtures[0]).read_bytes(), Path(fixtures[1]).read_bytes())
+        with wave.open(fixtures[0], 'rb') as wav_file:
+            self.assertEqual(wav_file.getnchannels(), 1)
+            self.assertEqual(wav_file.getframerate(), 16000)
+        self.assertEqual(get_duration(fixtures[0]), 0.25)
+
+    def test_compare(self):
+        measurement = Measurement('wav2flac', 'serial', 1, 10, 2.0, 20 * 10 ** 6, 300.0)
+        baseline = {'wav2flac/serial': {'files_per_second': 5.0, 'megabytes_per_second': 10.0,
+                                        'realtime_factor': 200.0}}
+        regressions = compare([measurement], baseline, 0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('realtime_factor', regressions[0])
+        self.assertEqual(compare([measurement], baseline, 0.3), [])
+        self.assertEqual(compare([measurement], {}, 0.1), [])
+
+    def test_measure_startup(self):
+        # The commands that never run an event loop or open a database don't import them as they
+        # start; the programs are timed until they finish running
+        with tempfile.TemporaryDirectory() as directory:
+            commands = dict(startup_commands(directory))
+            self.assertEqual(len(commands), 10)
+            for module in ('anarky.scripts.main', 'anarky.scripts.flac2mp3'):
+                measurement = measure_startup(module, commands[module], repeat=1)
+                self.assertEqual(measurement.modules, ())
+                self.assertGreater(measurement.seconds, measurement.import_seconds)
+                self.assertGreater(measurement.import_seconds, 0.0)
+
+    def test_check_startup(self):
+        measurements = [StartupMeasurement('anarky.scripts.main', 0.002, ()),
+                        StartupMeasurement('anarky.scripts.watch', 0.3, ('asyncio',))]
+        problems = check_startup(measurements, 0.1)
+        self.assertEqual(len(problems), 2)
+        self.assertTrue(all(problem.startswith('anarky.scripts.watch') for problem in problems))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the distributed conversion of batches through a shared job queue.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from concurrent.futures import Future
+from pathlib import Path
+from threading import Event, Thread
+from unittest import mock
+import tempfile
+import time
+import unittest
+
+from anarky.api import Converter
+from anarky.cluster import DONE, ERROR_LEASE, FAILED, JobQueue, QUEUED, QueueWorker, RUNNING
+from anarky.scheduler import Result
+from tests.helpers import Clock, install_programs
+
+
+class ClusterTests(unittest.TestCase):
+    """
+    Tests for the distributed conversion of batches through a shared job queue.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.path = str(self.directory / 'queue.db')
+        self.clock = Clock()
+        self.files = []
+        for name in ('one.wav', 'two.wav', 'three.wav'):
+            filename = self.directory / name
+            filename.write_bytes(name.encode())
+            self.files.append(str(filename))
+
+    def open_queue(self, lease: float = 10.0, **options) -> JobQueue:
+        job_queue = JobQueue(self.path, lease=lease, clock=self.clock, **options)
+        self.addCleanup(job_queue.close)
+        return job_queue
+
+    def test_queue(self):
+        coordinator = self.open_queue()
+        coordinator.configure(conversion='wav2flac', destination='/srv/flac', profile=None)
+        self.assertEqual(coordinator.add(self.files, batch=2), 3)
+        self.assertEqual(coordinator.add(self.files[:1]), 0)
+
+        worker = self.open_queue()
+        self.assertEqual(worker.settings, {'conversion': 'wav2flac', 'destination': '/srv/flac'})
+        self.assertEqual(worker.claim('a'), self.files[0])
+        self.assertEqual(worker.claim('b'), self.files[1])
+        self.assertTrue(worker.complete(self.files[0], 'a', output='one.flac'))
+        self.assertTrue(worker.complete(self.files[1], 'b', error='ProcessError: crashed'))
+        worker.release(worker.claim('a'), 'a')
+
+        self.assertEqual(coordinator.counts(), {QUEUED: 1, RUNNING: 0, DONE: 1, FAILED: 1})
+        self.assertEqual(coordinator.pending(), 1)
+        self.assertEqual([(result.filename, result.error) for result in coordinator.failures()],
+                         [(self.files[1], 'ProcessError: crashed')])
+
+    def test_lease(self):
+        job_queue = self.open_queue()
+        job_queue.add(self.files[:2])
+        self.assertEqual(job_queue.claim('a'), self.files[0])
+        self.assertEqual(job_queue.claim('b'), self.files[1])
+
+        # Worker 'b' keeps renewing its lease, while worker 'a' crashed
+        self.clock.now = 8.0
+        self.assertEqual(job_queue.renew('b'), 1)
+        self.clock.now = 15.0
+        self.assertEqual(job_queue.claim('c'), self.files[0])
+        self.assertEqual(job_queue.requeued, 1)
+        self.assertEqual(job_queue.renew('a'), 0)
+        self.assertFalse(job_queue.complete(self.files[0], 'a', output='one.flac'))
+        self.assertTrue(job_queue.complete(self.files[1], 'b', output='two.flac'))
+        self.assertEqual(job_queue.counts()[RUNNING], 1)
+
+    def test_lease_attempts(self):
+        job_queue = self.open_queue(attempts=2)
+        job_queue.add(self.files[:1])
+        for worker in ('a', 'b'):
+            self.assertEqual(job_queue.claim(worker), self.files[0])
+            self.clock.now += 20.0
+
+        self.assertIsNone(job_queue.claim('c'))
+        self.assertEqual([result.error for result in job_queue.failures()], [ERROR_LEASE])
+
+    def test_invalid_queue(self):
+        Path(self.path).write_bytes(b'not a database, but long enough to look like one' * 4)
+        with self.assertRaises(ValueError):
+            JobQueue(self.path)
+
+    def wait_renewal(self, job_queue: JobQueue, now: float):
+        # The leases are renewed from the thread of the worker, a few times per lease period
+        for _ in range(100):
+            row = job_queue._connection.execute('SELECT MIN(expires) FROM jobs WHERE state = ?',
+                                                (RUNNING,)).fetchone()
+            if row[0] is not None and row[0] > now:
+                return
+            time.sleep(0.05)
+        self.fail('The leases of the running jobs were not renewed')
+
+    def test_worker_lease(self):
+        job_queue = self.open_queue(lease=0.3)
+        job_queue.add(self.files[:2])
+
+        # The first job finishes at once and the second one runs until the test finishes it
+        futures = []
+
+        def start(filename: str) -> Future:
+            future = Future()
+            future.set_running_or_notify_cancel()
+            if not futures:
+                future.set_result(Result(filename, 'one.flac'))
+            futures.append(future)
+            return future
+
+        # The worker takes its time with the first result and is then interrupted
+        consumed = Event()
+        interrupt = Event()
+
+        def work():
+            with JobQueue(self.path, lease=0.3, clock=self.clock) as queue:
+                results = QueueWorker(mock.Mock(jobs=2, start=start), queue, 'a', 0.01).run()
+                next(results)
+                consumed.set()
+                interrupt.wait(5)
+                results.close()
+
+        worker = Thread(target=work, daemon=True)
+        worker.start()
+        self.assertTrue(consumed.wait(5))
+
+        # The lease is renewed while the results aren't consumed...
+        self.clock.now = 10.0
+        self.wait_renewal(job_queue, 10.0)
+        self.assertIsNone(job_queue.claim('b'))
+
+        # ... and while the running job finishes after the worker is interrupted
+        interrupt.set()
+        self.clock.now = 20.0
+        self.wait_renewal(job_queue, 20.0)
+        self.assertIsNone(job_queue.claim('b'))
+        futures[1].set_result(Result(self.files[1], 'two.flac'))
+        worker.join(5)
+        self.assertEqual(job_queue.counts()[DONE], 2)
+        self.assertEqual(job_queue.requeued, 0)
+
+    def test_workers(self):
+        install_programs(self, self.directory, 'flac')
+
+        output = self.directory / 'output'
+        output.mkdir()
+        with JobQueue(self.path) as job_queue:
+            job_queue.add(self.files)
+
+        # Each worker stands for a host, with its own connection to the queue
+        results = []
+
+        def work(name: str):
+            with JobQueue(self.path) as job_queue, Converter('wav2flac', str(output)) as converter:
+                results.extend(QueueWorker(converter, job_queue, name, poll=0.01).run())
+
+        workers = [Thread(target=work, args=(name,)) for name in ('a', 'b')]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+
+        self.assertEqual(sorted(result.filename for result in results), sorted(self.files))
+        self.assertFalse(any(result.failed for result in results))
+        self.assertEqual((output / 'two.flac').read_bytes(), b'two.wav')
+        with JobQueue(self.path) as job_queue:
+            self.assertEqual(job_queue.counts()[DONE], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
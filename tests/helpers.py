@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+
+"""
+Fixtures shared by the tests: minimal FLAC files, stand-ins for the external programs and a clock
+that only moves when it's told to.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from struct import pack
+from unittest import mock, TestCase
+import os
+import stat
+
+from anarky.programs import reset_programs
+
+# Stand-in for the 'flac' program: it decodes by copying its input to stdout, tests by logging the
+# file and failing the corrupt ones, and encodes or decodes by copying its input (a file or stdin)
+# to the '-o' file, failing the outputs with 'bad' in their name
+FLAC = '''#!/bin/sh
+if [ "$1" = --version ]; then echo "flac 1.4.3"; exit 0; fi
+case "$1" in
+-dcs)
+    if [ -n "$FAKE_FLAC_FAIL" ]; then exit 1; fi
+    cat "$2"; exit 0;;
+-ts)
+    echo "$2" >> "$FAKE_FLAC_LOG"
+    if grep -q corrupt "$2"; then echo "$2: ERROR, MD5 signature mismatch" >&2; exit 1; fi
+    exit 0;;
+esac
+if [ -n "$FAKE_FLAC_ARGUMENTS" ]; then echo "$@" > "$FAKE_FLAC_ARGUMENTS"; fi
+while [ $# -gt 0 ]; do
+    case "$1" in
+    -o) output="$2"; shift;;
+    -) input="-";;
+    -*) ;;
+    *) input="$1";;
+    esac
+    shift
+done
+case "$output" in *bad*) exit 1;; esac
+if [ "$input" = "-" ]; then cat > "$output"; else cp "$input" "$output"; fi
+'''
+
+# Stand-in for the 'lame' program, which copies its input (a file or stdin) to the output file
+LAME = '''#!/bin/sh
+if [ "$1" = --version ]; then echo "LAME 3.100"; exit 0; fi
+if [ -n "$FAKE_LAME_ARGUMENTS" ]; then echo "$@" > "$FAKE_LAME_ARGUMENTS"; fi
+if [ -n "$FAKE_LAME_FAIL" ]; then cat > /dev/null; echo "bad settings" >&2; exit 1; fi
+for last; do :; done
+eval "input=\\${$(($# - 1))}"
+if [ "$input" = "-" ]; then cat > "$last"; else cp "$input" "$last"; fi
+'''
+
+PROGRAMS = {'flac': FLAC, 'lame': LAME}
+
+
+class Clock:
+    """
+    Clock whose time is set by the tests.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def install_programs(test: TestCase, directory: Path, *names: str, **environment: str) -> Path:
+    """
+    Puts the stand-ins for the external programs first in the PATH (and the cache inside the
+    directory) until the end of the test.
+    :param test: The running test
+    :param directory: The directory where the programs are written
+    :param names: The names of the programs (e.g. 'flac')
+    :param environment: The extra environment variables of the programs
+    :return: The directory of the programs
+    """
+    programs = directory / 'bin'
+    programs.mkdir()
+    for name in names:
+        program = programs / name
+        program.write_text(PROGRAMS[name])
+        program.chmod(program.stat().st_mode | stat.S_IEXEC)
+
+    environment.update({'PATH': str(programs) + os.pathsep + os.environ['PATH'],
+                        'XDG_CACHE_HOME': str(directory / 'cache')})
+    patch = mock.patch.dict(os.environ, environment)
+    patch.start()
+    test.addCleanup(patch.stop)
+    reset_programs()
+    test.addCleanup(reset_programs)
+    return programs
+
+
+def flac_block(block_type, data, last=False):
+    return bytes([block_type | (0x80 if last else 0)]) + pack('>I', len(data))[1:] + data
+
+
+def stream_info(sample_rate=44100, channels=2, bits_per_sample=16, total_samples=441000):
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) | \
+        total_samples
+    return pack('>HH', 4096, 4096) + bytes(6) + pack('>Q', packed) + bytes(range(16))
+
+
+def vorbis_comment(comments):
+    data = pack('<I', 6) + b'anarky' + pack('<I', len(comments))
+    for comment in comments:
+        encoded = comment.encode('utf-8')
+        data += pack('<I', len(encoded)) + encoded
+    return data
+
+
+def picture(picture_type, description, data, mime='image/jpeg'):
+    return pack('>II', picture_type, len(mime)) + mime.encode('ascii') + \
+        pack('>I', len(description)) + description.encode('utf-8') + \
+        pack('>IIIII', 500, 500, 24, 0, len(data)) + data
+
+
+def flac_metadata(comments=None, pictures=(), padding=False, **stream):
+    # The STREAMINFO block, then the optional VORBIS_COMMENT, PICTURE and PADDING blocks
+    blocks = [(0, stream_info(**stream))]
+    if comments is not None:
+        blocks.append((4, vorbis_comment(comments)))
+    blocks += [(6, picture(*item)) for item in pictures]
+    if padding:
+        blocks.append((1, bytes(8)))
+    return b'fLaC' + b''.join(flac_block(block_type, data, last=index == len(blocks) - 1)
+                              for index, (block_type, data) in enumerate(blocks))
+
+
+def flac_file(filename, comments=None, pictures=(), audio=b'audio frames', prefix=b'', **kwargs):
+    Path(filename).write_bytes(prefix + flac_metadata(comments, pictures, **kwargs) + audio)
+    return str(filename)
@@ -9,7 +9,11 @@ License: MIT (see LICENSE for details)
 
 # Module import
 # --------------------------------------------------------------------------------------------------
-import anarky.library.interface as interface
+from pathlib import Path
+from threading import current_thread
+from unittest.mock import patch
+import anarky.interface as interface
+from anarky import utils
 import tempfile
 import unittest
 
@@ -18,6 +22,17 @@ import unittest
 # --------------------------------------------------------------------------------------------------
 class InterfaceTests(unittest.TestCase):
 
+    # Builds a directory tree of input files
+    def tree(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = temporary.name
+        for name in ('a.flac', 'cover.jpg', 'disc1/b.FLAC', 'disc1/c.flac', 'live/d.flac'):
+            path = Path(directory, name)
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(b'')
+        return directory
+
     # Tests for method "file_exists"
     def test_file_exists_none(self):
         result = interface.file_exists(None)
@@ -63,6 +78,54 @@ class InterfaceTests(unittest.TestCase):
         result = interface.get_input_files(True)
         self.assertEqual(result, [])
 
+    def test_get_input_files(self):
+        directory = self.tree()
+        result = interface.get_input_files([directory])
+        self.assertEqual([Path(path).relative_to(directory).as_posix() for path in result],
+                         ['a.flac', 'cover.jpg', 'disc1/b.FLAC', 'disc1/c.flac', 'live/d.flac'])
+
+    # Tests for method "iter_input_files"
+    def test_iter_input_files_extensions(self):
+        directory = self.tree()
+        result = interface.iter_input_files([directory], extensions=['.flac'])
+        self.assertEqual([Path(path).name for path in result],
+                         ['a.flac', 'b.FLAC', 'c.flac', 'd.flac'])
+
+    def test_iter_input_files_include_exclude(self):
+        directory = self.tree()
+        result = interface.iter_input_files([directory], include=['disc1/*', 'd.*'],
+                                            exclude=['c.flac'])
+        self.assertEqual([Path(path).name for path in result], ['b.FLAC', 'd.flac'])
+
+    def test_iter_input_files_exclude_directory(self):
+        directory = self.tree()
+        result = interface.iter_input_files([directory], extensions=['.flac'], exclude=['live'])
+        self.assertEqual([Path(path).name for path in result], ['a.flac', 'b.FLAC', 'c.flac'])
+
+    def test_iter_input_files_explicit_file(self):
+        directory = self.tree()
+        cover = str(Path(directory, 'cover.jpg'))
+        result = interface.iter_input_files([cover], extensions=['.flac'])
+        self.assertEqual(list(result), [cover])
+
+    def test_iter_input_files_walks_ahead(self):
+        # The directory is walked by another thread while the files are consumed
+        directory = self.tree()
+        threads = []
+
+        def walk_files(*args):
+            threads.append(current_thread())
+            yield from utils.walk_files(*args)
+
+        with patch('anarky.interface.walk_files', walk_files):
+            result = interface.iter_input_files([directory], extensions=['.flac'])
+            self.assertEqual(Path(next(result)).name, 'a.flac')
+            self.assertEqual([Path(path).name for path in result], ['b.FLAC', 'c.flac', 'd.flac'])
+        self.assertNotEqual(threads, [current_thread()])
+
+    def test_iter_input_files_none(self):
+        self.assertEqual(list(interface.iter_input_files(None)), [])
+
 
 # Methods :: Execution and boilerplate
 # --------------------------------------------------------------------------------------------------
@@ -0,0 +1,114 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the write-ahead journal of a batch of conversions.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import json
+import tempfile
+import unittest
+
+from anarky.journal import DONE, FAILED, Journal, JOURNAL
+from anarky.scheduler import run_jobs
+
+
+class JournalTests(unittest.TestCase):
+    """
+    Tests for the write-ahead journal of a batch of conversions.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.files = []
+        for name in ('one', 'two', 'bad', 'four'):
+            filename = self.directory / (name + '.wav')
+            filename.write_bytes(b'audio')
+            self.files.append(str(filename))
+
+    def convert(self, filename, destination):
+        if 'bad' in filename:
+            raise ValueError('corrupt file')
+        output = Path(destination, Path(filename).stem + '.flac')
+        output.write_bytes(b'flac')
+        return output
+
+    def run_batch(self, files, resume=False):
+        with Journal(str(self.directory), 'wav2flac', resume) as journal:
+            results = run_jobs(journal.track(self.convert), journal.queue(files),
+                               str(self.directory), 2)
+        return journal, results
+
+    def test_journal_states(self):
+        journal, results = self.run_batch(self.files)
+        self.assertEqual(len(results), 4)
+        states = {Path(key).name: entry['state'] for key, entry in journal.entries.items()}
+        self.assertEqual(states, {'one.wav': DONE, 'two.wav': DONE, 'bad.wav': FAILED,
+                                  'four.wav': DONE})
+
+    def test_resume(self):
+        # The batch is killed after the first two files
+        self.run_batch(self.files[:2])
+        with open(str(self.directory / JOURNAL), 'a') as journal_file:
+            journal_file.write('{"file": "' + self.files[3] + '", "sta')
+
+        journal, results = self.run_batch(self.files, resume=True)
+        self.assertEqual(journal.resumed, 2)
+        self.assertEqual(sorted(Path(result.filename).name for result in results),
+                         ['bad.wav', 'four.wav'])
+        # The record cut short was removed, so the records written afterwards can be read
+        for line in (self.directory / JOURNAL).read_text().splitlines():
+            json.loads(line)
+
+        # The output of a converted file is gone and another file changed, so they're converted
+        # again
+        (self.directory / 'one.flac').unlink()
+        Path(self.files[1]).write_bytes(b'longer audio')
+        journal, results = self.run_batch(self.files, resume=True)
+        self.assertEqual(sorted(Path(result.filename).name for result in results),
+                         ['bad.wav', 'one.wav', 'two.wav'])
+
+    def test_resume_every_output(self):
+        # A fan-out conversion is only done while every one of its outputs is still there
+        def fan_out(filename, destination):
+            outputs = [Path(destination, Path(filename).stem + extension)
+                       for extension in ('.flac', '.mp3')]
+            for output in outputs:
+                output.write_bytes(b'encoded')
+            return outputs
+
+        with Journal(str(self.directory), 'flac2many') as journal:
+            results = run_jobs(journal.track(fan_out), journal.queue(self.files[:2]),
+                               str(self.directory))
+        self.assertEqual(sorted(Path(result.output).name for result in results),
+                         ['one.flac', 'two.flac'])
+
+        (self.directory / 'two.mp3').unlink()
+        with Journal(str(self.directory), 'flac2many', resume=True) as journal:
+            self.assertEqual(list(journal.queue(self.files[:2])), [self.files[1]])
+
+    def test_without_resume(self):
+        self.run_batch(self.files)
+        journal, results = self.run_batch(self.files)
+        self.assertEqual(journal.resumed, 0)
+        self.assertEqual(len(results), 4)
+
+    def test_close_remove(self):
+        journal, _ = self.run_batch(self.files)
+        self.assertTrue(journal.path.is_file())
+        journal.close(remove=True)
+        self.assertFalse(journal.path.exists())
+
+    def test_resume_other_conversion(self):
+        self.run_batch(self.files)
+        with Journal(str(self.directory), 'wav2mp3', resume=True) as journal:
+            self.assertEqual(list(journal.queue(self.files)), self.files)
+
+
+if __name__ == '__main__':
+    unittest.main()
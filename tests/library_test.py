@@ -0,0 +1,105 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the persistent index of an audio library.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from hashlib import sha256
+from pathlib import Path
+import os
+import tempfile
+import unittest
+
+from anarky.audio.wav import PCM, WavFormat, WavWriter
+from anarky.library import Cover, LibraryIndex, UpdateSummary, without_output
+from tests.helpers import flac_file
+
+
+class LibraryTests(unittest.TestCase):
+    """
+    Tests for the persistent index of an audio library.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.library = self.directory / 'library'
+        (self.library / 'album').mkdir(parents=True)
+        self.first = self.library / 'album' / 'first.flac'
+        flac_file(self.first, ['ARTIST=Nina Simone', 'TITLE=Sinnerman', 'COMMENT=live'],
+                  [(3, '', b'cover', 'image/png')])
+        self.second = self.library / 'album' / 'second.flac'
+        flac_file(self.second, ['ARTIST=Nina Simone', 'ARTIST=Duke Ellington'])
+        self.wav = self.library / 'take.wav'
+        with WavWriter(str(self.wav), WavFormat(PCM, 2, 44100, 16)) as writer:
+            writer.write(bytes(44100 * 4))
+        self.broken = self.library / 'broken.flac'
+        self.broken.write_bytes(b'fLaC')
+
+        self.index = LibraryIndex(str(self.directory / 'library.db'))
+        self.addCleanup(self.index.close)
+
+    def test_update(self):
+        self.assertEqual(self.index.update([str(self.library)]),
+                         UpdateSummary(added=4, failed=1))
+
+        entry = self.index.get(str(self.first))
+        self.assertEqual((entry.format, entry.duration, entry.sample_rate, entry.channels,
+                          entry.bits_per_sample), ('flac', 10.0, 44100, 2, 16))
+        # Only the tags that are written into the converted files are indexed
+        self.assertEqual(entry.tags, {'ARTIST': ['Nina Simone'], 'TITLE': ['Sinnerman']})
+        self.assertEqual(entry.covers,
+                         (Cover(3, 'image/png', 500, 500, sha256(b'cover').hexdigest()),))
+        self.assertEqual(self.index.get(str(self.wav)).duration, 1.0)
+        self.assertIn('ValueError', self.index.get(str(self.broken)).error)
+
+        # Only the changed files are read again and the removed ones are forgotten
+        flac_file(self.second, ['ARTIST=Duke Ellington', 'ALBUM=Money Jungle'])
+        os.utime(str(self.second), ns=(1, 1))
+        self.wav.unlink()
+        self.assertEqual(self.index.update([str(self.library)], exclude=['broken*']),
+                         UpdateSummary(updated=1, unchanged=1, removed=1))
+        self.assertEqual(self.index.get(str(self.second)).tags,
+                         {'ARTIST': ['Duke Ellington'], 'ALBUM': ['Money Jungle']})
+        self.assertIsNone(self.index.get(str(self.wav)))
+        self.assertIsNotNone(self.index.get(str(self.broken)))
+
+    def test_update_overlapping(self):
+        # The files reached through several inputs are only indexed once
+        paths = [str(self.library), str(self.library / 'album'), str(self.first), str(self.first)]
+        self.assertEqual(self.index.update(paths), UpdateSummary(added=4, failed=1))
+        self.assertEqual(self.index.update(paths), UpdateSummary(unchanged=4))
+
+    def test_select(self):
+        self.index.update([str(self.library)])
+
+        self.assertEqual(self.index.select('.flac', {'artist': 'nina simone'}),
+                         [str(self.first), str(self.second)])
+        self.assertEqual(self.index.select(tags={'ARTIST': 'Duke Ellington'}), [str(self.second)])
+        self.assertEqual(self.index.select('.flac', cover=False), [str(self.second)])
+        self.assertEqual(self.index.select('.wav'), [str(self.wav)])
+        self.assertEqual(self.index.select(tags={'ARTIST': 'Nina Simone', 'TITLE': 'Other'}), [])
+
+        # The tags are compared without case in any script, not only in ASCII
+        flac_file(self.second, ['ARTIST=Édith Piaf', 'TITLE=Straße'])
+        os.utime(str(self.second), ns=(1, 1))
+        self.index.update([str(self.second)])
+        self.assertEqual(self.index.select(tags={'ARTIST': 'ÉDITH PIAF', 'TITLE': 'STRASSE'}),
+                         [str(self.second)])
+        self.assertEqual(self.index.get(str(self.second)).tags,
+                         {'ARTIST': ['Édith Piaf'], 'TITLE': ['Straße']})
+
+        # The files already converted into the output directory are left out
+        output = self.directory / 'mp3'
+        output.mkdir()
+        (output / 'first.mp3').write_bytes(b'mp3')
+        self.assertEqual(list(without_output(self.index.select('.flac'), str(output), '.mp3')),
+                         [str(self.second)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the manifest of conversions.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest import mock
+import os
+import tempfile
+import unittest
+
+from anarky.manifest import Manifest, MANIFEST
+from anarky.scheduler import run_jobs
+
+
+class ManifestTests(unittest.TestCase):
+    """
+    Tests for the manifest of conversions.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.source = self.directory / 'song.wav'
+        self.source.write_bytes(b'audio')
+        self.output = self.directory / 'song.flac'
+        self.output.write_bytes(b'encoded')
+
+    def converted(self, settings='-f8V'):
+        manifest = Manifest(str(self.directory), 'wav2flac', settings)
+        manifest.update(str(self.source), str(self.output))
+        manifest.save()
+        return Manifest(str(self.directory), 'wav2flac', settings)
+
+    def test_is_up_to_date_unknown_file(self):
+        manifest = Manifest(str(self.directory), 'wav2flac', '-f8V')
+        self.assertFalse(manifest.is_up_to_date(str(self.source)))
+
+    def test_is_up_to_date(self):
+        manifest = self.converted()
+        self.assertTrue(manifest.is_up_to_date(str(self.source)))
+        self.assertEqual(manifest.get_output(str(self.source)), str(self.output.resolve()))
+
+    def test_is_up_to_date_other_conversion(self):
+        self.converted()
+        manifest = Manifest(str(self.directory), 'wav2mp3', '-f8V')
+        self.assertFalse(manifest.is_up_to_date(str(self.source)))
+
+    def test_is_up_to_date_touched(self):
+        manifest = self.converted()
+        stat = self.source.stat()
+        os.utime(str(self.source), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(manifest.is_up_to_date(str(self.source)))
+
+    def test_is_up_to_date_changed(self):
+        manifest = self.converted()
+        stat = self.source.stat()
+        self.source.write_bytes(b'AUDIO')
+        os.utime(str(self.source), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertFalse(manifest.is_up_to_date(str(self.source)))
+
+    def test_is_up_to_date_settings(self):
+        self.converted()
+        manifest = Manifest(str(self.directory), 'wav2flac', '-f5')
+        self.assertFalse(manifest.is_up_to_date(str(self.source)))
+
+    def test_is_up_to_date_output_removed(self):
+        manifest = self.converted()
+        self.output.unlink()
+        self.assertFalse(manifest.is_up_to_date(str(self.source)))
+
+    def test_is_up_to_date_every_output(self):
+        # Every output of a fan-out conversion must still be there
+        other = self.directory / 'mp3' / 'song.mp3'
+        other.parent.mkdir()
+        other.write_bytes(b'encoded')
+        manifest = Manifest(str(self.directory), 'flac2many', '-f8V')
+        manifest.update(str(self.source), [str(self.output), str(other)])
+        self.assertEqual(manifest.get_output(str(self.source)), str(self.output.resolve()))
+        self.assertTrue(manifest.is_up_to_date(str(self.source)))
+        other.unlink()
+        self.assertFalse(manifest.is_up_to_date(str(self.source)))
+
+    def test_checkpoint(self):
+        # The manifest is written while the batch runs, not only once it's saved
+        manifest = Manifest(str(self.directory), 'wav2flac', '-f8V')
+        with mock.patch('anarky.manifest.CHECKPOINT_FILES', 1):
+            run_jobs(lambda filename, destination: self.output, [str(self.source)],
+                     str(self.directory), manifest=manifest)
+        self.assertTrue((self.directory / MANIFEST).is_file())
+        self.assertTrue(Manifest(str(self.directory), 'wav2flac', '-f8V').is_up_to_date(
+            str(self.source)))
+
+
+if __name__ == '__main__':
+    unittest.main()
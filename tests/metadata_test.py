@@ -0,0 +1,186 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the audio metadata management operations.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest import mock
+import os
+import tempfile
+import unittest
+import wave
+
+from anarky.metadata import CoverCache, get_cover, get_duration, get_flac_arguments, \
+    get_lame_arguments, get_tags, Picture, read_audio_header, read_flac_metadata
+from tests import helpers
+
+
+def flac_file(directory, comments=(), pictures=(), prefix=b''):
+    return helpers.flac_file(Path(directory, 'song.flac'), comments, pictures,
+                             b'\xff\xf8audio frames', prefix, padding=True)
+
+
+class MetadataTests(unittest.TestCase):
+    """
+    Tests for the audio metadata management operations.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = temporary.name
+
+    def test_read_flac_metadata(self):
+        filename = flac_file(self.directory, ['TITLE=Song', 'artist=Band', 'ARTIST=Other'],
+                             [(3, 'front.jpg', b'jpeg')])
+        metadata = read_flac_metadata(filename)
+        self.assertEqual(metadata.stream_info.sample_rate, 44100)
+        self.assertEqual(metadata.stream_info.channels, 2)
+        self.assertEqual(metadata.stream_info.bits_per_sample, 16)
+        self.assertEqual(metadata.stream_info.total_samples, 441000)
+        self.assertEqual(metadata.stream_info.duration, 10.0)
+        self.assertEqual(metadata.stream_info.md5, bytes(range(16)).hex())
+        self.assertEqual(metadata.tags, {'TITLE': ['Song'], 'ARTIST': ['Band', 'Other']})
+        self.assertEqual(metadata.pictures[0].description, 'front.jpg')
+        self.assertEqual(metadata.pictures[0].data, b'jpeg')
+
+    def test_read_flac_metadata_without_pictures(self):
+        filename = flac_file(self.directory, pictures=[(3, 'front.jpg', b'jpeg')])
+        self.assertEqual(read_flac_metadata(filename, pictures=False).pictures, [])
+
+    def test_read_flac_metadata_id3(self):
+        id3 = b'ID3\x03\x00\x00' + bytes([0, 0, 0, 10]) + bytes(10)
+        filename = flac_file(self.directory, ['TITLE=Song'], prefix=id3)
+        self.assertEqual(read_flac_metadata(filename).tags, {'TITLE': ['Song']})
+
+    def test_read_flac_metadata_id3_footer(self):
+        # The footer (flag 0x10) isn't counted in the size of the tag
+        id3 = b'ID3\x04\x00\x10' + bytes([0, 0, 0, 10]) + bytes(10) + b'3DI\x04\x00\x10' + bytes(4)
+        filename = flac_file(self.directory, ['TITLE=Song'], prefix=id3)
+        self.assertEqual(read_flac_metadata(filename).tags, {'TITLE': ['Song']})
+
+    def test_read_flac_metadata_invalid(self):
+        filename = Path(self.directory, 'song.wav')
+        filename.write_bytes(b'RIFF\x00\x00\x00\x00WAVE')
+        with self.assertRaises(ValueError):
+            read_flac_metadata(str(filename))
+
+    def test_get_tags(self):
+        filename = flac_file(self.directory, ['TITLE=A=B', 'TRACKNUMBER=3', 'COMMENT=ignored'])
+        self.assertEqual(get_tags(filename), {'TITLE': 'A=B', 'TRACKNUMBER': '3'})
+
+    def test_get_lame_arguments(self):
+        tags = {'TITLE': ['Song'], 'ARTIST': ['Band', 'Other'], 'TRACKNUMBER': ['3'],
+                'TRACKTOTAL': ['12'], 'ALBUMARTIST': ['Various'], 'COMMENT': ['ignored']}
+        self.assertEqual(get_lame_arguments(tags, 'cover.jpg'),
+                         ['--tt', 'Song', '--ta', 'Band', '--tn', '3/12', '--tv', 'TPE2=Various',
+                          '--ti', 'cover.jpg'])
+        self.assertEqual(get_lame_arguments({}), [])
+
+    def test_get_flac_arguments(self):
+        # Only the known tags are copied, never an embedded picture or any other comment
+        tags = {'TITLE': ['Song'], 'ARTIST': ['Band', 'Other'], 'COMMENT': ['ignored'],
+                'METADATA_BLOCK_PICTURE': ['AAAAAw==']}
+        self.assertEqual(get_flac_arguments(tags, 'cover.jpg'),
+                         ['--tag=TITLE=Song', '--tag=ARTIST=Band', '--tag=ARTIST=Other',
+                          '--picture=cover.jpg'])
+
+    def test_read_flac_metadata_corrupted(self):
+        filename = Path(self.directory, 'corrupted.flac')
+        filename.write_bytes(b'fLaC' + helpers.flac_block(0, bytes(10), last=True))
+        with self.assertRaises(ValueError):
+            read_flac_metadata(str(filename))
+
+    def test_get_cover(self):
+        filename = flac_file(self.directory, pictures=[(4, 'back.jpg', b'back'),
+                                                       (3, 'front.jpg', b'front')])
+        cover = get_cover(filename, self.directory)
+        self.assertEqual(cover, str(Path(self.directory, 'front.jpg')))
+        self.assertEqual(Path(cover).read_bytes(), b'front')
+
+    def test_get_cover_without_description(self):
+        filename = flac_file(self.directory, pictures=[(3, '', b'png', 'image/png')])
+        self.assertEqual(Path(get_cover(filename, self.directory)).name, 'cover.png')
+
+    def test_cover_cache(self):
+        cache = CoverCache()
+        front = Picture(3, 'image/jpeg', 'front.jpg', 1, 1, b'front')
+        other = Picture(3, 'image/jpeg', 'front.jpg', 1, 1, b'other')
+        cover = cache.store(front, self.directory)
+        mtime = Path(cover).stat().st_mtime_ns
+
+        self.assertEqual(cache.store(front, self.directory), cover)
+        self.assertEqual(CoverCache().store(front, self.directory), cover)
+        self.assertEqual(Path(cover).stat().st_mtime_ns, mtime)
+        different = cache.store(other, self.directory)
+        self.assertNotEqual(different, cover)
+        self.assertEqual(Path(different).read_bytes(), b'other')
+
+    def test_cover_cache_temporary(self):
+        cache = CoverCache()
+        cover = cache.store(Picture(3, 'image/png', '', 1, 1, b'png'))
+        self.assertTrue(cover.endswith('.png'))
+        self.assertEqual(cache.store(Picture(3, 'image/png', 'x', 1, 1, b'png')), cover)
+        cache.close()
+        self.assertFalse(Path(cover).exists())
+
+    def test_cover_cache_scope(self):
+        # The cache is closed once the last batch (or job) that uses it ends
+        cache = CoverCache()
+        with cache:
+            with cache:
+                cover = cache.store(Picture(3, 'image/png', '', 1, 1, b'png'))
+            self.assertTrue(Path(cover).exists())
+        self.assertFalse(Path(cover).exists())
+
+        with cache:
+            self.assertNotEqual(cache.store(Picture(3, 'image/png', '', 1, 1, b'png')), cover)
+
+    def test_get_cover_album(self):
+        cache = CoverCache()
+        covers = set()
+        for track in range(3):
+            directory = Path(self.directory, str(track))
+            directory.mkdir()
+            filename = flac_file(directory, pictures=[(3, 'front.jpg', b'front')])
+            covers.add(get_cover(filename, self.directory, cache))
+        self.assertEqual(covers, {str(Path(self.directory, 'front.jpg'))})
+
+    def test_get_cover_none(self):
+        self.assertIsNone(get_cover(flac_file(self.directory), self.directory))
+
+    def test_get_duration(self):
+        self.assertEqual(get_duration(flac_file(self.directory)), 10.0)
+
+        filename = str(Path(self.directory, 'song.wav'))
+        with wave.open(filename, 'wb') as wav_file:
+            wav_file.setnchannels(2)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(8000)
+            wav_file.writeframes(bytes(4 * 4000))
+        self.assertEqual(get_duration(filename), 0.5)
+
+    def test_read_audio_header_cached(self):
+        # The header is only read again once the file changes
+        filename = flac_file(self.directory)
+        with mock.patch('anarky.metadata.read_flac_metadata', wraps=read_flac_metadata) as read:
+            self.assertEqual(get_duration(filename), 10.0)
+            self.assertEqual(read_audio_header(filename).data_size, 441000 * 2 * 2)
+            self.assertEqual(read.call_count, 1)
+            os.utime(filename, ns=(1, 1))
+            self.assertEqual(get_duration(filename), 10.0)
+            self.assertEqual(read.call_count, 2)
+
+    def test_get_duration_unknown(self):
+        filename = Path(self.directory, 'song.wav')
+        filename.write_bytes(b'not a wav file')
+        self.assertEqual(get_duration(str(filename)), 0.0)
+        self.assertEqual(get_duration(str(Path(self.directory, 'song.mp3'))), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
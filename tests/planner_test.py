@@ -0,0 +1,65 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the planning of the order in which a batch of files is converted.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import tempfile
+import unittest
+
+from anarky.audio.wav import PCM, WavFormat, WavWriter
+from anarky.planner import BYTES_PER_SECOND, estimate_cost, makespan, Plan, plan_jobs
+
+
+class PlannerTests(unittest.TestCase):
+    """
+    Tests for the planning of the order in which a batch of files is converted.
+    """
+
+    def test_makespan(self):
+        self.assertEqual(makespan([1, 1, 1, 1, 70], 4), 71)
+        self.assertEqual(makespan([70, 1, 1, 1, 1], 4), 70)
+        self.assertEqual(makespan([3, 3, 2, 2, 2], 2), 7)
+        self.assertEqual(makespan([], 4), 0)
+
+    def test_estimate_cost(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = Path(temporary.name)
+        wav_file = directory / 'song.wav'
+        with WavWriter(str(wav_file), WavFormat(PCM, 1, 8000, 16)) as writer:
+            writer.write(bytes(32000))
+        other = directory / 'song.ape'
+        other.write_bytes(bytes(BYTES_PER_SECOND))
+
+        self.assertEqual(estimate_cost(str(wav_file)), 2.0)
+        self.assertEqual(estimate_cost(str(other)), 1.0)
+        self.assertEqual(estimate_cost(str(directory / 'missing.wav')), 0.0)
+
+    def test_plan_order(self):
+        costs = {'a': 1.0, 'live': 4200.0, 'b': 300.0, 'c': 200.0}
+        plan = plan_jobs(['a', 'b', 'c', 'live'], 2, cost=costs.get)
+        self.assertEqual(list(plan), ['live', 'b', 'c', 'a'])
+        self.assertEqual(plan.makespan, 4200.0)
+        self.assertEqual(plan.naive_makespan, 4401.0)
+
+    def test_plan_report(self):
+        plan = Plan(['a', 'b'], {'a': 10.0, 'b': 30.0}, 2)
+        convert = plan.track(lambda filename, destination: filename + destination)
+        self.assertEqual(convert('a', '.mp3'), 'a.mp3')
+        self.assertEqual(convert('b', '.mp3'), 'b.mp3')
+        plan.walls = {'a': 1.0, 'b': 3.0}
+
+        report = plan.report(3.5)
+        self.assertEqual(report['speed'], 10.0)
+        self.assertEqual(report['predicted_wall'], 3.0)
+        self.assertEqual(report['actual_wall'], 3.5)
+        self.assertIn('predicted 3.0 s', plan.summary(3.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the playlists of the output files of a batch.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest.mock import patch
+import tempfile
+import unittest
+
+from anarky.audio.wav import PCM, WavFormat, WavWriter
+from anarky.journal import Journal
+from anarky.playlist import Playlist
+from anarky.scheduler import Result, run_jobs
+from anarky.utils import get_partial_path
+from tests.helpers import flac_file
+
+
+class PlaylistTests(unittest.TestCase):
+    """
+    Tests for the playlists of the output files of a batch.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.output = self.directory / 'mp3'
+        self.output.mkdir()
+        self.files = []
+        for name, comments in (('one', ['ARTIST=Nina Simone', 'TITLE=Sinnerman']),
+                               ('two', ['TITLE=Łódź']), ('bad', []),
+                               ('four', ['ARTIST=Nobody'])):
+            filename = self.directory / (name + '.flac')
+            flac_file(filename, comments, total_samples=88200)
+            self.files.append(str(filename))
+
+    def convert(self, filename, destination):
+        if 'bad' in filename:
+            raise ValueError('corrupt file')
+        output = Path(destination, Path(filename).stem + '.mp3')
+        output.write_bytes(b'mp3')
+        return output
+
+    def result(self, index):
+        return Result(self.files[index], self.output / (Path(self.files[index]).stem + '.mp3'))
+
+    def test_listing_order(self):
+        filename = self.output / 'album.m3u8'
+        playlist = Playlist(str(filename))
+        self.assertEqual(list(playlist.queue(self.files)), self.files)
+
+        # The entries wait for the conversions of the files listed before them
+        playlist.add(self.result(1))
+        partial = get_partial_path(str(filename))
+        self.assertEqual(partial.read_text(), '#EXTM3U\n')
+        playlist.add(self.result(0))
+        self.assertEqual(partial.read_text(encoding='utf-8'),
+                         '#EXTM3U\n#EXTINF:2,Nina Simone - Sinnerman\none.mp3\n'
+                         '#EXTINF:2,Łódź\ntwo.mp3\n')
+
+        # The failed conversions are left out and the ones never finished don't hold the others
+        playlist.add(Result(self.files[2], None, 'ValueError: corrupt file'))
+        playlist.add(self.result(3)._replace(filename=self.files[3] + '.missing'))
+        playlist.close()
+        self.assertFalse(partial.exists())
+        self.assertEqual(playlist.count, 2)
+        self.assertTrue(filename.read_text(encoding='utf-8').endswith('two.mp3\n'))
+
+    def test_resume(self):
+        # The first batch converts the first two files and the second one the others
+        wav = self.directory / 'take.wav'
+        with WavWriter(str(wav), WavFormat(PCM, 2, 44100, 16)) as writer:
+            writer.write(bytes(44100 * 12))
+        self.files.append(str(wav))
+        with Journal(str(self.output), 'flac2mp3') as journal:
+            run_jobs(journal.track(self.convert), journal.queue(self.files[:2]), str(self.output))
+
+        filename = self.directory / 'album.m3u'
+        with Playlist(str(filename)) as playlist:
+            with Journal(str(self.output), 'flac2mp3', resume=True) as journal:
+                def resumed(name, output):
+                    playlist.add(Result(name, output, skipped=True))
+
+                results = run_jobs(journal.track(playlist.track(self.convert)),
+                                   journal.queue(playlist.queue(self.files), resumed),
+                                   str(self.output), 2)
+                list(playlist.record(reversed(results)))
+
+        # The headers of the converted files were read by the workers
+        self.assertEqual({Path(result.filename).stem: (result.duration, result.tags)
+                          for result in results if not result.failed},
+                         {'four': (2.0, {'ARTIST': ['Nobody']}), 'take': (3.0, {})})
+
+        # Legacy playlists replace the characters that Latin-1 can't encode
+        self.assertEqual(filename.read_bytes().decode('latin-1').splitlines(),
+                         ['#EXTM3U', '#EXTINF:2,Nina Simone - Sinnerman', 'mp3/one.mp3',
+                          '#EXTINF:2,?ód?', 'mp3/two.mp3', '#EXTINF:2,four', 'mp3/four.mp3',
+                          '#EXTINF:3,take', 'mp3/take.mp3'])
+
+    def test_carried_description(self):
+        # The duration and tags come from the result; the title is kept in a single line
+        filename = self.output / 'album.m3u8'
+        with Playlist(str(filename)) as playlist:
+            list(playlist.queue(self.files[:1]))
+            playlist.add(self.result(0)._replace(
+                duration=61.4, tags={'ARTIST': ['Nina\r\nSimone'], 'TITLE': ['Sinnerman\n']}))
+        self.assertEqual(filename.read_text(encoding='utf-8').splitlines(),
+                         ['#EXTM3U', '#EXTINF:61,Nina Simone - Sinnerman', 'one.mp3'])
+
+    def test_listed_twice(self):
+        # A file listed twice takes both of its places and doesn't hold the files after it
+        filename = self.output / 'album.m3u8'
+        playlist = Playlist(str(filename))
+        files = [self.files[0], self.files[1], self.files[0], self.files[3]]
+        self.assertEqual(list(playlist.queue(files)), files)
+        for index in (0, 1, 0):
+            playlist.add(self.result(index))
+        self.assertEqual(playlist.count, 3)
+        playlist.add(self.result(3))
+        self.assertEqual(playlist.count, 4)
+        playlist.close()
+        self.assertEqual(filename.read_text(encoding='utf-8').splitlines()[2::2],
+                         ['one.mp3', 'two.mp3', 'one.mp3', 'four.mp3'])
+
+    def test_bounded_buffer(self):
+        # Past the size of the buffer, the entries stop waiting for the files listed before them
+        filename = self.output / 'album.m3u8'
+        with patch('anarky.playlist.BUFFER_SIZE', 1):
+            with Playlist(str(filename)) as playlist:
+                list(playlist.queue(self.files))
+                playlist.add(self.result(3))
+                self.assertEqual(playlist.count, 0)
+                playlist.add(self.result(1))
+                self.assertEqual(playlist.count, 1)
+                playlist.add(self.result(0))
+                playlist.add(Result(self.files[2], None, 'ValueError: corrupt file'))
+        self.assertEqual(filename.read_text(encoding='utf-8').splitlines()[2::2],
+                         ['two.mp3', 'one.mp3', 'four.mp3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the execution of external programs.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from subprocess import TimeoutExpired
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from anarky.manifest import Manifest
+from anarky.process import Engine, iter_blocking, ProcessError, run_blocking, run_bounded, \
+    run_pipeline, run_pipeline_async, run_process, run_process_async, run_tee
+from anarky.scheduler import describe_job, describing
+
+
+def shell(script):
+    return ['sh', '-c', script]
+
+
+class ProcessTests(unittest.TestCase):
+    """
+    Tests for the execution of external programs.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+
+    def test_run_process(self):
+        self.assertEqual(run_process(shell('echo progress >&2')), b'progress\n')
+
+    def test_run_process_error(self):
+        with self.assertRaises(ProcessError) as context:
+            run_process(shell('echo "invalid input" >&2; exit 3'))
+        self.assertEqual(context.exception.returncode, 3)
+        self.assertIn('invalid input', str(context.exception))
+
+    def test_run_process_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(TimeoutExpired):
+            run_process(['sleep', '10'], timeout=0.2)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_run_pipeline(self):
+        output = self.directory / 'output'
+        run_pipeline(shell('echo audio'), shell('cat > "{}"'.format(output)))
+        self.assertEqual(output.read_text(), 'audio\n')
+
+    def test_run_pipeline_error(self):
+        with self.assertRaises(ProcessError) as context:
+            run_pipeline(shell('echo corrupt >&2; exit 1'), ['cat'])
+        self.assertIn('corrupt', str(context.exception))
+
+    def test_run_pipeline_consumer_error(self):
+        # The producer only fails because the consumer stopped reading: the consumer is reported
+        producer = shell('trap "" PIPE; while echo audio; do :; done; echo "broken pipe" >&2; '
+                         'exit 141')
+        consumer = shell('head -c 1 > /dev/null; echo "disk full" >&2; exit 2')
+        with self.assertRaises(ProcessError) as context:
+            run_pipeline(producer, consumer)
+        self.assertEqual(context.exception.returncode, 2)
+        self.assertIn('disk full', str(context.exception))
+        with self.assertRaises(ProcessError) as context:
+            asyncio.run(run_pipeline_async(producer, consumer))
+        self.assertEqual(context.exception.returncode, 2)
+
+    def test_run_tee(self):
+        first, second, copy = (self.directory / name for name in ('first', 'second', 'copy'))
+        # Larger than a pipe buffer and a queued chunk, so the consumers are fed in several rounds
+        audio = 'x' * 300000
+        errors = run_tee(shell('head -c 300000 /dev/zero | tr "\\0" x'),
+                         [shell('cat > "{}"'.format(first)), shell('cat > "{}"'.format(second)),
+                          shell('echo "bad input" >&2; exit 2')],
+                         [str(copy)])
+
+        self.assertEqual(errors[:2] + errors[3:], [None, None, None])
+        self.assertIsInstance(errors[2], ProcessError)
+        self.assertIn('bad input', str(errors[2]))
+        for output in (first, second, copy):
+            self.assertEqual(output.read_text(), audio)
+
+    def test_run_tee_error(self):
+        with self.assertRaises(ProcessError) as context:
+            run_tee(shell('echo corrupt >&2; exit 1'), [['cat']])
+        self.assertIn('corrupt', str(context.exception))
+
+    def test_run_process_async(self):
+        self.assertEqual(asyncio.run(run_process_async(shell('echo progress >&2'))),
+                         b'progress\n')
+
+    def test_run_process_async_error(self):
+        with self.assertRaises(ProcessError):
+            asyncio.run(run_process_async(shell('exit 2')))
+
+    def test_run_process_async_timeout(self):
+        with self.assertRaises(TimeoutExpired):
+            asyncio.run(run_process_async(['sleep', '10'], timeout=0.2))
+
+    def test_run_pipeline_async(self):
+        output = self.directory / 'output'
+        asyncio.run(run_pipeline_async(shell('echo audio'), shell('cat > "{}"'.format(output))))
+        self.assertEqual(output.read_text(), 'audio\n')
+
+    def test_run_pipeline_async_error(self):
+        with self.assertRaises(ProcessError):
+            asyncio.run(run_pipeline_async(['true'], shell('cat > /dev/null; exit 4')))
+
+    def test_engine(self):
+        running = []
+        peak = []
+
+        async def convert(filename, destination):
+            running.append(filename)
+            peak.append(len(running))
+            await run_process_async(['sleep', '0.05'])
+            running.remove(filename)
+            if filename == 'bad':
+                raise ValueError('corrupt file')
+            return destination + '/' + filename
+
+        async def run():
+            engine = Engine(jobs=2)
+            return [result async for result in engine.run(convert, ['a', 'b', 'bad', 'c'], 'out')]
+
+        results = {result.filename: result for result in asyncio.run(run())}
+        self.assertEqual(results['a'].output, 'out/a')
+        self.assertIn('corrupt file', results['bad'].error)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_engine_manifest(self):
+        source = self.directory / 'a.wav'
+        source.write_bytes(b'audio')
+        converted = []
+
+        async def convert(filename, destination):
+            converted.append(filename)
+            output = Path(destination, 'a.flac')
+            output.write_bytes(b'flac')
+            return str(output)
+
+        async def run():
+            manifest = Manifest(str(self.directory), 'wav2flac', '-8')
+            results = [result async for result in Engine().run(convert, [str(source)],
+                                                                str(self.directory), manifest)]
+            manifest.save()
+            return results
+
+        self.assertFalse(asyncio.run(run())[0].skipped)
+        self.assertTrue(asyncio.run(run())[0].skipped)
+        self.assertEqual(converted, [str(source)])
+
+    def test_run_bounded(self):
+        # The awaitables are created as the pending ones finish
+        created = []
+
+        async def job(number):
+            await asyncio.sleep(0.01)
+            return number
+
+        def jobs():
+            for number in range(10):
+                created.append(number)
+                yield job(number)
+
+        async def run():
+            results = []
+            async for result in run_bounded(jobs(), 2):
+                self.assertLessEqual(len(created) - len(results), 2)
+                results.append(result)
+            return results
+
+        self.assertEqual(sorted(asyncio.run(run())), list(range(10)))
+
+    def test_run_blocking(self):
+        # The blocking functions run off the event loop, but what they record is kept on the job
+        def read():
+            describe_job(2.0)
+            return threading.get_ident()
+
+        def walk():
+            for number in range(5):
+                yield number, threading.get_ident()
+
+        async def double(number):
+            return number * 2
+
+        async def run():
+            with describing() as description:
+                thread = await run_blocking(read)
+            items = [item async for item in iter_blocking(walk())]
+            jobs = (double(number) async for number, _ in iter_blocking(walk()))
+            results = [result async for result in run_bounded(jobs, 2)]
+            return thread, description, items, results
+
+        thread, description, items, results = asyncio.run(run())
+        self.assertNotEqual(thread, threading.get_ident())
+        self.assertEqual(description, {'duration': 2.0})
+        self.assertEqual([number for number, _ in items], list(range(5)))
+        self.assertNotIn(threading.get_ident(), [thread for _, thread in items])
+        self.assertEqual(sorted(results), [0, 2, 4, 6, 8])
+
+    def test_engine_timeout(self):
+        async def convert(filename, destination):
+            await run_process_async(['sleep', '10'])
+
+        start = time.monotonic()
+        result = asyncio.run(Engine(timeout=0.2).convert(convert, 'a', 'out'))
+        self.assertTrue(result.failed)
+        self.assertIn('TimeoutExpired', result.error)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_engine_cancellation(self):
+        pid_file = self.directory / 'pid'
+
+        async def convert(filename, destination):
+            await run_process_async(shell('echo $$ > "{}"; exec sleep 10'.format(pid_file)))
+
+        async def run():
+            task = asyncio.ensure_future(Engine().convert(convert, 'a', 'out'))
+            while not pid_file.exists() or not pid_file.read_text().strip():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        pid = int(pid_file.read_text())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the encoder profiles.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import tempfile
+import unittest
+
+from anarky.profile import ARCHIVAL, get_profile, PREVIEW, PROFILE_FILE, ProfileSelector, STANDARD
+
+
+class ProfileTests(unittest.TestCase):
+    """
+    Tests for the encoder profiles.
+    """
+
+    def test_archival_arguments(self):
+        self.assertEqual(ARCHIVAL.flac_arguments(), ['-f', '-8', '-V'])
+        self.assertEqual(ARCHIVAL.lame_arguments(),
+                         ['-b', '320', '-q', '0', '--preset', 'insane', '--id3v2-only'])
+
+    def test_fast_arguments(self):
+        self.assertEqual(PREVIEW.flac_arguments(), ['-f', '-0'])
+        self.assertEqual(PREVIEW.lame_arguments(), ['-b', '128', '-q', '7', '--id3v2-only'])
+        self.assertEqual(STANDARD.lame_arguments(), ['-V', '2', '-q', '2', '--id3v2-only'])
+
+    def test_get_profile(self):
+        self.assertEqual(get_profile(' Preview\n'), PREVIEW)
+        with self.assertRaises(ValueError):
+            get_profile('lossy')
+
+    def test_selector(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = Path(temporary.name)
+        scratch = directory / 'scratch' / 'album'
+        scratch.mkdir(parents=True)
+        (directory / 'scratch' / PROFILE_FILE).write_text('preview\n')
+        song = scratch / 'song.wav'
+        master = directory / 'master.wav'
+
+        selector = ProfileSelector()
+        self.assertEqual(selector.select(str(song)), PREVIEW)
+        self.assertEqual(selector.select(str(master)), ARCHIVAL)
+        self.assertEqual(ProfileSelector(STANDARD).select(str(song)), STANDARD)
+
+    def test_selector_invalid_file(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = Path(temporary.name)
+        (directory / PROFILE_FILE).write_text('lossy')
+        with self.assertRaises(ValueError):
+            ProfileSelector().select(str(directory / 'song.wav'))
+
+
+if __name__ == '__main__':
+    unittest.main()
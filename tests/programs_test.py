@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the registry of external programs.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest import mock
+import os
+import stat
+import tempfile
+import unittest
+
+from anarky.enum.program import Program
+from anarky.programs import get_missing_programs, get_program, Registry, reset_programs
+
+LAME = '''#!/bin/sh
+echo "$0" >> "${0%/*}/calls"
+echo "LAME 64bits version 3.100"
+'''
+
+
+class ProgramsTests(unittest.TestCase):
+    """
+    Tests for the registry of external programs.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.lame = self.directory / 'lame'
+        self.lame.write_text(LAME)
+        self.lame.chmod(self.lame.stat().st_mode | stat.S_IEXEC)
+        self.calls = self.directory / 'calls'
+
+        environment = mock.patch.dict(os.environ, {'PATH': str(self.directory),
+                                                   'XDG_CACHE_HOME': str(self.directory)})
+        environment.start()
+        self.addCleanup(environment.stop)
+        reset_programs()
+        self.addCleanup(reset_programs)
+
+    def test_find(self):
+        tool = Registry(self.directory / 'programs.json').find('lame')
+        self.assertEqual(tool.path, str(self.lame.resolve()))
+        self.assertEqual(tool.version, 'LAME 64bits version 3.100')
+
+    def test_find_missing(self):
+        self.assertIsNone(Registry(self.directory / 'programs.json').find('flac'))
+
+    def test_find_once_per_process(self):
+        registry = Registry(self.directory / 'programs.json')
+        registry.find('lame')
+        registry.find('lame')
+        self.assertEqual(len(self.calls.read_text().splitlines()), 1)
+
+    def test_find_cached_on_disk(self):
+        Registry(self.directory / 'programs.json').find('lame')
+        tool = Registry(self.directory / 'programs.json').find('lame')
+        self.assertEqual(tool.version, 'LAME 64bits version 3.100')
+        self.assertEqual(len(self.calls.read_text().splitlines()), 1)
+
+    def test_find_invalidated_by_mtime(self):
+        Registry(self.directory / 'programs.json').find('lame')
+        mtime = self.lame.stat().st_mtime_ns + 10 ** 9
+        os.utime(str(self.lame), ns=(mtime, mtime))
+        Registry(self.directory / 'programs.json').find('lame')
+        self.assertEqual(len(self.calls.read_text().splitlines()), 2)
+
+    def test_get_program(self):
+        self.assertEqual(get_program(Program.LAME), str(self.lame.resolve()))
+        self.assertEqual(get_program(Program.FLAC), 'flac')
+
+    def test_get_missing_programs(self):
+        self.assertEqual(get_missing_programs([Program.FLAC, Program.LAME, Program.METAFLAC]),
+                         ['flac', 'metaflac'])
+
+
+if __name__ == '__main__':
+    unittest.main()
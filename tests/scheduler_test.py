@@ -0,0 +1,112 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the parallel scheduling of conversion jobs.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import tempfile
+import threading
+import time
+import unittest
+
+from anarky.manifest import Manifest
+from anarky.scheduler import Result, Scheduler, run_jobs
+
+
+def convert(filename, destination):
+    if filename.startswith('bad'):
+        raise ValueError('corrupt file')
+    return destination + '/' + filename
+
+
+class SchedulerTests(unittest.TestCase):
+    """
+    Tests for the parallel scheduling of conversion jobs.
+    """
+
+    def test_run_jobs(self):
+        results = run_jobs(convert, ['a', 'b', 'c'], 'out', jobs=2)
+        self.assertEqual(sorted(results), [Result('a', 'out/a'), Result('b', 'out/b'),
+                                           Result('c', 'out/c')])
+
+    def test_run_abandoned(self):
+        started = []
+
+        def slow(filename, destination):
+            started.append(filename)
+            time.sleep(0.05)
+            return filename
+
+        with Scheduler(1) as scheduler:
+            results = scheduler.run(slow, ['a', 'b', 'c', 'd'], 'out')
+            next(results)
+            results.close()
+        self.assertLess(len(started), 4)
+
+    def test_run_jobs_collects_failures(self):
+        results = {result.filename: result
+                   for result in run_jobs(convert, ['a', 'bad', 'c'], 'out')}
+        self.assertEqual(len(results), 3)
+        self.assertTrue(results['bad'].failed)
+        self.assertIn('corrupt file', results['bad'].error)
+        self.assertFalse(results['c'].failed)
+
+    def test_run_jobs_empty(self):
+        self.assertEqual(run_jobs(convert, [], 'out'), [])
+
+    def test_run_jobs_is_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def slow(filename, destination):
+            with lock:
+                running.append(filename)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(filename)
+
+        run_jobs(slow, [str(i) for i in range(20)], 'out', jobs=3)
+        self.assertLessEqual(max(peak), 3)
+
+    def test_scheduler_consumes_files_lazily(self):
+        consumed = []
+
+        def files():
+            for i in range(100):
+                consumed.append(i)
+                yield str(i)
+
+        with Scheduler(2) as scheduler:
+            results = scheduler.run(convert, files(), 'out')
+            next(results)
+            self.assertLess(len(consumed), 100)
+            self.assertEqual(len(list(results)), 99)
+
+    def test_run_jobs_skips_up_to_date_files(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        directory = Path(temporary.name)
+        source = directory / 'song.wav'
+        source.write_bytes(b'audio')
+
+        def copy(filename, destination):
+            output = Path(destination, 'song.flac')
+            output.write_bytes(Path(filename).read_bytes())
+            return output
+
+        manifest = Manifest(str(directory), 'wav2flac', '-f8V')
+        first = run_jobs(copy, [str(source)], str(directory), manifest=manifest)
+        second = run_jobs(copy, [str(source)], str(directory), manifest=manifest)
+        self.assertFalse(first[0].skipped)
+        self.assertTrue(second[0].skipped)
+        self.assertEqual(second[0].output, str(directory.resolve() / 'song.flac'))
+
+
+if __name__ == '__main__':
+    unittest.main()
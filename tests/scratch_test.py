@@ -0,0 +1,151 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the scratch space of the conversions.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from threading import Event, Thread
+from time import sleep
+import tempfile
+import unittest
+
+from anarky.audio.wav import PCM, WavFormat, WavWriter
+from anarky.scratch import estimate_scratch_size, LOCK_SUFFIX, parse_size, PREFIX, remove_stale, \
+    Scratch
+from anarky.utils import atomic_output, get_workspace
+
+
+class ScratchTests(unittest.TestCase):
+    """
+    Tests for the scratch space of the conversions.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.scratch = self.directory / 'scratch'
+        self.scratch.mkdir()
+        self.output = self.directory / 'output'
+        self.output.mkdir()
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512'), 512)
+        self.assertEqual(parse_size('2K'), 2048)
+        self.assertEqual(parse_size('1.5g'), 3 << 29)
+        self.assertEqual(parse_size('4MiB'), 4 << 20)
+        for value in ('', '0', '-1M', '2X'):
+            with self.assertRaises(ValueError):
+                parse_size(value)
+
+    def test_estimate_scratch_size(self):
+        wav_file = self.directory / 'song.wav'
+        with WavWriter(str(wav_file), WavFormat(PCM, 2, 44100, 16)) as writer:
+            writer.write(bytes(4000))
+        other = self.directory / 'song.flac'
+        other.write_bytes(b'not really a FLAC file')
+
+        self.assertEqual(estimate_scratch_size(str(wav_file)), 4000 + 4044)
+        self.assertEqual(estimate_scratch_size(str(other)), 44)
+        self.assertEqual(estimate_scratch_size(str(self.directory / 'missing.wav')), 0)
+
+    def test_track(self):
+        source = self.directory / 'song.wav'
+        source.write_bytes(b'audio')
+
+        def convert(filename: str, destination: str) -> Path:
+            output = Path(destination, 'song.mp3')
+            with atomic_output(str(output)) as partial:
+                self.assertIn(workspace, partial.parents)
+                partial.write_bytes(Path(filename).read_bytes())
+            return output
+
+        with Scratch(str(self.scratch), 1 << 20) as scratch:
+            workspace = scratch.root
+            output = scratch.track(convert)(str(source), str(self.output))
+            self.assertEqual(list(scratch.root.iterdir()), [])
+            self.assertEqual(scratch.used, 0)
+
+        self.assertIsNone(get_workspace())
+        self.assertEqual(output.read_bytes(), b'audio')
+        self.assertEqual(list(self.output.iterdir()), [output])
+        self.assertEqual(list(self.scratch.iterdir()), [])
+
+    def test_track_error(self):
+        def convert(filename: str, destination: str):
+            with atomic_output(str(Path(destination, 'song.mp3'))) as partial:
+                partial.write_bytes(b'half')
+                raise ValueError('encoder crashed')
+
+        with Scratch(str(self.scratch), 1 << 20) as scratch:
+            with self.assertRaises(ValueError):
+                scratch.track(convert, size=lambda filename: 10)('song.wav', str(self.output))
+            self.assertEqual(list(scratch.root.iterdir()), [])
+
+        self.assertEqual(list(self.output.iterdir()), [])
+
+    def test_reserve_backpressure(self):
+        started = Event()
+
+        def reserve():
+            with scratch.reserve(60):
+                started.set()
+
+        with Scratch(str(self.scratch), 100) as scratch:
+            with scratch.reserve(60):
+                thread = Thread(target=reserve)
+                thread.start()
+                self.assertFalse(started.wait(0.2))
+                self.assertEqual(scratch.waits, 1)
+            thread.join(5)
+            self.assertTrue(started.is_set())
+            self.assertEqual(scratch.peak, 60)
+
+            # A reservation larger than the budget runs alone
+            with scratch.reserve(1000):
+                self.assertEqual(scratch.used, 1000)
+
+    def test_reserve_in_order(self):
+        # A large reservation that waits isn't overtaken by the smaller ones that come after it
+        order = []
+
+        def reserve(size, name):
+            with scratch.reserve(size):
+                order.append(name)
+
+        with Scratch(str(self.scratch), 100) as scratch:
+            with scratch.reserve(60):
+                large = Thread(target=reserve, args=(80, 'large'))
+                large.start()
+                while scratch.waits < 1:
+                    sleep(0.01)
+                small = Thread(target=reserve, args=(30, 'small'))
+                small.start()
+                while scratch.waits < 2:
+                    sleep(0.01)
+                self.assertEqual(order, [])
+            large.join(5)
+            small.join(5)
+        self.assertEqual(order, ['large', 'small'])
+
+    def test_remove_stale(self):
+        # The lock files of these directories aren't held, so their owners don't exist
+        (self.scratch / '{}99999999-abc'.format(PREFIX)).mkdir()
+        (self.scratch / '{}1-def'.format(PREFIX)).mkdir()
+        (self.scratch / '{}1-def{}'.format(PREFIX, LOCK_SUFFIX)).write_bytes(b'')
+        (self.scratch / 'other').mkdir()
+        with Scratch(str(self.scratch)) as scratch:
+            self.assertEqual(sorted(path.name for path in self.scratch.iterdir()),
+                             sorted(['other', scratch.root.name, scratch.root.name + LOCK_SUFFIX]))
+
+            # The directory of a scratch space that is still open is kept, whatever its name
+            self.assertEqual(remove_stale(str(self.scratch)), 0)
+            self.assertTrue(scratch.root.is_dir())
+        self.assertEqual(sorted(path.name for path in self.scratch.iterdir()), ['other'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the timing and throughput statistics.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import asyncio
+import json
+import tempfile
+import unittest
+
+from anarky.process import Engine, run_process
+from anarky.scheduler import run_jobs
+from anarky.stats import percentile, Recorder, set_recorder, stage, summarize
+
+
+class StatsTests(unittest.TestCase):
+    """
+    Tests for the timing and throughput statistics.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.source = self.directory / 'song.wav'
+        self.source.write_bytes(bytes(1000))
+        self.addCleanup(set_recorder, None)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_summarize(self):
+        self.assertEqual(summarize([3, 1, 2]), {'total': 6, 'p50': 2, 'p90': 3, 'p99': 3, 'max': 3})
+
+    def test_stage_disabled(self):
+        with stage('encode', str(self.source)) as current:
+            current.output = str(self.source)
+
+    def test_stage(self):
+        recorder = Recorder(lambda filename: 10.0)
+        set_recorder(recorder)
+        output = self.directory / 'song.flac'
+        with stage('encode', str(self.source)) as current:
+            run_process(['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done; '
+                                     'head -c 400 /dev/zero > "{}"'.format(output)])
+            current.output = output
+
+        (record,) = recorder.records
+        self.assertEqual(record.stage, 'encode')
+        self.assertEqual(record.bytes_in, 1000)
+        self.assertEqual(record.bytes_out, 400)
+        self.assertEqual(record.duration, 10.0)
+        self.assertGreater(record.cpu, 0)
+        self.assertAlmostEqual(record.realtime_factor, 10.0 / record.wall)
+
+    def test_report(self):
+        recorder = Recorder(lambda filename: 5.0)
+        set_recorder(recorder)
+
+        def convert(filename, destination):
+            with stage('encode', filename):
+                return filename
+
+        run_jobs(convert, [str(self.source)] * 3, str(self.directory), jobs=2)
+        report_file = self.directory / 'stats.json'
+        recorder.save(str(report_file), jobs=2)
+        report = json.loads(report_file.read_text())
+
+        self.assertEqual(report['batch']['files'], 3)
+        self.assertEqual(report['batch']['jobs'], 2)
+        self.assertEqual(report['batch']['audio_seconds'], 15.0)
+        self.assertEqual(sorted(report['stages']), ['encode', 'job'])
+        self.assertEqual(report['stages']['encode']['count'], 3)
+        self.assertEqual(report['stages']['job']['bytes_out'], 3000)
+        self.assertIn('p90', report['stages']['job']['wall'])
+        self.assertEqual(len(report['slowest']), 3)
+        self.assertEqual(len(report['files']), 6)
+
+    def test_report_async(self):
+        recorder = Recorder(lambda filename: 5.0)
+        set_recorder(recorder)
+
+        async def convert(filename, destination):
+            with stage('encode', filename, cpu=False):
+                return filename
+
+        async def run():
+            return [result async for result in Engine(jobs=2).run(convert, [str(self.source)] * 2,
+                                                                  str(self.directory))]
+
+        asyncio.run(run())
+        report = recorder.report(jobs=2)
+        self.assertEqual(report['batch']['files'], 2)
+        self.assertEqual(report['stages']['encode']['count'], 2)
+        self.assertEqual(report['stages']['job']['cpu']['total'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
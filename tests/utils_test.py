@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the utilities.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from time import monotonic, sleep
+import tempfile
+import unittest
+
+from anarky.utils import atomic_output, get_partial_path, prefetch, walk_files
+
+
+class UtilsTests(unittest.TestCase):
+    """
+    Tests for the utilities.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.output = self.directory / 'song.mp3'
+
+    def test_partial_path(self):
+        self.assertEqual(get_partial_path(str(self.output)),
+                         self.directory / '.song.anarky-partial.mp3')
+
+    def test_atomic_output(self):
+        with atomic_output(str(self.output)) as partial:
+            partial.write_bytes(b'mp3')
+            self.assertFalse(self.output.exists())
+
+        self.assertEqual(self.output.read_bytes(), b'mp3')
+        self.assertFalse(partial.exists())
+
+    def test_atomic_output_failure(self):
+        self.output.write_bytes(b'previous')
+        with self.assertRaises(KeyboardInterrupt):
+            with atomic_output(str(self.output)) as partial:
+                partial.write_bytes(b'half')
+                raise KeyboardInterrupt
+
+        self.assertEqual(self.output.read_bytes(), b'previous')
+        self.assertFalse(partial.exists())
+
+    def test_walk_files_skips_partial_files(self):
+        (self.directory / 'song.wav').write_bytes(b'wav')
+        get_partial_path(str(self.directory / 'other.wav')).write_bytes(b'wav')
+        self.assertEqual([Path(path).name for path in walk_files(str(self.directory), ['.wav'])],
+                         ['song.wav'])
+
+    def test_prefetch(self):
+        # The items are produced ahead of the consumer, but no more than the given number
+        produced = []
+
+        def items():
+            for item in range(10):
+                produced.append(item)
+                yield item
+
+        result = prefetch(items(), 2)
+        self.assertEqual(next(result), 0)
+        deadline = monotonic() + 5
+        while len(produced) < 4 and monotonic() < deadline:
+            sleep(0.01)
+        sleep(0.05)
+        self.assertEqual(len(produced), 4)
+        self.assertEqual(list(result), list(range(1, 10)))
+
+    def test_prefetch_error(self):
+        def items():
+            yield 'first'
+            raise OSError('unreadable')
+
+        result = prefetch(items())
+        self.assertEqual(next(result), 'first')
+        with self.assertRaises(OSError):
+            next(result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the validation of file types.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+import tempfile
+import unittest
+
+from anarky.enum.audio_file import AudioFile
+from anarky.validation import detect_file_type, detect_file_types, is_flac_file, is_mp3_file, \
+    is_wav_file
+
+ID3 = b'ID3\x04\x00\x00\x00\x00\x00\x05' + bytes(5)
+MPEG_FRAME = b'\xff\xfb\x90\x64' + bytes(60)
+
+
+class ValidationTests(unittest.TestCase):
+    """
+    Tests for the validation of file types.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+
+    def file(self, name, content):
+        filename = self.directory / name
+        filename.write_bytes(content)
+        return str(filename)
+
+    def test_detect_file_type_wav(self):
+        filename = self.file('song.wav', b'RIFF\x24\x00\x00\x00WAVEfmt ')
+        self.assertIs(detect_file_type(filename), AudioFile.WAV)
+        self.assertTrue(is_wav_file(filename))
+        self.assertFalse(is_flac_file(filename))
+
+    def test_detect_file_type_flac(self):
+        filename = self.file('song.flac', b'fLaC\x00\x00\x00\x22')
+        self.assertIs(detect_file_type(filename), AudioFile.FLAC)
+        self.assertTrue(is_flac_file(filename))
+
+    def test_detect_file_type_flac_id3(self):
+        filename = self.file('song.flac', ID3 + b'fLaC\x00\x00\x00\x22')
+        self.assertIs(detect_file_type(filename), AudioFile.FLAC)
+
+    def test_detect_file_type_flac_id3_footer(self):
+        footer = b'ID3\x04\x00\x10\x00\x00\x00\x05' + bytes(5) + b'3DI\x04\x00\x10' + bytes(4)
+        self.assertIs(detect_file_type(self.file('song.flac', footer + b'fLaC\x00\x00\x00\x22')),
+                      AudioFile.FLAC)
+
+    def test_detect_file_type_mp3(self):
+        self.assertTrue(is_mp3_file(self.file('song.mp3', MPEG_FRAME)))
+        self.assertTrue(is_mp3_file(self.file('tagged.mp3', ID3 + MPEG_FRAME)))
+
+    def test_detect_file_type_invalid_frame(self):
+        # Bitrate index 15 is reserved
+        self.assertIsNone(detect_file_type(self.file('song.mp3', b'\xff\xfb\xf0\x64')))
+
+    def test_detect_file_type_unknown(self):
+        self.assertIsNone(detect_file_type(self.file('cover.jpg', b'\xff\xd8\xff\xe0')))
+        self.assertIsNone(detect_file_type(self.file('empty', b'')))
+
+    def test_detect_file_type_missing(self):
+        self.assertIsNone(detect_file_type(str(self.directory / 'missing.wav')))
+        self.assertIsNone(detect_file_type(None))
+
+    def test_detect_file_types(self):
+        filenames = [self.file('{}.wav'.format(i), b'RIFF\x00\x00\x00\x00WAVE') for i in range(10)]
+        filenames.append(self.file('song.flac', b'fLaC'))
+        result = list(detect_file_types(filenames))
+        self.assertEqual([name for name, _ in result], filenames)
+        self.assertEqual([kind for _, kind in result], [AudioFile.WAV] * 10 + [AudioFile.FLAC])
+
+
+if __name__ == '__main__':
+    unittest.main()
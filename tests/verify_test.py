@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the bulk integrity verification of FLAC audio files.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest import mock
+import tempfile
+import unittest
+
+from anarky.verify import flac_test_command, VerificationIndex, Verifier
+from tests.helpers import flac_file, install_programs
+
+
+class VerifyTests(unittest.TestCase):
+    """
+    Tests for the bulk integrity verification of FLAC audio files.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.log = self.directory / 'log'
+        install_programs(self, self.directory, 'flac', FAKE_FLAC_LOG=str(self.log))
+
+        self.files = []
+        for name, audio in (('one.flac', b'audio'), ('two.flac', b'corrupt audio')):
+            filename = self.directory / name
+            flac_file(filename, audio=audio)
+            self.files.append(str(filename))
+        self.damaged = self.directory / 'three.flac'
+        self.damaged.write_bytes(b'fLaC\x00')
+        self.files.append(str(self.damaged))
+
+    def verify(self, **options) -> dict:
+        verifier = Verifier(VerificationIndex(str(self.directory / 'index.json')), 2, **options)
+        return {Path(result.filename).name: result for result in verifier.verify(self.files)}
+
+    def decoded(self) -> list:
+        decoded = sorted(Path(line).name for line in self.log.read_text().splitlines())
+        self.log.write_text('')
+        return decoded
+
+    def test_verify(self):
+        results = self.verify()
+        self.assertFalse(results['one.flac'].failed)
+        self.assertIn('MD5 signature mismatch', results['two.flac'].error)
+        self.assertIn('ValueError', results['three.flac'].error)
+        self.assertFalse(any(result.skipped for result in results.values()))
+        # The damaged header is found without starting the decoder
+        self.assertEqual(self.decoded(), ['one.flac', 'two.flac'])
+
+    def test_verify_index(self):
+        self.verify()
+        self.decoded()
+
+        # Only the changed file is tested again; the others keep the outcome of the last sweep
+        flac_file(self.files[0], audio=b'new audio')
+        results = self.verify()
+        self.assertEqual(self.decoded(), ['one.flac'])
+        self.assertFalse(results['one.flac'].skipped)
+        self.assertTrue(results['two.flac'].skipped)
+        self.assertTrue(results['two.flac'].failed)
+        self.assertTrue(results['three.flac'].failed)
+
+        self.verify(force=True)
+        self.assertEqual(self.decoded(), ['one.flac', 'two.flac'])
+
+    def test_verify_cached_first(self):
+        self.verify()
+        flac_file(self.files[0], audio=b'new audio')
+
+        # The outcomes from the index don't wait for the file being tested
+        verifier = Verifier(VerificationIndex(str(self.directory / 'index.json')), 1)
+        self.assertEqual([Path(result.filename).name for result in verifier.verify(self.files)],
+                         ['two.flac', 'three.flac', 'one.flac'])
+
+    def test_verify_checkpoint(self):
+        index_file = self.directory / 'index.json'
+        with mock.patch('anarky.verify.CHECKPOINT_FILES', 1):
+            results = Verifier(VerificationIndex(str(index_file)), 1).verify(self.files)
+            next(results)
+            self.assertTrue(index_file.is_file())
+            results.close()
+
+    def test_verify_rewritten(self):
+        # The file is rewritten after it was listed but before the decoder reads it
+        def command(filename):
+            flac_file(filename, audio=b'rewritten audio')
+            return flac_test_command(filename)
+
+        index = VerificationIndex(str(self.directory / 'index.json'))
+        list(Verifier(index, 1, command=command).verify(self.files[:1]))
+        self.assertIsNone(index.get(self.files[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+
+"""
+Tests for the continuous conversion of the audio files dropped into a set of directories.
+
+Author: Eduardo Ferreira
+License: MIT (see LICENSE for details)
+"""
+
+from pathlib import Path
+from unittest import mock
+import tempfile
+import time
+import unittest
+
+from anarky.api import Converter
+from anarky.watch import Debouncer, Inotify, open_monitor, Poller, Watcher
+from tests.helpers import Clock, install_programs
+
+
+def inotify_available() -> bool:
+    try:
+        Inotify([]).close()
+    except OSError:
+        return False
+    return True
+
+
+class WatchTests(unittest.TestCase):
+    """
+    Tests for the continuous conversion of the audio files dropped into a set of directories.
+    """
+
+    def setUp(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        self.directory = Path(temporary.name)
+        self.input = self.directory / 'input'
+        self.input.mkdir()
+
+    def test_debouncer(self):
+        clock = Clock()
+        debouncer = Debouncer(2.0, clock)
+        filename = self.input / 'song.wav'
+        filename.write_bytes(b'aud')
+        debouncer.touch(str(filename))
+
+        clock.now = 1.5
+        filename.write_bytes(b'audio')
+        self.assertEqual(debouncer.ready(), [])
+        clock.now = 3.0
+        self.assertEqual(debouncer.ready(), [])
+        clock.now = 3.5
+        self.assertEqual(debouncer.ready(), [str(filename)])
+        self.assertEqual(len(debouncer), 0)
+
+        # Files removed before they settle are forgotten
+        debouncer.touch(str(self.input / 'missing.wav'))
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(len(debouncer), 0)
+
+    def test_poller(self):
+        (self.input / 'old.wav').write_bytes(b'audio')
+        with Poller([str(self.input)], ['.wav'], interval=0.01) as poller:
+            self.assertEqual(poller.changes(1.0), [str(self.input / 'old.wav')])
+
+            (self.input / 'album').mkdir()
+            (self.input / 'album' / 'new.wav').write_bytes(b'audio')
+            (self.input / 'album' / 'cover.jpg').write_bytes(b'image')
+            self.assertEqual(poller.changes(1.0), [str(self.input / 'album' / 'new.wav')])
+            self.assertEqual(poller.changes(1.0), [])
+
+    @unittest.skipUnless(inotify_available(), 'inotify is not available')
+    def test_inotify(self):
+        (self.input / 'old.wav').write_bytes(b'audio')
+        with Inotify([str(self.input)], ['.wav']) as monitor:
+            self.assertEqual(monitor.changes(0.0), [str(self.input / 'old.wav')])
+
+            (self.input / 'new.wav').write_bytes(b'audio')
+            (self.input / '.new.anarky-partial.wav').write_bytes(b'audio')
+            (self.input / 'album').mkdir()
+            (self.input / 'album' / 'track.wav').write_bytes(b'audio')
+            changed = set()
+            for _ in range(10):
+                changed.update(monitor.changes(0.1))
+
+        self.assertEqual(changed, {str(self.input / 'new.wav'),
+                                   str(self.input / 'album' / 'track.wav')})
+
+    def test_open_monitor(self):
+        self.assertIsInstance(open_monitor([str(self.input)], polling=True), Poller)
+        with mock.patch('anarky.watch.Inotify', side_effect=OSError('unavailable')):
+            self.assertIsInstance(open_monitor([str(self.input)]), Poller)
+
+    def test_watcher(self):
+        install_programs(self, self.directory, 'flac')
+
+        # The output directory is inside the watched directory, but its files are never picked up
+        output = self.input / 'output'
+        output.mkdir()
+        (self.input / 'song.wav').write_bytes(b'audio')
+        results = []
+        converter = Converter('wav2flac', str(output), jobs=2, incremental=True)
+        with Watcher(converter, [str(self.input)], settle=0.05, interval=0.01, polling=True,
+                     callback=results.append) as watcher:
+            deadline = time.monotonic() + 10
+            while not results and time.monotonic() < deadline:
+                watcher.step(0.01)
+
+        self.assertEqual([result.output for result in results], [str(output / 'song.flac')])
+        self.assertEqual((output / 'song.flac').read_bytes(), b'audio')
+        self.assertTrue(converter.manifest.is_up_to_date(str(self.input / 'song.wav')))
+
+
+if __name__ == '__main__':
+    unittest.main()